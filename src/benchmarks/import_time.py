@@ -0,0 +1,102 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+benchmark_path = "results/benchmarks/"
+
+entry_points = ["src.evaluation.ekg_contexts_eval", "src.evaluation.ocel_contexts_eval",
+                "src.evaluation.view_service", "src.evaluation.batch_runner", "src.benchmarks.run_benchmarks",
+                "src.strategies.sharded_scoring", "src.util.posting_index"]
+
+# loaded only on the code paths that need them: log loading (ocpa, pm4py), Neo4j queries (neo4j, promg), scoring
+# (pandas, tqdm) and plotting (matplotlib, seaborn)
+heavy_modules = ["ocpa", "pm4py", "networkx", "scipy", "graphviz", "promg", "neo4j", "pandas", "tqdm", "matplotlib",
+                 "seaborn"]
+
+
+def measure_import(module):
+    """
+    Imports the module in a fresh interpreter.
+
+        @return: dict of the cumulative import time of the module (from -X importtime) and the heavy modules it loads
+    """
+    code = f"import sys, json, {module}; print(json.dumps([m for m in {heavy_modules!r} if m in sys.modules]))"
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                             check=True)
+    import_us = None
+    for line in process.stderr.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            import_us = int(fields[1])
+    return {"import_ms": import_us / 1000 if import_us is not None else None,
+            "heavy_modules": json.loads(process.stdout.strip().splitlines()[-1])}
+
+
+def measure_help(module, repeat=3):
+    """
+    @return: minimum wall time in ms of python -m module --help, incl. the interpreter startup
+    """
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", module, "--help"], capture_output=True, check=True)
+        latencies.append(time.perf_counter() - start)
+    return min(latencies) * 1000
+
+
+def run_import_benchmark(modules, repeat=3):
+    results = {"python": sys.version, "entry_points": {}}
+    for module in modules:
+        result = measure_import(module)
+        result["help_ms"] = measure_help(module, repeat)
+        results["entry_points"][module] = result
+        logging.info(f"{module}: import {result['import_ms']:.1f} ms, --help {result['help_ms']:.1f} ms, "
+                     f"heavy modules {result['heavy_modules']}")
+    return results
+
+
+def check(results, max_help_ms=None):
+    """
+    @return: list of violations: entry points loading heavy modules on import or exceeding the --help time budget
+    """
+    violations = []
+    for module, result in results["entry_points"].items():
+        if len(result["heavy_modules"]) > 0:
+            violations.append(f"{module} imports {', '.join(result['heavy_modules'])}")
+        if max_help_ms is not None and result["help_ms"] > max_help_ms:
+            violations.append(f"{module} --help takes {result['help_ms']:.1f} ms (budget {max_help_ms} ms)")
+    return violations
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure the import time and --help latency of the entry points.")
+    parser.add_argument("--modules", type=str, default=",".join(entry_points), help="Modules to measure")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed --help runs (minimum is kept)")
+    parser.add_argument("--max_help_ms", type=float, default=None, help="Time budget of --help per entry point")
+    return parser.parse_args()
+
+
+def main(args):
+    results = run_import_benchmark(args.modules.split(","), args.repeat)
+
+    os.makedirs(benchmark_path, exist_ok=True)
+    result_file = benchmark_path + datetime.now().strftime("%Y%m%d-%H%M%S") + "_import_time.json"
+    with open(result_file, "w") as f:
+        json.dump(results, f, indent=4)
+    logging.info("Wrote import time results to " + result_file)
+
+    violations = check(results, args.max_help_ms)
+    for violation in violations:
+        logging.info("Slow startup: " + violation)
+    return 1 if len(violations) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,276 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import duckdb
+import numpy as np
+
+import src.strategies.db_selection as db_selection
+from src.benchmarks.synthetic_logs import generate_synthetic_events, write_synthetic_ocel, \
+    generate_synthetic_view_db, generate_synthetic_view_info, generate_synthetic_rel, write_synthetic_ekg
+from src.util.graph_source import LocalGraphSource
+from src.util.metrics import peak_rss_bytes
+from src.util.similarity_measures import matching_similarities
+from src.util.view_tables import migrate_view_database
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+benchmark_path = "results/benchmarks/"
+# tracked baseline of the small scale, regenerate with --update_baseline on the reference machine
+baseline_file = "src/benchmarks/baseline.json"
+
+scales = {
+    "small": {"num_events": 1000, "num_object_types": 3, "objects_per_type": 50, "objects_per_event": 2,
+              "rel_density": 0.1, "num_views": 4, "num_proc_execs": 200, "edges_per_proc_exec": 10,
+              "num_edges": 2000},
+    "medium": {"num_events": 10000, "num_object_types": 4, "objects_per_type": 300, "objects_per_event": 3,
+               "rel_density": 0.1, "num_views": 6, "num_proc_execs": 2000, "edges_per_proc_exec": 20,
+               "num_edges": 20000},
+    "large": {"num_events": 100000, "num_object_types": 6, "objects_per_type": 2000, "objects_per_event": 3,
+              "rel_density": 0.1, "num_views": 8, "num_proc_execs": 20000, "edges_per_proc_exec": 30,
+              "num_edges": 200000}
+}
+
+
+def measure(function, repeat=1):
+    """
+    Runs function repeat times for the latency (minimum) and once more under tracemalloc for the peak
+    Python memory. The function gets the run number and returns the number of processed items.
+
+        @return: dict of latency, throughput (items per second) and peak memory
+    """
+    latencies = []
+    num_items = 0
+    for run in range(repeat):
+        start = time.perf_counter()
+        num_items = function(run)
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function(repeat)
+    _, peak_python_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latency = min(latencies)
+    return {
+        "latency_s": latency,
+        "throughput_per_s": num_items / latency if latency > 0 else None,
+        "num_items": num_items,
+        "peak_python_bytes": peak_python_bytes,
+        "peak_rss_bytes": peak_rss_bytes()
+    }
+
+
+def bench_leading_type_index(scale, work_dir, repeat=1):
+    """
+    Index construction by leading type on a synthetic OCEL, throughput in events per second.
+    """
+    from src.view_generation.ocel_leading_type import compute_indices_by_leading_type_db
+
+    events, objects = generate_synthetic_events(scale["num_events"], scale["num_object_types"],
+                                                scale["objects_per_type"], scale["objects_per_event"])
+    file_name = write_synthetic_ocel(os.path.join(work_dir, "synthetic.jsonocel"), events, objects)
+    object_types = sorted(set(objects.values()))
+
+    def run(i):
+        compute_indices_by_leading_type_db(file_name, os.path.join(work_dir, f"leading_type_{i}.duckdb"),
+                                           object_types=object_types)
+        return len(events)
+
+    return measure(run, repeat)
+
+
+def bench_ekg_leading_type_index(scale, work_dir, repeat=1):
+    """
+    Index construction by leading type on a synthetic EKG export answered in-process, throughput in events per
+    second.
+    """
+    from src.view_generation.ekg_leading_type import compute_indices_by_ekg_leading_types
+
+    events, objects = generate_synthetic_events(scale["num_events"], scale["num_object_types"],
+                                                scale["objects_per_type"], scale["objects_per_event"])
+    rel = generate_synthetic_rel(events, objects, scale["rel_density"])
+    graph_source = LocalGraphSource(write_synthetic_ekg(os.path.join(work_dir, "ekg"), events, objects, rel))
+    os.makedirs("data/temp", exist_ok=True)
+
+    def run(i):
+        compute_indices_by_ekg_leading_types(graph_source, os.path.join(work_dir, f"ekg_leading_type_{i}.duckdb"))
+        return len(events)
+
+    return measure(run, repeat)
+
+
+def bench_pairwise_scores(scale, work_dir, repeat=1):
+    """
+    Pairwise scoring of synthetic views in DuckDB, throughput in context table rows per second.
+    """
+    db_name = os.path.join(work_dir, "views.duckdb")
+    view_names = generate_synthetic_view_db(db_name, scale["num_views"], scale["num_proc_execs"],
+                                            scale["edges_per_proc_exec"], scale["num_edges"])
+    with duckdb.connect(db_name) as con:
+        num_rows = sum(con.sql("SELECT COUNT(*) FROM " + view_name).fetchone()[0] for view_name in view_names)
+
+    def run(i):
+        db_selection.DBSubsetSelector(db_name, object_types=view_names, file_id=f"benchmark_{i}")
+        return num_rows
+
+    results_path = db_selection.results_path
+    db_selection.results_path = work_dir + "/"
+    try:
+        return measure(run, repeat)
+    finally:
+        db_selection.results_path = results_path
+
+
+def bench_pairwise_scores_schema(scale, work_dir, repeat=1):
+    """
+    Pairwise scoring by the join on procExec keys (without variants) of a view database with String procExec
+    columns, before and after its migration to the typed context tables of the current schema version. Latency
+    and throughput (context table rows per second) after the migration, with the latency before and the speedup.
+    """
+    db_name = os.path.join(work_dir, "legacy_views.duckdb")
+    view_names = generate_synthetic_view_db(db_name, scale["num_views"], scale["num_proc_execs"],
+                                            scale["edges_per_proc_exec"], scale["num_edges"], legacy_schema=True)
+    with duckdb.connect(db_name) as con:
+        num_rows = sum(con.sql("SELECT COUNT(*) FROM " + view_name).fetchone()[0] for view_name in view_names)
+
+    def run(i):
+        db_selection.DBSubsetSelector(db_name, object_types=view_names, file_id=f"benchmark_{i}",
+                                      duckdb_config={"variants": False})
+        return num_rows
+
+    results_path = db_selection.results_path
+    db_selection.results_path = work_dir + "/"
+    try:
+        legacy = measure(run, repeat)
+        start = time.perf_counter()
+        with duckdb.connect(db_name) as con:
+            migrate_view_database(con)
+        migration_time = time.perf_counter() - start
+        result = measure(run, repeat)
+    finally:
+        db_selection.results_path = results_path
+    result["legacy_latency_s"] = legacy["latency_s"]
+    result["speedup"] = legacy["latency_s"] / result["latency_s"] if result["latency_s"] > 0 else None
+    result["migration_s"] = migration_time
+    return result
+
+
+def bench_matching_similarities(scale, work_dir, repeat=1):
+    """
+    In-memory matching similarity of two synthetic views, throughput in contexts per second.
+    """
+    num_proc_execs = min(scale["num_proc_execs"], 5000)
+    view_info = generate_synthetic_view_info(num_proc_execs, scale["edges_per_proc_exec"], scale["num_edges"], seed=1)
+    other_view_info = generate_synthetic_view_info(num_proc_execs, scale["edges_per_proc_exec"], scale["num_edges"],
+                                                   seed=2)
+
+    def run(i):
+        matching_similarities(view_info, other_view_info)
+        return 2 * num_proc_execs
+
+    return measure(run, repeat)
+
+
+benchmarks = {
+    "leading_type_index": bench_leading_type_index,
+    "ekg_leading_type_index": bench_ekg_leading_type_index,
+    "pairwise_scores": bench_pairwise_scores,
+    "pairwise_scores_schema": bench_pairwise_scores_schema,
+    "matching_similarities": bench_matching_similarities
+}
+
+
+def run_benchmarks(scale_names, benchmark_names, repeat=1):
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "duckdb": duckdb.__version__,
+            "numpy": np.__version__
+        },
+        "benchmarks": {}
+    }
+    for benchmark_name in benchmark_names:
+        results["benchmarks"][benchmark_name] = {}
+        for scale_name in scale_names:
+            logging.info(f"Running benchmark {benchmark_name} at scale {scale_name}")
+            with tempfile.TemporaryDirectory() as work_dir:
+                try:
+                    result = benchmarks[benchmark_name](scales[scale_name], work_dir, repeat)
+                except ImportError as e:
+                    logging.info(f"Skipping benchmark {benchmark_name}: {e}")
+                    result = {"skipped": str(e)}
+            results["benchmarks"][benchmark_name][scale_name] = result
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25):
+    """
+    Compares latencies to a baseline.
+
+        @param tolerance: allowed relative latency increase
+        @return: list of regressions (benchmark, scale, baseline latency, latency)
+    """
+    regressions = []
+    for benchmark_name, results_per_scale in results["benchmarks"].items():
+        for scale_name, result in results_per_scale.items():
+            baseline_result = baseline.get("benchmarks", {}).get(benchmark_name, {}).get(scale_name)
+            if baseline_result is None or "latency_s" not in baseline_result or "latency_s" not in result:
+                if "latency_s" in result:
+                    logging.warning(f"No baseline latency for {benchmark_name} ({scale_name}), not compared")
+                continue
+            if result["latency_s"] > baseline_result["latency_s"] * (1 + tolerance):
+                regressions.append((benchmark_name, scale_name, baseline_result["latency_s"], result["latency_s"]))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run benchmarks on synthetic logs and views.")
+    parser.add_argument("--scales", type=str, default="small,medium", help="Scales to run (small, medium, large)")
+    parser.add_argument("--benchmarks", type=str, default=",".join(benchmarks.keys()), help="Benchmarks to run")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of timed runs per benchmark (minimum is kept)")
+    parser.add_argument("--baseline", type=str, default=baseline_file, help="Baseline file to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative latency increase")
+    parser.add_argument("--update_baseline", action="store_true", help="Store the results as new baseline")
+    return parser.parse_args()
+
+
+def main(args):
+    results = run_benchmarks(args.scales.split(","), args.benchmarks.split(","), args.repeat)
+
+    os.makedirs(benchmark_path, exist_ok=True)
+    result_file = benchmark_path + datetime.now().strftime("%Y%m%d-%H%M%S") + "_benchmarks.json"
+    with open(result_file, "w") as f:
+        json.dump(results, f, indent=4)
+    logging.info("Wrote benchmark results to " + result_file)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+        logging.info("Updated baseline " + args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        logging.error(f"Baseline {args.baseline} not found, run with --update_baseline to create it")
+        return 1
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    for benchmark_name, scale_name, baseline_latency, latency in regressions:
+        logging.info(f"Regression in {benchmark_name} ({scale_name}): {latency:.3f}s vs. baseline "
+                     f"{baseline_latency:.3f}s")
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
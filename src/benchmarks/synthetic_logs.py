@@ -0,0 +1,153 @@
+import csv
+import itertools
+import json
+import os
+from datetime import datetime, timedelta
+
+import duckdb
+import numpy as np
+
+from src.util.view_tables import create_context_table, create_viewmeta_table, insert_view_meta
+
+
+def generate_synthetic_events(num_events=1000, num_object_types=3, objects_per_type=50, objects_per_event=2,
+                              num_activities=10, seed=42):
+    """
+    Generates object-centric events with random activities, increasing timestamps and objects of random types.
+
+        @param objects_per_event: average number of objects per event (at least one)
+        @return: tuple (events, objects): events as list of (event id, activity, timestamp, list of object ids),
+                 objects as dict of object id to object type
+    """
+    rng = np.random.default_rng(seed)
+    object_types = [f"type{t}" for t in range(num_object_types)]
+    objects = {f"{object_type}_{o}": object_type for object_type in object_types for o in range(objects_per_type)}
+    object_ids = list(objects.keys())
+
+    start = datetime(2020, 1, 1)
+    events = []
+    for e in range(num_events):
+        num_objects = max(1, min(len(object_ids), int(rng.poisson(objects_per_event - 1)) + 1))
+        event_objects = [object_ids[o] for o in rng.choice(len(object_ids), size=num_objects, replace=False)]
+        activity = f"act{int(rng.integers(num_activities))}"
+        events.append((e, activity, start + timedelta(minutes=e), event_objects))
+    return events, objects
+
+
+def generate_synthetic_rel(events, objects, rel_density=0.0, seed=42):
+    """
+    Derives REL edges between objects sharing an event (as done for the EKGs beforehand, see ekg_queries) and adds
+    rel_density * number of objects random REL edges.
+
+        @return: sorted list of object id pairs (o1, o2) with o1 < o2
+    """
+    rng = np.random.default_rng(seed)
+    rel = set()
+    for _, _, _, event_objects in events:
+        for o1, o2 in itertools.combinations(sorted(event_objects), 2):
+            rel.add((o1, o2))
+
+    object_ids = sorted(objects.keys())
+    for _ in range(int(rel_density * len(object_ids))):
+        o1, o2 = rng.choice(len(object_ids), size=2, replace=False)
+        rel.add(tuple(sorted((object_ids[o1], object_ids[o2]))))
+    return sorted(rel)
+
+
+def write_synthetic_ocel(file_name, events, objects):
+    """
+    Writes events and objects as OCEL 1.0 JSON (.jsonocel), as read by ocpa.
+    """
+    ocel = {
+        "ocel:global-event": {"ocel:activity": "__INVALID__"},
+        "ocel:global-object": {"ocel:type": "__INVALID__"},
+        "ocel:global-log": {
+            "ocel:attribute-names": [],
+            "ocel:object-types": sorted(set(objects.values())),
+            "ocel:version": "1.0",
+            "ocel:ordering": "timestamp"
+        },
+        "ocel:events": {
+            str(event_id): {
+                "ocel:activity": activity,
+                "ocel:timestamp": timestamp.isoformat(),
+                "ocel:omap": event_objects,
+                "ocel:vmap": {}
+            } for event_id, activity, timestamp, event_objects in events
+        },
+        "ocel:objects": {object_id: {"ocel:type": object_type, "ocel:ovmap": {}}
+                         for object_id, object_type in objects.items()}
+    }
+    with open(file_name, "w") as f:
+        json.dump(ocel, f)
+    return file_name
+
+
+def write_synthetic_ekg(directory, events, objects, rel):
+    """
+    Writes an EKG export as CSV files: entities.csv (id, type), events.csv (id, timestamp, activity),
+    corr.csv (event, entity) and rel.csv (entity1, entity2).
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "entities.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "type"])
+        writer.writerows(sorted(objects.items()))
+    with open(os.path.join(directory, "events.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "timestamp", "activity"])
+        writer.writerows([(event_id, timestamp.isoformat(), activity) for event_id, activity, timestamp, _ in events])
+    with open(os.path.join(directory, "corr.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["event", "entity"])
+        writer.writerows([(event_id, o) for event_id, _, _, event_objects in events for o in event_objects])
+    with open(os.path.join(directory, "rel.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["entity1", "entity2"])
+        writer.writerows(rel)
+    return directory
+
+
+def generate_synthetic_view_db(db_name, num_views=4, num_proc_execs=500, edges_per_proc_exec=10, num_edges=5000,
+                               seed=42, legacy_schema=False):
+    """
+    Generates a view database with random context tables (edge, procExec) and their viewmeta entries,
+    as written by the index construction.
+
+        @param legacy_schema: store procExec as String, as the EKG generators did before schema version 2
+
+        @return: list of view (context table) names
+    """
+    rng = np.random.default_rng(seed)
+    view_names = [f"view{v}" for v in range(num_views)]
+    with duckdb.connect(db_name) as con:
+        create_viewmeta_table(con)
+        if legacy_schema:
+            con.sql("DROP TABLE viewschema")
+        for view_idx, view_name in enumerate(view_names):
+            if legacy_schema:
+                con.sql("DROP TABLE IF EXISTS " + view_name)
+                con.sql("CREATE TABLE " + view_name + "(edge INTEGER, procExec String)")
+            else:
+                create_context_table(con, view_name)
+            proc_execs = np.repeat(np.arange(num_proc_execs), edges_per_proc_exec)
+            edges = rng.integers(num_edges, size=len(proc_execs))
+            rows = np.unique(np.stack([edges, proc_execs], axis=1), axis=0)
+            con.executemany("INSERT INTO " + view_name + " VALUES (?, ?)", rows.tolist())
+            insert_view_meta(con, view_idx, view_name, num_proc_execs, num_proc_execs * (edges_per_proc_exec + 1))
+            con.sql("CREATE INDEX IF NOT EXISTS " + view_name + "_edge_index ON " + view_name + "(edge)")
+        con.commit()
+    return view_names
+
+
+def generate_synthetic_view_info(num_proc_execs=500, edges_per_proc_exec=10, num_edges=5000, seed=42):
+    """
+    Generates a view as used by matching_similarities: dict of edge to list of contexts containing it,
+    and the number of contexts.
+    """
+    rng = np.random.default_rng(seed)
+    view = {}
+    for context in range(num_proc_execs):
+        for edge in set(rng.integers(num_edges, size=edges_per_proc_exec).tolist()):
+            view.setdefault(edge, []).append(context)
+    return view, num_proc_execs
@@ -0,0 +1,184 @@
+import argparse
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from datetime import datetime
+
+import duckdb
+import yaml
+
+from src.evaluation import ekg_contexts_eval, ocel_contexts_eval
+from src.evaluation.dataset_registry import ekg_graph_source, get_dataset, load_registry, log_window, registry_file
+from src.evaluation.weight_sweep import parse_weights
+from src.util import memory_governor
+from src.util.score_store import ScoreStore
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+results_path = "results/"
+db_path = "data/temp/"
+
+# settings of the DuckDB database instance, shared by all jobs of a dataset, the other keys of the duckdb section of
+# a config are scoring options (nearest, variants, shards, in_memory, ...)
+instance_settings = ["memory_limit", "threads"]
+
+
+def load_batch(file_name):
+    """
+    Loads a batch file (YAML) with the datasets of the registry to compute views for and the configs to run for each
+    of them:
+        registry: registry file (default: src/evaluation/datasets.yaml)
+        datasets: [order, bpi14]
+        duckdb: {memory_limit: 8GB, threads: 4}         settings of the DuckDB instance of each dataset
+        configs:
+          - {selection_method: mmr, weights: "0:1:0.1"}
+          - {selection_method: enumeration, k: 3, duckdb: {nearest: true}}
+
+        @return: dict with registry, datasets, duckdb and configs (default: one config with the default arguments)
+    """
+    with open(file_name) as f:
+        batch = yaml.safe_load(f) or {}
+    batch.setdefault("registry", registry_file)
+    batch.setdefault("duckdb", {})
+    batch["configs"] = batch.get("configs") or [{}]
+    if len(batch.get("datasets") or []) == 0:
+        raise ValueError(f"No datasets in batch file {file_name}")
+    for config in batch["configs"]:
+        settings = [key for key in (config.get("duckdb") or {}) if key in instance_settings]
+        if len(settings) > 0:
+            raise ValueError(f"{', '.join(settings)} of a config: set them in the duckdb section of the batch, the "
+                             f"jobs of a dataset share one DuckDB instance")
+    return batch
+
+
+def schedule(num_datasets, num_cores=None, threads=None):
+    """
+    Distributes the cores onto one worker process per dataset, up to the number of cores.
+
+        @param threads: DuckDB threads per worker (default: the cores divided among the workers)
+        @return: tuple (number of worker processes, DuckDB threads per worker)
+    """
+    num_cores = (os.cpu_count() or 1) if num_cores is None else num_cores
+    num_workers = max(1, min(num_datasets, num_cores if threads is None else max(1, num_cores // threads)))
+    return num_workers, threads if threads is not None else max(1, num_cores // num_workers)
+
+
+def index_input(entry, config):
+    """
+    @return: key of the input the relation indices of a config are computed from: the time window of the log of an
+             OCEL dataset (which the filter_date of a config changes), None for the graph of an EKG dataset
+    """
+    if entry["kind"] == "ocel":
+        return log_window(entry, end_time=config.get("filter_date"))
+    return None
+
+
+def run_config(entry, config, db_name, db_dir, score_store, reuse_indices, result_file_id, graph_source=None):
+    duckdb_config = dict(config.get("duckdb") or {})
+    args = {"weight": config.get("weight", 0.5), "selection_method": config.get("selection_method", "mmr"),
+            "weights": parse_weights(config.get("weights")), "duckdb_config": duckdb_config,
+            "score_store": score_store, "reuse_indices": reuse_indices, "result_file_id": result_file_id}
+    if entry["kind"] == "ocel":
+        ocel_contexts_eval.compute_views_for_dataset(entry, k=config.get("k"), filter_date=config.get("filter_date"),
+                                                     db_dir=db_dir, **args)
+    else:
+        ekg_contexts_eval.compute_views(graph_source, db_name, contextdef=entry["contextdef"], k=config.get("k"),
+                                        short_name=entry["short_name"], relation=entry["relation"], **args)
+
+
+def run_dataset_jobs(entry, configs, db_dir, instance_config, batch_id):
+    """
+    Runs all configs of a dataset in one process. The relation indices are computed by the first config and reused
+    by the following ones on the same input (see index_input), the (filtered) log or graph is loaded once, one DuckDB
+    database instance with the settings of the batch stays open for all configs and the pairwise scores are shared
+    through one ScoreStore.
+
+        @param instance_config: dict of memory_limit and threads of the DuckDB instance
+        @return: list of dicts with the outcome of each config
+    """
+    db_name = os.path.join(db_dir, entry["db_name"])
+    memory_governor.set_memory_budget(instance_config.get("memory_limit"))
+    graph_source = ekg_graph_source(entry) if entry["kind"] == "ekg" else None
+    outcomes = []
+    # connections of the jobs join this instance, so they must not set instance settings of their own
+    with duckdb.connect(db_name) as con:
+        for name, value in instance_config.items():
+            con.execute(f"SET {name} = '{value}'")
+        score_store = ScoreStore(db_name)
+        # input of the relation indices in the database, all configs write them to the same database
+        indices_built = False
+        indices_input = None
+        for i, config in enumerate(configs):
+            result_file_id = f"{batch_id}_{entry['name']}_{i}"
+            start_time = time.perf_counter()
+            outcome = {"dataset": entry["name"], "config": config, "result_file_id": result_file_id}
+            config_input = index_input(entry, config)
+            reuse_indices = indices_built and config_input == indices_input
+            try:
+                run_config(entry, config, db_name, db_dir, score_store, reuse_indices, result_file_id, graph_source)
+                indices_built, indices_input = True, config_input
+            except Exception as e:
+                # a failed build can leave the indices of the database incomplete
+                indices_built = indices_built and reuse_indices
+                logging.exception(f"Config {i} of {entry['name']} failed")
+                outcome["error"] = "".join(traceback.format_exception_only(type(e), e)).strip()
+            outcome["seconds"] = time.perf_counter() - start_time
+            outcomes.append(outcome)
+    if graph_source is not None and hasattr(graph_source, "close"):
+        graph_source.close()
+    return outcomes
+
+
+def run_batch(batch, db_dir=db_path, num_cores=None):
+    """
+    Runs the configs of a batch for all of its datasets, one worker process per dataset on the available cores.
+
+        @return: list of the outcomes of all jobs
+    """
+    registry = load_registry(batch["registry"])
+    entries = [get_dataset(registry, name) for name in batch["datasets"]]
+    num_workers, threads = schedule(len(entries), num_cores, batch["duckdb"].get("threads"))
+    instance_config = dict(batch["duckdb"], threads=threads)
+    batch_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+    os.makedirs(db_dir, exist_ok=True)
+    logging.info(f"Running {len(batch['configs'])} configs for {len(entries)} datasets on {num_workers} workers "
+                 f"with {threads} DuckDB threads each")
+
+    if num_workers == 1:
+        return [outcome for entry in entries
+                for outcome in run_dataset_jobs(entry, batch["configs"], db_dir, instance_config, batch_id)]
+    outcomes = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers,
+                                                mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(run_dataset_jobs, entry, batch["configs"], db_dir, instance_config, batch_id)
+                   for entry in entries]
+        for future in futures:
+            outcomes.extend(future.result())
+    return outcomes
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compute views for several datasets and configs in one batch.")
+    parser.add_argument("batch", type=str, help="Batch file (YAML) with datasets and configs")
+    parser.add_argument("--dbpath", type=str, default=db_path, help="Directory of the view databases")
+    parser.add_argument("--cores", type=int, default=None, help="Number of cores to use (default: all)")
+    return parser.parse_args()
+
+
+def main(args):
+    outcomes = run_batch(load_batch(args.batch), args.dbpath, args.cores)
+    os.makedirs(results_path, exist_ok=True)
+    result_file = results_path + datetime.now().strftime("%Y%m%d-%H%M%S") + "_batch.json"
+    with open(result_file, "w") as f:
+        json.dump(outcomes, f, indent=4)
+    logging.info("Wrote batch outcomes to " + result_file)
+    return 1 if any("error" in outcome for outcome in outcomes) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+
+import yaml
+
+from src.util.filter_log import filter_ocel_json, load_ocel_from_file
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+registry_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "datasets.yaml")
+
+dataset_kinds = ["ocel", "ekg"]
+required_keys = {"ocel": ["file", "object_types"], "ekg": []}
+
+# filtered logs written by this process, (file, start time, end time) -> filtered file
+prepared_logs = {}
+
+
+def load_registry(file_name=registry_file):
+    """
+    Loads the dataset registry, a YAML file with the entries of the datasets under datasets.
+
+        @return: dict of dataset name to entry (dict), with short_name and db_name defaulting to the dataset name
+    """
+    with open(file_name) as f:
+        content = yaml.safe_load(f) or {}
+    registry = {}
+    for name, entry in (content.get("datasets") or {}).items():
+        entry = dict(entry)
+        entry.setdefault("kind", "ocel")
+        if entry["kind"] not in dataset_kinds:
+            raise ValueError(f"Dataset {name}: unknown kind {entry['kind']} (expected one of {dataset_kinds})")
+        missing = [key for key in required_keys[entry["kind"]] if key not in entry]
+        if entry["kind"] == "ekg" and "graph" not in entry and "neo4j" not in entry:
+            missing.append("graph or neo4j")
+        if len(missing) > 0:
+            raise ValueError(f"Dataset {name}: missing {', '.join(missing)}")
+        entry.setdefault("file_type", "json")
+        entry.setdefault("contextdef", "interact")
+        entry.setdefault("relation", "total")
+        entry.setdefault("short_name", name)
+        entry.setdefault("db_name", f"{entry['kind']}_views_{name}.duckdb")
+        entry["name"] = name
+        registry[name] = entry
+    return registry
+
+
+def get_dataset(registry, name):
+    if name not in registry:
+        raise ValueError(f"Unknown dataset {name} (known: {', '.join(sorted(registry))})")
+    return registry[name]
+
+
+def log_window(entry, end_time=None):
+    """
+    @param end_time: end of the time window, overriding the one of the filter of the entry
+    @return: tuple (file, start time, end time) of the log of an OCEL dataset, the times None without filter
+    """
+    if "filter" not in entry:
+        return entry["file"], None, None
+    return entry["file"], entry["filter"].get("start_time"), \
+        end_time if end_time is not None else entry["filter"].get("end_time")
+
+
+def prepare_log(entry, end_time=None):
+    """
+    Returns the file to load the log of an OCEL dataset from. A log with a time filter is filtered once per process
+    and end time, later entries of the same log reuse the filtered file.
+
+        @param end_time: end of the time window, overriding the one of the filter of the entry
+    """
+    if "filter" not in entry:
+        return entry["file"]
+    key = log_window(entry, end_time)
+    _, start_time, end_time = key
+    if key not in prepared_logs:
+        filtered_file = entry.get("filtered_file", entry["file"] + ".filtered.jsonocel").format(
+            start_date=(start_time or "").split("T")[0], end_date=(end_time or "").split("T")[0])
+        filtered_data = filter_ocel_json(load_ocel_from_file(entry["file"]), start_time=start_time,
+                                         end_time=end_time)
+        with open(filtered_file, "w") as f:
+            f.write(json.dumps(filtered_data, indent=4))
+        logging.info(f"Filtered {entry['file']} to {filtered_file}")
+        prepared_logs[key] = filtered_file
+    return prepared_logs[key]
+
+
+def ekg_graph_source(entry, max_in_flight=None):
+    """
+    @return: graph source of an EKG dataset, queried with the property names of the entry
+    """
+    from src.util.cypher_queries import CypherQueryLibrary
+    from src.util.graph_source import AsyncNeo4jGraphSource, LocalGraphSource, Neo4jGraphSource
+    if "graph" in entry:
+        return LocalGraphSource(entry["graph"])
+    neo4j = dict(entry["neo4j"])
+    queries = CypherQueryLibrary(**entry["properties"]) if "properties" in entry else None
+    if max_in_flight is not None and entry["contextdef"] == "leading":
+        return AsyncNeo4jGraphSource(max_in_flight=max_in_flight, queries=queries, **neo4j)
+    return Neo4jGraphSource(queries=queries, **neo4j)
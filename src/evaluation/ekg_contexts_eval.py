@@ -5,9 +5,17 @@ import json
 import time
 import logging
 import duckdb
-from promg import DatabaseConnection
 
+from src.evaluation.dataset_registry import ekg_graph_source, load_registry, registry_file
+from src.evaluation.weight_sweep import parse_weights, write_weight_sweep_results
+from src.strategies.db_enumeration_selection import DBEnumerationSubsetSelector
 from src.strategies.db_mmr_selection import DBRankingSubsetSelector
+from src.util import memory_governor, metrics
+from src.util.coverage import add_coverage_to_results, selection_coverage
+from src.util.metrics import JsonMetricsCollector
+from src.util.graph_source import LocalGraphSource, Neo4jGraphSource, AsyncNeo4jGraphSource
+from src.util.score_store import ScoreStore
+from src.util.view_tables import get_view_stats, migrate_view_database
 from src.view_generation.ekg_interacting_entities import compute_indices_by_interacting_entities
 from src.view_generation.ekg_leading_type import compute_indices_by_ekg_leading_types
 
@@ -15,6 +23,7 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 
 relation_indices_precomputed = False
 counts_precomputed = False
+use_score_store = True
 remove_db = False
 db_path = "data/temp/"
 
@@ -22,52 +31,127 @@ def main(args):
     duckdb_config = {}
     if args.maxmem is not None:
         duckdb_config["memory_limit"] = args.maxmem
+    # the Python side of the pipeline is throttled against the same budget
+    memory_governor.set_memory_budget(args.maxmem)
     if args.threads is not None:
         duckdb_config["threads"] = args.threads
+    if args.nearest:
+        duckdb_config["nearest"] = True
+    if args.shards is not None:
+        # sharded pairwise scoring, see ShardedPairScorer
+        duckdb_config["shards"] = args.shards
+        duckdb_config["shard_workers"] = args.shard_workers
+        duckdb_config["shard_queue"] = args.shard_queue
+        duckdb_config["shard_timeout"] = args.shard_timeout
     if args.dbpath is not None:
         global db_path
         db_path = args.dbpath
 
-    short_name = args.dataset
-    temp_db_path = f"data/temp/ekg_{args.contextdef}_{short_name}.duckdb"
-
-    neo4j_connection = DatabaseConnection(
-        db_name="neo4j",
-        uri="bolt://localhost:7687",
-        user="neo4j",
-        password="12341234")
-
-    compute_views(neo4j_connection, temp_db_path, contextdef=args.contextdef, weight=args.weight, selection_method=args.selection_method,
-                  duckdb_config=duckdb_config, short_name=short_name)
+    registry = load_registry(args.registry)
+    entry = registry.get(args.dataset) if args.graph is None else None
+    if entry is not None and entry["kind"] != "ekg":
+        raise ValueError(f"Dataset {args.dataset} is an OCEL dataset, run it with ocel_contexts_eval")
+    contextdef = args.contextdef or (entry["contextdef"] if entry is not None else "interact")
+    relation = args.relation or (entry["relation"] if entry is not None else "total")
+    short_name = entry["short_name"] if entry is not None else args.dataset
+    if entry is not None:
+        temp_db_path = os.path.join(db_path, entry["db_name"])
+    else:
+        temp_db_path = f"data/temp/ekg_{contextdef}{'_partial' if relation == 'partial' else ''}_{short_name}.duckdb"
+
+    if entry is not None:
+        # graph and property names of the registry entry
+        graph_source = ekg_graph_source(dict(entry, contextdef=contextdef), max_in_flight=args.max_in_flight)
+    elif args.graph is not None:
+        graph_source = LocalGraphSource(args.graph)
+    elif args.max_in_flight is not None and contextdef == "leading":
+        graph_source = AsyncNeo4jGraphSource(
+            database="neo4j",
+            uri="bolt://localhost:7687",
+            user="neo4j",
+            password="12341234",
+            max_in_flight=args.max_in_flight)
+    else:
+        graph_source = Neo4jGraphSource(
+            database="neo4j",
+            uri="bolt://localhost:7687",
+            user="neo4j",
+            password="12341234")
+
+    compute_views(graph_source, temp_db_path, contextdef=contextdef, weight=args.weight, selection_method=args.selection_method,
+                  duckdb_config=duckdb_config, short_name=short_name, weights=parse_weights(args.weights), k=args.k,
+                  resume=args.resume, relation=relation)
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Compute views for different datasets.")
     parser.add_argument("--dataset", type=str, required=True,
-                        help="Dataset to compute views for (bpi17, bpi14, order)")
+                        help="EKG dataset of the registry (e.g. bpi14-ekg, order-ekg), or name of the dataset in the "
+                             "graph given by --graph or in Neo4j with the property names configured in ekg_queries")
+    parser.add_argument("--registry", type=str, default=registry_file, help="Dataset registry (YAML)")
     parser.add_argument("--k", type=int, default=4, help="Number of views to select")
     parser.add_argument("--weight", type=float, default=0.5, help="Weight for MMR selection")
+    parser.add_argument("--weights", type=str, default=None,
+                        help="Weight sweep for MMR selection, reusing one score matrix (e.g. 0.1,0.5,0.9 or 0:1:0.1)")
     parser.add_argument("--selection_method", type=str, default="mmr", help="Selection method (mmr or enumeration)")
-    parser.add_argument("--maxmem", type=str, default=None, help="Max available memory for DuckDB (must be KB, MB, GB)")
+    parser.add_argument("--maxmem", type=str, default=None, help="Max available memory for DuckDB and budget of the memory governor (must be KB, MB, GB)")
     parser.add_argument("--threads", type=int, default=None, help="Max number of threads for DuckDB")
+    parser.add_argument("--nearest", action="store_true",
+                        help="Score by nearest-context search over edge set indices instead of the pairwise join")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="Number of edge-hash shards per context table for sharded pairwise scoring")
+    parser.add_argument("--shard_workers", type=int, default=None,
+                        help="Number of local shard worker processes (default: one per shard up to the CPU count, "
+                             "0 if only remote workers serve the shard queue)")
+    parser.add_argument("--shard_queue", type=str, default=None,
+                        help="Shard queue directory on a file system shared with remote workers, which are started "
+                             "with python -m src.strategies.sharded_scoring <shard_queue>")
+    parser.add_argument("--shard_timeout", type=float, default=None,
+                        help="Seconds to wait for the shard tasks of a pair before failing (default: wait as long as "
+                             "the local workers are alive)")
     parser.add_argument("--dbpath", type=str, default=None, help="Path for temporary database files")
-    parser.add_argument("--contextdef", type=str, default="interact", help="Method for defining context (interact or leading)")
+    parser.add_argument("--contextdef", type=str, default=None,
+                        help="Method for defining context (interact or leading, default: registry entry or interact)")
+    parser.add_argument("--relation", type=str, default=None,
+                        help="Relation between the events of a process execution: total (time order of all events) "
+                             "or partial (DF edges of the single objects), default: registry entry or total")
+    parser.add_argument("--graph", type=str, default=None,
+                        help="Directory of an EKG export (entities, events, corr, rel as CSV or Parquet) to compute "
+                             "the contexts on in-process instead of querying Neo4j")
+    parser.add_argument("--max_in_flight", type=int, default=None,
+                        help="Number of concurrent Neo4j context queries (async driver, leading type contexts only)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume an interrupted index construction from the checkpoint in the database file "
+                             "(interacting entities contexts only)")
     return parser.parse_args()
 
-def compute_views(neo4j_connection, temp_db_path, contextdef="interact", weight=0.5, selection_method="mmr",
-              duckdb_config=None, short_name=""):
+def compute_views(graph_source, temp_db_path, contextdef="interact", weight=0.5, selection_method="mmr",
+              duckdb_config=None, short_name="", weights=None, k=None, metrics_hook=None, resume=False,
+              score_store=None, reuse_indices=False, result_file_id=None, relation="total"):
+    """
+    @param relation: relation between the events of a process execution, total or partial (see relation_kinds)
+    @param score_store: ScoreStore shared with other runs on the same view database
+    @param reuse_indices: use the relation indices already in the view database instead of computing them
+    @param result_file_id: prefix of the result files (default: current time, dataset and method)
+    """
     start_time = time.time()
+    # collects per-context and per-pair metrics of all stages, written next to the results
+    metrics_hook = metrics.set_metrics_hook(metrics_hook if metrics_hook is not None else JsonMetricsCollector())
 
-    result_file_id = datetime.now().strftime("%Y%m%d-%H%M%S") + "_" + short_name + "_" + selection_method + "_" + "interacting_entities"
-    if not relation_indices_precomputed:
+    if result_file_id is None:
+        result_file_id = datetime.now().strftime("%Y%m%d-%H%M%S") + "_" + short_name + "_" + selection_method + "_" + "interacting_entities"
+    if not relation_indices_precomputed and not reuse_indices:
         if contextdef == "leading":
-            compute_indices_by_ekg_leading_types(neo4j_connection=neo4j_connection, temp_db_path=temp_db_path,
-                                                                duckdb_config=duckdb_config, short_name=short_name)
+            compute_indices_by_ekg_leading_types(graph_source=graph_source, temp_db_path=temp_db_path,
+                                                                duckdb_config=duckdb_config, short_name=short_name,
+                                                                relation=relation)
         else:
-            compute_indices_by_interacting_entities(neo4j_connection=neo4j_connection, temp_db_path=temp_db_path,
-                                                    duckdb_config=duckdb_config)
+            compute_indices_by_interacting_entities(graph_source=graph_source, temp_db_path=temp_db_path,
+                                                    duckdb_config=duckdb_config, resume=resume, relation=relation)
 
     with duckdb.connect(temp_db_path) as duckdb_conn:
+        # reused view databases of older versions keep procExec as String
+        migrate_view_database(duckdb_conn)
         view_infos = duckdb_conn.sql("SELECT objecttype FROM viewmeta ORDER BY viewIdx ASC").fetchall()
         context_defs = [view_info[0] for view_info in view_infos]
 
@@ -75,17 +159,34 @@ def compute_views(neo4j_connection, temp_db_path, contextdef="interact", weight=
     index_computation_time = indexing_end_time - start_time
     logging.info("Done computing indices by " + contextdef + " in " + str(index_computation_time) + " seconds")
 
-    logging.info("Initializing ranking subset selector - computing scores")
-    k = len(context_defs)
-    ranking_subset_selection = DBRankingSubsetSelector(db_name=temp_db_path, object_types=context_defs,
-                                                       counts_precomputed=counts_precomputed, weight=weight,
-                                                       duckdb_config=duckdb_config, file_id=result_file_id)
+    if score_store is None and use_score_store:
+        score_store = ScoreStore(temp_db_path)
+    if selection_method == "enumeration":
+        logging.info("Initializing enumeration subset selector - computing scores")
+        k = len(context_defs) if k is None else min(k, len(context_defs))
+        ranking_subset_selection = DBEnumerationSubsetSelector(db_name=temp_db_path, object_types=context_defs,
+                                                               counts_precomputed=counts_precomputed, weight=weight,
+                                                               duckdb_config=duckdb_config, file_id=result_file_id,
+                                                               score_store=score_store)
+        weights = None
+    else:
+        logging.info("Initializing ranking subset selector - computing scores")
+        # greedy selection of all views contains the selection for every k as prefix
+        k = len(context_defs)
+        ranking_subset_selection = DBRankingSubsetSelector(db_name=temp_db_path, object_types=context_defs,
+                                                           counts_precomputed=counts_precomputed, weight=weight,
+                                                           duckdb_config=duckdb_config, file_id=result_file_id,
+                                                           score_store=score_store)
     score_comp_end_time = time.time()
     score_computation_time = score_comp_end_time - indexing_end_time
     logging.info("Done scoring views in " + str(score_computation_time) + " seconds")
 
-    logging.info("Selecting views by mmr")
-    selected_views = ranking_subset_selection.select_view_indices(k)
+    if weights is not None:
+        logging.info("Selecting views by mmr for weights " + str(weights))
+        selected_per_weight = ranking_subset_selection.select_view_indices_for_weights(weights, k)
+    else:
+        logging.info("Selecting views by " + selection_method)
+        selected_views = ranking_subset_selection.select_view_indices(k)
     view_selection_time = time.time() - score_comp_end_time
     logging.info("Done selecting views in " + str(view_selection_time) + " seconds")
     run_time = time.time() - start_time
@@ -96,11 +197,20 @@ def compute_views(neo4j_connection, temp_db_path, contextdef="interact", weight=
         "view_selection_time": view_selection_time,
         "run_time": run_time
     }
+    for stage, stage_time in recorded_times.items():
+        metrics.timing("stage", stage_time, stage=stage)
+
+    if weights is not None:
+        write_weight_sweep_results(selected_per_weight, context_defs, result_file_id, "neo4j_" + short_name,
+                                   f"{selection_method}-interacting_entities", runtimes=recorded_times)
+    else:
+        print(selected_views)
+        logging.info("Computing stats for evaluation")
+        get_stats_for_views(selected_views, context_defs, temp_db_path, start_time,
+                            f"{selection_method}-interacting_entities", result_file_id, runtimes=recorded_times, short_name=short_name)
 
-    print(selected_views)
-    logging.info("Computing stats for evaluation")
-    get_stats_for_views(selected_views, context_defs, temp_db_path, start_time,
-                        f"{selection_method}-interacting_entities", result_file_id, runtimes=recorded_times, short_name=short_name)
+    metrics.timing("stage", time.time() - start_time - run_time, stage="stats_time")
+    metrics_hook.emit("results/" + result_file_id + "_metrics.json")
 
     if remove_db:
         # Check if the file exists
@@ -120,8 +230,10 @@ def compute_views(neo4j_connection, temp_db_path, contextdef="interact", weight=
 
 def get_stats_for_views(selected_views, object_types, db_file, start_time, method, file_id, runtimes=None, short_name=""):
     with duckdb.connect(db_file) as con:
-        view_infos = con.sql("SELECT * FROM viewmeta").fetchdf()
-        print(view_infos)
+        # views by object type, view indices need not be the positions in object_types
+        view_stats = {stats["objecttype"]: stats for stats in get_view_stats(con).values()}
+        coverage = selection_coverage(con, [view_stats[object_types[res_tuple[0]]]["viewIdx"]
+                                            for res_tuple in selected_views])
 
     path = "results"
     result_json = {"filename": "neo4j_" + short_name, "method": method, "selected_views": []}
@@ -134,38 +246,29 @@ def get_stats_for_views(selected_views, object_types, db_file, start_time, metho
         results_for_k = {}
         obj_t = object_types[obj_idx]
 
-        with duckdb.connect(db_file) as con:
-            num_edges = con.sql("SELECT COUNT(DISTINCT edge) FROM " + obj_t).fetchone()[0]
-
         # compute selected views and gather statistics: number of process executions, number of variants,
         # number of events covered, etc.
         # check how difference in weight affects the selected views
         # check how difference between selected views changes with increasing k -> convergence?
         # check how different methods compare to each other
 
-        # TODO: add level of detail: average number of unique activities per trace (Murillas et al., 2019)
-        # TODO: add covered events covered
+        stats = view_stats[obj_t]
         results_for_k["object_type"] = obj_t
-        results_for_k["num_process_executions"] = int(
-            view_infos.loc[view_infos['viewIdx'] == obj_idx, 'numProcExecs'].values[0])
+        results_for_k["num_process_executions"] = int(stats["numProcExecs"])
         # number of traces present in an event log (Murillas et al., 2019)
-        results_for_k["num_edges"] = num_edges
+        results_for_k["num_edges"] = stats["numEdges"]
         results_for_k["score info"] = score_info
         results_for_k["time"] = finish_time - start_time
         results_for_k["position"] = k
 
-        #events_covered = set()
-        #for edge in indices_leading_types[obj_idx]["relation_index"]:
-        #    events_covered.add(edge[0])
-        #    events_covered.add(edge[1])
-
-        #results_for_k["num_of_events_covered"] = len(events_covered)
-        results_for_k["num_of_events_total-dupl"] = int(
-            view_infos.loc[view_infos['viewIdx'] == obj_idx, 'numEvents'].values[0])  # incl duplicates events
-        results_for_k["avg_num_of_events_per_trace"] = float(
-            view_infos.loc[view_infos['viewIdx'] == obj_idx, 'AvgNumEventsPerTrace'].values[0])
+        results_for_k["num_of_events_covered"] = stats["numEventsCovered"]
+        results_for_k["num_of_events_total-dupl"] = int(stats["numEvents"])  # incl duplicates events
+        results_for_k["avg_num_of_events_per_trace"] = float(stats["AvgNumEventsPerTrace"])
         # Average number of events (AE) (Eq. 3): average number of events per trace (Murillas et al., 2019)
+        results_for_k["avg_num_of_unique_activities_per_trace"] = stats["AvgNumUniqueActivitiesPerTrace"]
+        # level of detail: average number of unique activities per trace (Murillas et al., 2019)
         result_json["selected_views"].append(results_for_k)
+    add_coverage_to_results(result_json, coverage)
 
 
     with open(f"{path}/{file_id}_results.json", "w") as f:
@@ -7,14 +7,22 @@ import logging
 
 import duckdb
 
+from src.evaluation.dataset_registry import get_dataset, load_registry, prepare_log, registry_file
+from src.evaluation.weight_sweep import parse_weights, write_weight_sweep_results
+from src.strategies.db_enumeration_selection import DBEnumerationSubsetSelector
 from src.strategies.db_mmr_selection import DBRankingSubsetSelector
-from src.util.filter_log import filter_ocel_json, load_ocel_from_file
+from src.util import memory_governor, metrics
+from src.util.coverage import add_coverage_to_results, selection_coverage
+from src.util.metrics import JsonMetricsCollector
+from src.util.score_store import ScoreStore
+from src.util.view_tables import get_view_stats
 from src.view_generation.ocel_leading_type import compute_indices_by_leading_type_db
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 
 relation_indices_precomputed = False
 counts_precomputed = False
+use_score_store = True
 remove_db = False
 db_path = "data/temp/"
 
@@ -22,65 +30,111 @@ def main(args):
     duckdb_config = {}
     if args.maxmem is not None:
         duckdb_config["memory_limit"] = args.maxmem
+    # the Python side of the pipeline is throttled against the same budget
+    memory_governor.set_memory_budget(args.maxmem)
     if args.threads is not None:
         duckdb_config["threads"] = args.threads
+    if args.nearest:
+        duckdb_config["nearest"] = True
+    if args.shards is not None:
+        # sharded pairwise scoring, see ShardedPairScorer
+        duckdb_config["shards"] = args.shards
+        duckdb_config["shard_workers"] = args.shard_workers
+        duckdb_config["shard_queue"] = args.shard_queue
+        duckdb_config["shard_timeout"] = args.shard_timeout
     if args.dbpath is not None:
         global db_path
         db_path = args.dbpath
 
-    if args.dataset == "bpi17":
-        compute_views_for_bpi17(duckdb_config=duckdb_config)
-    elif args.dataset == "bpi14":
-        if args.filterdate:
-            compute_views_for_bpi14(duckdb_config=duckdb_config, filter_date=args.filterdate)
-        else:
-            compute_views_for_bpi14(duckdb_config=duckdb_config)
-    elif args.dataset == "order":
-        compute_views_for_order_management(duckdb_config=duckdb_config)
-    elif args.dataset.startswith("bpi15"):
-        lognr = args.dataset.split("-")[1]
-        compute_views_for_bpi15(duckdb_config=duckdb_config, lognr = lognr)
-    else:
-        print("Unknown dataset")
+    selection_args = {"weights": parse_weights(args.weights), "selection_method": args.selection_method}
+    if args.selection_method == "enumeration":
+        # greedy selection of all views contains the selection for every k, the optimal subset is computed per k
+        selection_args["k"] = args.k
+
+    entry = get_dataset(load_registry(args.registry), args.dataset)
+    if entry["kind"] != "ocel":
+        raise ValueError(f"Dataset {args.dataset} is an EKG dataset, run it with ekg_contexts_eval")
+    compute_views_for_dataset(entry, duckdb_config=duckdb_config, filter_date=args.filterdate, **selection_args)
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Compute views for different datasets.")
     parser.add_argument("--dataset", type=str, required=True,
-                        help="Dataset to compute views for (bpi17, bpi14, order)")
+                        help="Dataset of the registry to compute views for (e.g. bpi17, bpi14, order, bpi15-1)")
+    parser.add_argument("--registry", type=str, default=registry_file, help="Dataset registry (YAML)")
     parser.add_argument("--k", type=int, default=4, help="Number of views to select")
     parser.add_argument("--weight", type=float, default=0.5, help="Weight for MMR selection")
+    parser.add_argument("--weights", type=str, default=None,
+                        help="Weight sweep for MMR selection, reusing one score matrix (e.g. 0.1,0.5,0.9 or 0:1:0.1)")
     parser.add_argument("--selection_method", type=str, default="mmr", help="Selection method (mmr or enumeration)")
-    parser.add_argument("--maxmem", type=str, default=None, help="Max available memory for DuckDB (must be KB, MB, GB)")
+    parser.add_argument("--maxmem", type=str, default=None, help="Max available memory for DuckDB and budget of the memory governor (must be KB, MB, GB)")
     parser.add_argument("--threads", type=int, default=None, help="Max number of threads for DuckDB")
-    parser.add_argument("--dbpath", type=str, default=None, help="Max available memory for DuckDB (must be KB, MB, GB)")
-    parser.add_argument("--filterdate", type=str, default="2013-09-30T23:59:59", help="Filter date for BPI14")
+    parser.add_argument("--nearest", action="store_true",
+                        help="Score by nearest-context search over edge set indices instead of the pairwise join")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="Number of edge-hash shards per context table for sharded pairwise scoring")
+    parser.add_argument("--shard_workers", type=int, default=None,
+                        help="Number of local shard worker processes (default: one per shard up to the CPU count, "
+                             "0 if only remote workers serve the shard queue)")
+    parser.add_argument("--shard_queue", type=str, default=None,
+                        help="Shard queue directory on a file system shared with remote workers, which are started "
+                             "with python -m src.strategies.sharded_scoring <shard_queue>")
+    parser.add_argument("--shard_timeout", type=float, default=None,
+                        help="Seconds to wait for the shard tasks of a pair before failing (default: wait as long as "
+                             "the local workers are alive)")
+    parser.add_argument("--dbpath", type=str, default=None, help="Max available memory for DuckDB and budget of the memory governor (must be KB, MB, GB)")
+    parser.add_argument("--filterdate", type=str, default=None,
+                        help="End of the time window of datasets with a filter (default: end time of the registry entry)")
     return parser.parse_args()
 
 
 # TODO: check that event ids are taken from the event log / assigned deterministically
 def compute_views(filename, object_types, db_name, file_type="json", k=2, weight=0.5, selection_method="mmr",
-              duckdb_config=None, short_name=""):
+              duckdb_config=None, short_name="", weights=None, metrics_hook=None, csv_parameters=None,
+              score_store=None, reuse_indices=False, result_file_id=None):
+    """
+    @param csv_parameters: dict of act_name, time_name and sep of a CSV log
+    @param score_store: ScoreStore shared with other runs on the same view database
+    @param reuse_indices: use the relation indices already in the view database instead of computing them
+    @param result_file_id: prefix of the result files (default: current time)
+    """
     start_time = time.time()
+    # collects per-context and per-pair metrics of all stages, written next to the results
+    metrics_hook = metrics.set_metrics_hook(metrics_hook if metrics_hook is not None else JsonMetricsCollector())
 
-    result_file_id = datetime.now().strftime("%Y%m%d-%H%M%S")
-    if not relation_indices_precomputed:
+    result_file_id = datetime.now().strftime("%Y%m%d-%H%M%S") if result_file_id is None else result_file_id
+    if not relation_indices_precomputed and not reuse_indices:
         compute_indices_by_leading_type_db(filename, db_name, file_type=file_type, object_types=object_types,
-                                           duckdb_config=duckdb_config)
+                                           duckdb_config=duckdb_config, **(csv_parameters or {}))
     indexing_end_time = time.time()
     index_computation_time = indexing_end_time - start_time
     logging.info("Done computing indices by leading type (ocel) in " + str(index_computation_time) + " seconds")
 
-    logging.info("Initializing ranking subset selector - computing scores")
-    ranking_subset_selection = DBRankingSubsetSelector(db_name=db_name, object_types=object_types,
-                                                       counts_precomputed=counts_precomputed, weight=weight,
-                                                       duckdb_config=duckdb_config, file_id=result_file_id)
+    if score_store is None and use_score_store:
+        score_store = ScoreStore(db_name)
+    if selection_method == "enumeration":
+        logging.info("Initializing enumeration subset selector - computing scores")
+        ranking_subset_selection = DBEnumerationSubsetSelector(db_name=db_name, object_types=object_types,
+                                                               counts_precomputed=counts_precomputed, weight=weight,
+                                                               duckdb_config=duckdb_config, file_id=result_file_id,
+                                                               score_store=score_store)
+        weights = None
+    else:
+        logging.info("Initializing ranking subset selector - computing scores")
+        ranking_subset_selection = DBRankingSubsetSelector(db_name=db_name, object_types=object_types,
+                                                           counts_precomputed=counts_precomputed, weight=weight,
+                                                           duckdb_config=duckdb_config, file_id=result_file_id,
+                                                           score_store=score_store)
     score_comp_end_time = time.time()
     score_computation_time = score_comp_end_time - indexing_end_time
     logging.info("Done scoring views in " + str(score_computation_time) + " seconds")
 
-    logging.info("Selecting views by mmr")
-    selected_views = ranking_subset_selection.select_view_indices(k)
+    if weights is not None:
+        logging.info("Selecting views by mmr for weights " + str(weights))
+        selected_per_weight = ranking_subset_selection.select_view_indices_for_weights(weights, k)
+    else:
+        logging.info("Selecting views by " + selection_method)
+        selected_views = ranking_subset_selection.select_view_indices(k)
     view_selection_time = time.time() - score_comp_end_time
     logging.info("Done selecting views in " + str(view_selection_time) + " seconds")
     run_time = time.time() - start_time
@@ -91,11 +145,20 @@ def compute_views(filename, object_types, db_name, file_type="json", k=2, weight
         "view_selection_time": view_selection_time,
         "run_time": run_time
     }
+    for stage, stage_time in recorded_times.items():
+        metrics.timing("stage", stage_time, stage=stage)
+
+    if weights is not None:
+        write_weight_sweep_results(selected_per_weight, object_types, result_file_id + "_" + short_name, filename,
+                                   f"{selection_method}-leading-type", runtimes=recorded_times)
+    else:
+        print(selected_views)
+        logging.info("Computing stats for evaluation")
+        get_stats_for_views(filename, selected_views, object_types, db_name, start_time,
+                            f"{selection_method}-leading-type", result_file_id, runtimes=recorded_times, short_name=short_name)
 
-    print(selected_views)
-    logging.info("Computing stats for evaluation")
-    get_stats_for_views(filename, selected_views, object_types, db_name, start_time,
-                        f"{selection_method}-leading-type", result_file_id, runtimes=recorded_times, short_name=short_name)
+    metrics.timing("stage", time.time() - start_time - run_time, stage="stats_time")
+    metrics_hook.emit("results/" + result_file_id + "_" + short_name + "_metrics.json")
 
     if remove_db:
         # Check if the file exists
@@ -107,87 +170,33 @@ def compute_views(filename, object_types, db_name, file_type="json", k=2, weight
             print(f"Database '{db_name}' does not exist.")
 
 
-def compute_views_for_bpi17(k=None, weight=0.5, selection_method="mmr", duckdb_config=None):
-    filename = 'data/BPIC17.jsonocel'
-    object_types = [
-        "Application",
-        "Workflow",
-        "Offer",
-        "Case_R"
-    ]
-    k = len(object_types) if k is None else k
-
-    db_file = db_path + "leading_type_views_BPI17.duckdb"
-
-    assert k <= len(object_types), "k must be less than the number of object types"
-    compute_views(filename, object_types, db_file, k=k, weight=weight, selection_method=selection_method,
-                  duckdb_config=duckdb_config, short_name="BPI17")
-
+def compute_views_for_dataset(entry, k=None, weight=0.5, selection_method="mmr", duckdb_config=None, weights=None,
+                              filter_date=None, db_dir=None, **kwargs):
+    """
+    Computes the views of an OCEL dataset of the registry.
 
-def compute_views_for_bpi17_csv(k=None, weight=0.5, selection_method="mmr", duckdb_config=None):
-    filename = 'data/BPI2017-Final-adapt.csv'
-    object_types = ["offer", "application", "event_org:resource", "event_EventID"]
+        @param entry: registry entry of the dataset
+        @param filter_date: end of the time window of a filtered log, overriding the one of the entry
+        @param db_dir: directory of the view database (default: db_path)
+        @param kwargs: further arguments of compute_views
+    """
+    filename = prepare_log(entry, end_time=filter_date)
+    object_types = entry["object_types"]
     k = len(object_types) if k is None else k
-
-    parameters = {
-        "act_name": 'event_activity',
-        "time_name": 'event_timestamp',
-        "sep": ',',
-    }
-
-    db_file = db_path + "leading_type_views_BPI17csv.duckdb"
+    db_file = os.path.join(db_path if db_dir is None else db_dir, entry["db_name"])
 
     assert k <= len(object_types), "k must be less than the number of object types"
-    compute_views(filename, object_types, db_file, file_type="csv", k=k, weight=weight,
-                  selection_method=selection_method, duckdb_config=duckdb_config, short_name="BPI17csv")
-
-
-def compute_views_for_bpi14(k=None, weight=0.5, selection_method="mmr", duckdb_config=None, filter_date="2013-09-30T23:59:59"):
-    # data = load_ocel_from_file("data/order-management.jsonocel")
-    data = load_ocel_from_file("data/BPIC14.jsonocel.zip")
-    filtered_data = filter_ocel_json(data, start_time="2013-01-01T00:00:01", end_time=filter_date)
-
-    filename = f'data/bpi14-filtered-{filter_date.split("T")[0]}.jsonocel'
-    with open(filename, "w") as f:
-        f.write(json.dumps(filtered_data, indent=4))
-
-    object_types = ["ConfigurationItem", "ServiceComponent", "Incident", "Interaction", "Change", "Case_R", "KM"]
-    k = len(object_types) if k is None else k
-   # db_file = db_path + f"leading_type_views_bpi14-filtered-{filter_date.split('T')[0]}.duckdb"
-    db_file = db_path + f"leading_type_views_bpi14-filtered.duckdb"
-    assert k <= len(object_types), "k must be less than the number of object types"
-    compute_views(filename, object_types, db_file, k=k, weight=weight, selection_method=selection_method,
-                  duckdb_config=duckdb_config, short_name="BPI14")
-
-
-def compute_views_for_order_management(k=None, weight=0.5, selection_method="mmr", duckdb_config=None):
-    filename = 'data/order-management.jsonocel'
-    object_types = ["orders", "items", "packages", "customers", "products"]
-    #object_types = ["packages", "customers", "products"]
-    k = len(object_types) if k is None else k
-    db_file = db_path + "leading_type_views_order.duckdb"
-    assert k <= len(object_types), "k must be less than the number of object types"
-    compute_views(filename, object_types, db_file, k=k, weight=weight, selection_method=selection_method,
-                  duckdb_config=duckdb_config, short_name="order")
-
-def compute_views_for_bpi15(k=None, weight=0.5, selection_method="mmr", duckdb_config=None, lognr="1"):
-    filename = 'data/BPIC15_Municipality' + lognr + '.jsonocel'
-    object_types = ["Application",
-      "Case_R",
-      "Responsible_actor",
-      "monitoringResource"]
-
-    k = len(object_types) if k is None else k
-    db_file = db_path + "leading_type_views_bpi15_"+ lognr +".duckdb"
-    assert k <= len(object_types), "k must be less than the number of object types"
-    compute_views(filename, object_types, db_file, k=k, weight=weight, selection_method=selection_method,
-                  duckdb_config=duckdb_config, short_name="BPI15_" + lognr)
+    compute_views(filename, object_types, db_file, file_type=entry["file_type"], k=k, weight=weight,
+                  selection_method=selection_method, duckdb_config=duckdb_config, short_name=entry["short_name"],
+                  weights=weights, csv_parameters=entry.get("csv"), **kwargs)
 
 
 def get_stats_for_views(filename, selected_views, object_types, db_file, start_time, method, file_id, runtimes=None, short_name=""):
     with duckdb.connect(db_file) as con:
-        view_infos = con.sql("SELECT * FROM viewmeta").fetchdf()
-        print(view_infos)
+        # views by object type, view indices need not be the positions in object_types
+        view_stats = {stats["objecttype"]: stats for stats in get_view_stats(con).values()}
+        coverage = selection_coverage(con, [view_stats[object_types[res_tuple[0]]]["viewIdx"]
+                                            for res_tuple in selected_views])
 
     path = "results"
     result_json = {"filename": filename, "method": method, "selected_views": []}
@@ -199,38 +208,29 @@ def get_stats_for_views(filename, selected_views, object_types, db_file, start_t
         results_for_k = {}
         obj_t = object_types[obj_idx]
 
-        with duckdb.connect(db_file) as con:
-            num_edges = con.sql("SELECT COUNT(DISTINCT edge) FROM " + obj_t).fetchone()[0]
-
         # compute selected views and gather statistics: number of process executions, number of variants,
         # number of events covered, etc.
         # check how difference in weight affects the selected views
         # check how difference between selected views changes with increasing k -> convergence?
         # check how different methods compare to each other
 
-        # TODO: add level of detail: average number of unique activities per trace (Murillas et al., 2019)
-        # TODO: add covered events covered
+        stats = view_stats[obj_t]
         results_for_k["object_type"] = obj_t
-        results_for_k["num_process_executions"] = int(
-            view_infos.loc[view_infos['viewIdx'] == obj_idx, 'numProcExecs'].values[0])
+        results_for_k["num_process_executions"] = int(stats["numProcExecs"])
         # number of traces present in an event log (Murillas et al., 2019)
-        results_for_k["num_edges"] = num_edges
+        results_for_k["num_edges"] = stats["numEdges"]
         results_for_k["score info"] = score_info
         results_for_k["time"] = finish_time - start_time
         results_for_k["position"] = k
 
-        #events_covered = set()
-        #for edge in indices_leading_types[obj_idx]["relation_index"]:
-        #    events_covered.add(edge[0])
-        #    events_covered.add(edge[1])
-
-        #results_for_k["num_of_events_covered"] = len(events_covered)
-        results_for_k["num_of_events_total-dupl"] = int(
-            view_infos.loc[view_infos['viewIdx'] == obj_idx, 'numEvents'].values[0])  # incl duplicates events
-        results_for_k["avg_num_of_events_per_trace"] = float(
-            view_infos.loc[view_infos['viewIdx'] == obj_idx, 'AvgNumEventsPerTrace'].values[0])
+        results_for_k["num_of_events_covered"] = stats["numEventsCovered"]
+        results_for_k["num_of_events_total-dupl"] = int(stats["numEvents"])  # incl duplicates events
+        results_for_k["avg_num_of_events_per_trace"] = float(stats["AvgNumEventsPerTrace"])
         # Average number of events (AE) (Eq. 3): average number of events per trace (Murillas et al., 2019)
+        results_for_k["avg_num_of_unique_activities_per_trace"] = stats["AvgNumUniqueActivitiesPerTrace"]
+        # level of detail: average number of unique activities per trace (Murillas et al., 2019)
         result_json["selected_views"].append(results_for_k)
+    add_coverage_to_results(result_json, coverage)
 
     now = datetime.now()
 
@@ -1,16 +1,27 @@
 import json
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
+
+from src.util.score_store import ScoreStore
 
 plot_file_path = 'results/plots/'
-plt.rcParams['pdf.fonttype'] = 42
-plt.rcParams['ps.fonttype'] = 42
-plt.rcParams['xtick.labelsize'] = 14
-plt.rcParams['ytick.labelsize'] = 14
+
+
+def plotting_modules():
+    """
+    @return: tuple (matplotlib.pyplot, seaborn), imported and configured on first use, so that loading results and
+             runtimes does not import them
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    plt.rcParams['pdf.fonttype'] = 42
+    plt.rcParams['ps.fonttype'] = 42
+    plt.rcParams['xtick.labelsize'] = 14
+    plt.rcParams['ytick.labelsize'] = 14
+    return plt, sns
 
 # Extract sim scores and positions
 def plot_score_evolution(file_path, name, file_id):
+    plt, sns = plotting_modules()
     # Load the JSON data
     with open(file_path, 'r') as f:
         data = json.load(f)
@@ -66,18 +77,64 @@ def __get_accumulated_similarity(file_path, file_id):
     return acc_similarity_scores
 
 
-def plot_runtime_breakdown(file_paths):
+def plot_pairwise_scores(db_name, object_types, name):
+    """
+    Plots the pairwise view similarities kept in the score store of a view database as heatmap.
+    """
+    plt, sns = plotting_modules()
+    pairwise_scores = ScoreStore(db_name).pairwise_matrix(object_types)
+
+    plt.figure(figsize=(10, 8))
+    sns.heatmap(pairwise_scores, xticklabels=object_types, yticklabels=object_types, vmin=0, vmax=1,
+                cmap='Blues', annot=len(object_types) <= 12, fmt='.2f')
+    plt.tight_layout()
+
+    plt.savefig(f'{plot_file_path}{name}_pairwise_scores.pdf', dpi=300, format='pdf')
+
+    plt.show()
+
+
+def load_stage_breakdown(metrics_path, runtimes):
+    """
+    Splits the recorded stage runtimes into their components using the timings of a metrics file
+    written next to the results (see src.util.metrics).
+    """
+    with open(metrics_path, 'r') as f:
+        timings = json.load(f).get('timings', [])
+
+    def total(name):
+        return sum(timing['total'] for timing in timings if timing['name'] == name)
+
+    index_time = runtimes.get('index_computation_time', 0)
+    score_time = runtimes.get('score_computation_time', 0)
+    neo4j_time = total('neo4j_query')
+    load_time = total('ocel_load')
+    ingest_time = total('relation_index_ingest')
+    counts_time = total('counts')
+    pair_time = total('pair_score')
+    return {
+        'Neo4j Queries': neo4j_time,
+        'OCEL Loading': load_time,
+        'Relation Index Ingest': ingest_time,
+        'Other Index Computation': max(index_time - neo4j_time - load_time - ingest_time, 0),
+        'Counts Computation': counts_time,
+        'Pairwise Score Joins': pair_time,
+        'Other Score Computation': max(score_time - counts_time - pair_time, 0),
+        'View Selection Time': runtimes.get('view_selection_time', 0)
+    }
+
+
+def plot_runtime_breakdown(file_paths, metrics_paths=None):
+    plt, _ = plotting_modules()
     labels = []
-    index_time = []
-    score_time = []
-    view_time = []
+    components = {}
 
     def extract_dataset_name(dataset_name):
         if dataset_name.startswith('data/'):
             return dataset_name.strip(".jsonocel").split('/')[-1]
         return dataset_name
 
-    for file_path in file_paths:
+    for i, file_path in enumerate(file_paths):
         with open(file_path, 'r') as f:
             content = json.load(f)
             dataset = extract_dataset_name(content.get('filename', 'Unknown'))
@@ -85,17 +142,25 @@ def plot_runtime_breakdown(file_paths):
             runtimes = content.get('runtimes', {})
 
             labels.append(f"{dataset}\n{method}")
-            index_time.append(runtimes.get('index_computation_time', 0))
-            score_time.append(runtimes.get('score_computation_time', 0))
-            view_time.append(runtimes.get('view_selection_time', 0))
+            if metrics_paths is not None and metrics_paths[i] is not None:
+                breakdown = load_stage_breakdown(metrics_paths[i], runtimes)
+            else:
+                breakdown = {
+                    'Index Computation Time': runtimes.get('index_computation_time', 0),
+                    'Score Computation Time': runtimes.get('score_computation_time', 0),
+                    'View Selection Time': runtimes.get('view_selection_time', 0)
+                }
+            for component, component_time in breakdown.items():
+                components.setdefault(component, [0] * len(file_paths))[i] = component_time
 
     x = np.arange(len(labels))
     width = 0.6
 
     fig, ax = plt.subplots(figsize=(12, 6))
-    ax.bar(x, index_time, width, label='Index Computation Time')
-    ax.bar(x, score_time, width, bottom=index_time, label='Score Computation Time')
-    ax.bar(x, view_time, width, bottom=np.array(index_time) + np.array(score_time), label='View Selection Time')
+    bottom = np.zeros(len(labels))
+    for component, component_times in components.items():
+        ax.bar(x, component_times, width, bottom=bottom, label=component)
+        bottom += np.array(component_times)
 
     ax.set_xlabel('Dataset and Method')
     ax.set_ylabel('Time (seconds)')
@@ -0,0 +1,249 @@
+import argparse
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import duckdb
+
+import src.strategies.db_selection as db_selection
+from src.evaluation.weight_sweep import parse_weights
+from src.strategies.db_mmr_selection import DBRankingSubsetSelector
+from src.util import memory_governor
+from src.util.coverage import add_coverage_to_results, selection_coverage, stored_coverage
+from src.util.graph_source import LocalGraphSource, Neo4jGraphSource
+from src.util.score_store import ScoreStore, context_table_versions
+from src.util.view_tables import get_view_stats, migrate_view_database
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+
+class ViewService:
+
+    """
+    Long-running view selection on a view database. The scores of the views (pairwise and overall), their statistics
+    and event coverage bitsets and the score store are kept resident, so that selections for any k and weight are
+    answered from memory without reconnecting or rescoring. A refresh rebuilds the view database with the events added
+    to the source (if a rebuild is given) and rescores only the pairs of views whose context tables changed.
+
+    @param db_name: view database to select views from
+    @param rebuild: callable rebuilding the view database from the source of the events, None to serve the database
+                    as is (a refresh then rereads it, e.g. after it was rebuilt by an evaluation run)
+    @param duckdb_config: DuckDB and scoring configuration, as for the subset selectors
+    @param score_store: ScoreStore to reuse the scores of unchanged views (default: store of the view database)
+    """
+    def __init__(self, db_name, rebuild=None, duckdb_config=None, score_store=None):
+        self.db_name = db_name
+        self.rebuild = rebuild
+        self.duckdb_config = duckdb_config
+        self.score_store = ScoreStore(db_name) if score_store is None else score_store
+        # selections wait for a running refresh instead of reading partially updated state
+        self.lock = threading.RLock()
+        self.versions = {}
+        self.load()
+
+    def load(self):
+        """
+        Reads the views of the database and scores them, reusing the stored scores of unchanged context tables.
+
+            @return: list of the views whose context tables changed since the last load
+        """
+        with self.lock:
+            with duckdb.connect(self.db_name) as con:
+                migrate_view_database(con)
+                view_stats = get_view_stats(con)
+                view_indices = sorted(view_stats)
+                object_types = [view_stats[view_idx]["objecttype"] for view_idx in view_indices]
+                versions = context_table_versions(con, object_types)
+                coverage = stored_coverage(con)
+            os.makedirs(db_selection.results_path, exist_ok=True)
+            self.selector = DBRankingSubsetSelector(self.db_name, object_types=object_types,
+                                                    duckdb_config=self.duckdb_config, file_id="view_service",
+                                                    score_store=self.score_store)
+            changed = [obj_type for obj_type in object_types if self.versions.get(obj_type) != versions[obj_type]]
+            self.view_stats, self.view_indices, self.object_types, self.versions, self.coverage = \
+                view_stats, view_indices, object_types, versions, coverage
+            return changed
+
+    def refresh(self):
+        """
+        Rebuilds the view database with the new events and rescores the changed views.
+
+            @return: dict with the changed views and the time of the rebuild and of the rescoring
+        """
+        with self.lock:
+            start_time = time.perf_counter()
+            if self.rebuild is not None:
+                self.rebuild()
+            rebuild_time = time.perf_counter() - start_time
+            changed = self.load()
+            logging.info(f"Refreshed {len(changed)} of {len(self.object_types)} views")
+            return {"changed_views": changed, "rebuild_time": rebuild_time,
+                    "score_time": time.perf_counter() - start_time - rebuild_time}
+
+    def views(self):
+        """
+        @return: list of the views with their statistics
+        """
+        with self.lock:
+            return [dict(self.view_stats[view_idx], overall_score=float(self.selector.overall_scores[i]))
+                    for i, view_idx in enumerate(self.view_indices)]
+
+    def select(self, k, weights):
+        """
+        Selects k views by MMR for each of the weights, from the resident scores.
+
+            @return: dict of weight to results of the selection, in the format of the evaluation results
+        """
+        with self.lock:
+            if k < 1 or k > len(self.object_types):
+                raise ValueError(f"k must be between 1 and the number of views ({len(self.object_types)})")
+            results = {}
+            for weight, selected_views in self.selector.select_view_indices_for_weights(weights, k).items():
+                result_json = {"weight": weight, "selected_views": []}
+                for position, (obj_idx, _, score_info, _) in enumerate(selected_views):
+                    stats = self.view_stats[self.view_indices[obj_idx]]
+                    result_json["selected_views"].append({
+                        "object_type": self.object_types[obj_idx],
+                        "position": position,
+                        "score info": score_info,
+                        "num_process_executions": int(stats["numProcExecs"]),
+                        "num_edges": stats["numEdges"],
+                        "num_of_events_covered": stats["numEventsCovered"]})
+                add_coverage_to_results(result_json, selection_coverage(
+                    None, [self.view_indices[selected[0]] for selected in selected_views], stored=self.coverage)
+                    if self.coverage is not None else None)
+                results[weight] = result_json
+            return results
+
+
+class ViewServiceHandler(BaseHTTPRequestHandler):
+
+    """
+    JSON API of a ViewService:
+        GET /views                      views and their statistics
+        GET /select?k=4&weight=0.5      views selected for k and the weight (or weights, as for --weights)
+        POST /refresh                   rebuild with the new events and rescore the changed views
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        service = self.server.service
+        if url.path == "/views":
+            self.reply(200, service.views())
+        elif url.path == "/select":
+            try:
+                k = int(params.get("k", len(service.object_types)))
+                weights = parse_weights(params.get("weight", "0.5"))
+                results = service.select(k, weights)
+            except ValueError as e:
+                self.reply(400, {"error": str(e)})
+                return
+            self.reply(200, results[weights[0]] if len(weights) == 1 else list(results.values()))
+        else:
+            self.reply(404, {"error": f"Unknown path {url.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == "/refresh":
+            self.reply(200, self.server.service.refresh())
+        else:
+            self.reply(404, {"error": f"Unknown path {url.path}"})
+
+    def reply(self, status, body):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def address_string(self):
+        # clients of a Unix socket have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service, port=None, socket_path=None, host="127.0.0.1"):
+    """
+    @return: HTTP server of the service on the local port, or on the Unix socket if socket_path is given
+    """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, ViewServiceHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ViewServiceHandler)
+    server.service = service
+    return server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve view selections on a view database from resident scores.")
+    parser.add_argument("db_name", type=str, help="View database (.duckdb file)")
+    parser.add_argument("--port", type=int, default=8765, help="Local HTTP port")
+    parser.add_argument("--socket", type=str, default=None, help="Unix socket to serve on instead of the port")
+    parser.add_argument("--graph", type=str, default=None,
+                        help="Directory of the EKG export to rebuild the views from on refresh")
+    parser.add_argument("--neo4j", action="store_true", help="Rebuild the views from Neo4j on refresh")
+    parser.add_argument("--contextdef", type=str, default="interact",
+                        help="Method for defining context on rebuild (interact or leading)")
+    parser.add_argument("--relation", type=str, default="total",
+                        help="Relation between the events of a process execution on rebuild (total or partial)")
+    parser.add_argument("--maxmem", type=str, default=None, help="Max available memory for DuckDB (KB, MB, GB)")
+    parser.add_argument("--threads", type=int, default=None, help="Max number of threads for DuckDB")
+    parser.add_argument("--nearest", action="store_true",
+                        help="Score by nearest-context search over edge set indices instead of the pairwise join")
+    return parser.parse_args()
+
+
+def ekg_rebuild(graph_source, db_name, contextdef, duckdb_config, relation="total"):
+    """
+    @param relation: relation between the events of a process execution (total or partial)
+    @return: callable rebuilding the view database from the graph source, which stays connected between rebuilds
+    """
+    from src.view_generation.ekg_interacting_entities import compute_indices_by_interacting_entities
+    from src.view_generation.ekg_leading_type import compute_indices_by_ekg_leading_types
+
+    def rebuild():
+        graph_source.refresh()
+        if contextdef == "leading":
+            compute_indices_by_ekg_leading_types(graph_source, db_name, duckdb_config=duckdb_config, relation=relation)
+        else:
+            compute_indices_by_interacting_entities(graph_source, db_name, duckdb_config=duckdb_config,
+                                                    relation=relation)
+    return rebuild
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    duckdb_config = {}
+    if args.maxmem is not None:
+        duckdb_config["memory_limit"] = args.maxmem
+    memory_governor.set_memory_budget(args.maxmem)
+    if args.threads is not None:
+        duckdb_config["threads"] = args.threads
+    if args.nearest:
+        duckdb_config["nearest"] = True
+
+    rebuild = None
+    if args.graph is not None:
+        rebuild = ekg_rebuild(LocalGraphSource(args.graph), args.db_name, args.contextdef, duckdb_config,
+                              args.relation)
+    elif args.neo4j:
+        rebuild = ekg_rebuild(Neo4jGraphSource(), args.db_name, args.contextdef, duckdb_config, args.relation)
+
+    server = make_server(ViewService(args.db_name, rebuild=rebuild, duckdb_config=duckdb_config),
+                         port=args.port, socket_path=args.socket)
+    logging.info(f"Serving views of {args.db_name} on {args.socket if args.socket is not None else args.port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,57 @@
+import json
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+path = "results"
+
+
+def parse_weights(weights_arg):
+    """
+    Parses the --weights argument, either a comma-separated list ("0.1,0.5,0.9")
+    or a range "start:stop:step" (stop inclusive).
+
+        @raise ValueError: for malformed weights, a step that is not positive or a range without weights
+    """
+    if weights_arg is None:
+        return None
+    if ":" in weights_arg:
+        start, stop, step = [float(x) for x in weights_arg.split(":")]
+        if step <= 0:
+            raise ValueError(f"Step of the weight range {weights_arg} must be positive")
+        if stop < start:
+            raise ValueError(f"Weight range {weights_arg} is empty, stop is less than start")
+        num_steps = int(round((stop - start) / step))
+        return [round(start + i * step, 10) for i in range(num_steps + 1)]
+    weights = [float(w) for w in weights_arg.split(",") if w.strip() != ""]
+    if len(weights) == 0:
+        raise ValueError(f"No weights in {weights_arg!r}")
+    return weights
+
+
+def write_weight_sweep_results(selected_per_weight, object_types, file_id, filename, method, runtimes=None):
+    """
+    Writes the views selected for each weight into a single result file. The selections are computed for the k of
+    the run; the selection for any smaller k is the prefix up to that position.
+
+        @param selected_per_weight: dict of weight to the list of views selected for it, in selection order
+    """
+    result_json = {"filename": filename, "method": method, "weights": list(selected_per_weight.keys()),
+                   "sweep": []}
+    if runtimes is not None:
+        result_json["runtimes"] = runtimes
+
+    for weight, selected_views in selected_per_weight.items():
+        results_for_weight = {"weight": weight, "selected_views": []}
+        for k, (obj_idx, score, score_info, _) in enumerate(selected_views):
+            results_for_weight["selected_views"].append({
+                "object_type": object_types[obj_idx],
+                "position": k,
+                "score info": score_info
+            })
+        result_json["sweep"].append(results_for_weight)
+
+    result_file = f"{path}/{file_id}_weight_sweep.json"
+    with open(result_file, "w") as f:
+        json.dump(result_json, f, indent=4)
+    logging.info("Wrote weight sweep results to " + result_file)
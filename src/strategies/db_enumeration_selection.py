@@ -0,0 +1,230 @@
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from src.strategies.db_mmr_selection import select_views_for_weights
+from src.strategies.db_selection import DBSubsetSelector
+
+# subsets with fewer views than this are searched in the calling process
+min_views_for_parallel_search = 16
+# number of search nodes after which a worker exchanges its best score with the other workers
+shared_bound_interval = 256
+
+# best objective found by any worker process, set by __init_worker__
+shared_best_score = None
+
+
+def __init_worker__(best_score):
+    global shared_best_score
+    shared_best_score = best_score
+
+
+def subset_objective(overall_scores, pairwise_score, indices, weight):
+    """
+    Set objective of the MMR selection: for each selected view, its weighted overall score minus
+    its weighted maximum similarity to any other selected view.
+
+        @param indices: indices of the selected views
+        @return: objective value of the subset
+    """
+    indices = list(indices)
+    objective = weight * sum(overall_scores[i] for i in indices)
+    for i in indices:
+        others = [pairwise_score[i][j] for j in indices if j != i]
+        objective -= (1 - weight) * (max(others) if len(others) > 0 else 0)
+    return objective
+
+
+def __search_branch__(args):
+    """
+    Branch-and-bound search below a fixed first view.
+
+    Subsets are represented as bitsets over the search order. The partial score of a subset, the
+    penalties of its members and the maximum similarity of every candidate to the subset are
+    carried along the search path, so each extension is scored incrementally. Any view added later
+    has a penalty of at least its maximum similarity to the current subset, and penalties of
+    current members only grow, so the current score plus the best remaining MMR gains bounds
+    every completion of the subset.
+
+        @param args: tuple (first, order, overall_scores, pairwise_score, k, weight, lower_bound)
+        @return: tuple (best objective, bitset of best subset over positions in order, visited nodes), the objective
+                 is lower_bound and the bitset None if the branch has no subset above lower_bound
+    """
+    first, order, overall_scores, pairwise_score, k, weight, lower_bound = args
+    n = len(order)
+    weighted_scores = weight * overall_scores[order]
+    sims = pairwise_score[np.ix_(order, order)]
+
+    # pruning bound, raised by the best subsets of the other workers, and best subset found by this worker
+    bound = lower_bound
+    best_score = lower_bound
+    best_bitset = None
+    visited = 0
+
+    # stack entries: (last position, bitset, members, member penalties, max sim of all views to subset, score)
+    stack = [(first, 1 << first, [first], np.zeros(1), sims[first].copy(), weighted_scores[first])]
+    while len(stack) > 0:
+        last, bitset, members, penalties, max_sim_to_sel, score = stack.pop()
+        visited += 1
+        if shared_best_score is not None and visited % shared_bound_interval == 0:
+            if shared_best_score.value > bound:
+                bound = shared_best_score.value
+            elif best_bitset is not None and best_score > shared_best_score.value:
+                shared_best_score.value = best_score
+        if len(members) == k:
+            if score > bound:
+                best_score = bound = score
+                best_bitset = bitset
+            continue
+
+        remaining = k - len(members)
+        if n - last - 1 < remaining:
+            continue
+        gains = weighted_scores[last + 1:] - (1 - weight) * max_sim_to_sel[last + 1:]
+        top_gains = np.partition(gains, len(gains) - remaining)[len(gains) - remaining:]
+        if score + np.sum(top_gains) <= bound + 1e-12:
+            continue
+
+        # score all children at once: adding a view raises member penalties and adds its own penalty
+        candidates = np.arange(last + 1, n - remaining + 1)
+        new_penalties = np.maximum(penalties, sims[np.ix_(candidates, members)])
+        penalty_sums = np.sum(new_penalties, axis=1) - np.sum(penalties) + max_sim_to_sel[candidates]
+        child_scores = score + weighted_scores[candidates] - (1 - weight) * penalty_sums
+
+        if remaining == 1:
+            best_child = np.argmax(child_scores)
+            if child_scores[best_child] > bound:
+                best_score = bound = child_scores[best_child]
+                best_bitset = bitset | (1 << int(candidates[best_child]))
+            continue
+
+        # bound children by the parent's gains of later views (child gains can only be lower)
+        later_gains = np.where(np.arange(last + 1, n)[None, :] > candidates[:, None], gains[None, :], -np.inf)
+        num_later = later_gains.shape[1]
+        child_bounds = child_scores + np.sum(
+            np.partition(later_gains, num_later - remaining + 1, axis=1)[:, num_later - remaining + 1:], axis=1)
+
+        # push in reverse order, so that candidates with lower position (higher overall score) are expanded first
+        for c_idx in range(len(candidates) - 1, -1, -1):
+            if child_bounds[c_idx] <= bound + 1e-12:
+                continue
+            pos = int(candidates[c_idx])
+            stack.append((pos, bitset | (1 << pos), members + [pos],
+                          np.append(new_penalties[c_idx], max_sim_to_sel[pos]),
+                          np.maximum(max_sim_to_sel, sims[pos]), child_scores[c_idx]))
+
+    return best_score, best_bitset, visited
+
+
+def optimal_subset(overall_scores, pairwise_score, k, weight=0.5, num_workers=None):
+    """
+    Finds the k-subset of views maximizing subset_objective by branch-and-bound, seeded with the
+    greedy MMR selection as lower bound. Branches are split by their first view across worker processes.
+
+        @return: tuple (sorted list of view indices, objective, greedy view indices, greedy objective, visited nodes)
+    """
+    overall_scores = np.asarray(overall_scores, dtype=float)
+    pairwise_score = np.asarray(pairwise_score, dtype=float)
+    n = len(overall_scores)
+    if k > n:
+        raise ValueError("k must be less than the number of views")
+
+    greedy = [int(v) for v in select_views_for_weights(overall_scores, pairwise_score, [weight], k)["selected"][0]]
+    greedy_score = subset_objective(overall_scores, pairwise_score, greedy, weight)
+    if k == 0 or k == n:
+        return sorted(greedy), greedy_score, greedy, greedy_score, 0
+
+    # search views in descending order of overall score to find good subsets early
+    order = np.argsort(-overall_scores, kind="stable")
+    # seed slightly below the greedy score, so the greedy subset itself is found if it is optimal
+    lower_bound = greedy_score - 1e-9
+    tasks = [(first, order, overall_scores, pairwise_score, k, weight, lower_bound) for first in range(n - k + 1)]
+
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    if num_workers > 1 and n >= min_views_for_parallel_search:
+        best_score = multiprocessing.Value("d", lower_bound, lock=False)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, initializer=__init_worker__,
+                                                    initargs=(best_score,)) as executor:
+            branch_results = list(executor.map(__search_branch__, tasks))
+    else:
+        # pass the best score on to the next branch
+        branch_results = []
+        for first in range(n - k + 1):
+            branch_results.append(__search_branch__((first, order, overall_scores, pairwise_score, k, weight,
+                                                     lower_bound)))
+            lower_bound = max(lower_bound, branch_results[-1][0])
+
+    best_score, best_bitset = greedy_score, None
+    visited = 0
+    for score, bitset, branch_visited in branch_results:
+        visited += branch_visited
+        if bitset is not None and score > best_score:
+            best_score, best_bitset = score, bitset
+
+    if best_bitset is None:
+        return sorted(greedy), greedy_score, greedy, greedy_score, visited
+    best_subset = sorted(int(order[pos]) for pos in range(n) if best_bitset >> pos & 1)
+    return best_subset, float(best_score), greedy, greedy_score, visited
+
+
+class DBEnumerationSubsetSelector(DBSubsetSelector):
+
+    """
+    Selects the optimal subset of k views under the MMR set objective (see subset_objective)
+    instead of the greedy MMR approximation.
+
+    @param weight: weight for the MMR score (default 0.5)
+    @param num_workers: number of worker processes for the search (default: number of CPUs)
+    """
+    def __init__(self, db_name, object_types=None, counts_precomputed=False, weight=0.5,
+                 duckdb_config=None, file_id=None, num_workers=None, score_store=None):
+        super().__init__(db_name, object_types, counts_precomputed, duckdb_config, file_id, score_store)
+        self.weight = weight
+        self.num_workers = num_workers
+        self.greedy_gap = None
+
+    '''
+    @param k: number of views to select
+
+    @return: list of tuples (view_index, score, score_info, time) of selected views,
+             ordered by greedy MMR order within the optimal subset
+    '''
+
+    def select_view_indices(self, k):
+        if k > len(self.object_types):
+            raise ValueError("k must be less than the number of views")
+
+        best_subset, best_score, greedy, greedy_score, visited = optimal_subset(
+            self.overall_scores, self.pairwise_score, k, weight=self.weight, num_workers=self.num_workers)
+        self.greedy_gap = best_score - greedy_score
+        logging.info(f"Optimal subset objective {best_score}, greedy objective {greedy_score} "
+                     f"(gap {self.greedy_gap}, {visited} search nodes)")
+
+        # order the optimal subset by greedy MMR for reporting
+        overall_scores = np.asarray(self.overall_scores, dtype=float)
+        sub_order = select_views_for_weights(overall_scores[best_subset],
+                                             self.pairwise_score[np.ix_(best_subset, best_subset)],
+                                             [self.weight], k)["selected"][0]
+        finish_time = time.time()
+
+        selected_results = []
+        for pos in sub_order:
+            view_idx = best_subset[pos]
+            others = [self.__get_score__(view_idx, j) for j in best_subset if j != view_idx]
+            max_sim = max(others) if len(others) > 0 else None
+            contribution = self.weight * overall_scores[view_idx] - (1 - self.weight) * (max_sim or 0)
+            info_scores = {
+                "sim_score": float(overall_scores[view_idx]),
+                "subset_contribution": float(contribution),
+                "max_sim_to_others": None if max_sim is None else float(max_sim),
+                "objective": float(best_score),
+                "greedy_objective": float(greedy_score),
+                "greedy_gap": float(self.greedy_gap)
+            }
+            selected_results.append((view_idx, float(contribution), info_scores, finish_time))
+
+        return selected_results
@@ -1,8 +1,72 @@
 import time
 
+import numpy as np
+
 from src.strategies.db_selection import DBSubsetSelector
 
 
+def select_views_for_weights(overall_scores, pairwise_score, weights, k):
+    """
+    Greedy MMR selection for several weights at once, vectorized over the weights.
+
+        @param overall_scores: array of overall scores per view
+        @param pairwise_score: symmetric matrix of pairwise view similarities
+        @param weights: list of MMR weights
+        @param k: number of views to select
+        @return: dict of (len(weights), k) arrays: selected view indices, mmr scores and
+                 max/min/avg similarity to previously selected views (nan in first step)
+    """
+    overall_scores = np.asarray(overall_scores, dtype=float)
+    pairwise_score = np.asarray(pairwise_score, dtype=float)
+    weights = np.asarray(weights, dtype=float)[:, None]
+    num_weights, n = len(weights), len(overall_scores)
+
+    if k > n:
+        raise ValueError("k must be less than the number of views")
+
+    selected = np.zeros((num_weights, k), dtype=int)
+    mmr_scores = np.zeros((num_weights, k))
+    max_sims = np.full((num_weights, k), np.nan)
+    min_sims = np.full((num_weights, k), np.nan)
+    avg_sims = np.full((num_weights, k), np.nan)
+
+    rows = np.arange(num_weights)
+    is_selected = np.zeros((num_weights, n), dtype=bool)
+    max_sim_to_sel = np.zeros((num_weights, n))
+    min_sim_to_sel = np.full((num_weights, n), np.inf)
+    sum_sim_to_sel = np.zeros((num_weights, n))
+
+    for step in range(k):
+        if step == 0:
+            # in first step, just choose view with best overall score (identical for all weights)
+            scores = np.broadcast_to(overall_scores, (num_weights, n))
+        else:
+            scores = weights * overall_scores - (1 - weights) * max_sim_to_sel
+        scores = np.where(is_selected, -np.inf, scores)
+        next_views = np.argmax(scores, axis=1)
+
+        selected[:, step] = next_views
+        mmr_scores[:, step] = scores[rows, next_views]
+        if step > 0:
+            max_sims[:, step] = max_sim_to_sel[rows, next_views]
+            min_sims[:, step] = min_sim_to_sel[rows, next_views]
+            avg_sims[:, step] = sum_sim_to_sel[rows, next_views] / step
+
+        is_selected[rows, next_views] = True
+        sims_to_next = pairwise_score[next_views]
+        max_sim_to_sel = np.maximum(max_sim_to_sel, sims_to_next)
+        min_sim_to_sel = np.minimum(min_sim_to_sel, sims_to_next)
+        sum_sim_to_sel += sims_to_next
+
+    return {
+        "selected": selected,
+        "mmr_score": mmr_scores,
+        "max_sim_to_prev": max_sims,
+        "min_sim_to_prev": min_sims,
+        "avg_sim_to_prev": avg_sims
+    }
+
+
 class DBRankingSubsetSelector(DBSubsetSelector):
 
     """
@@ -14,8 +78,8 @@ class DBRankingSubsetSelector(DBSubsetSelector):
     Initializes the SubsetSelector with the given views and computes the similarity scores.
     """
     def __init__(self, db_name, object_types=None, counts_precomputed=False, weight=0.5,
-                 duckdb_config=None, file_id=None):
-        super().__init__(db_name, object_types, counts_precomputed, duckdb_config, file_id)
+                 duckdb_config=None, file_id=None, score_store=None):
+        super().__init__(db_name, object_types, counts_precomputed, duckdb_config, file_id, score_store)
         self.weight = weight
 
     '''
@@ -80,3 +144,34 @@ class DBRankingSubsetSelector(DBSubsetSelector):
 
         return selected_results
 
+    '''
+    @param weights: list of MMR weights to select views for, reusing the computed scores
+    @param k: number of views to select (default: all views, which yields the selection for every smaller k as prefix)
+
+    @return: dict of weight to list of tuples (view_index, score, score_info, time) of selected views
+    '''
+
+    def select_view_indices_for_weights(self, weights, k=None):
+        k = len(self.object_types) if k is None else k
+        sweep = select_views_for_weights(self.overall_scores, self.pairwise_score, weights, k)
+        finish_time = time.time()
+
+        def as_float(value):
+            return None if np.isnan(value) else float(value)
+
+        selected_per_weight = {}
+        for w_idx, weight in enumerate(weights):
+            selected_results = []
+            for step in range(k):
+                view_idx = int(sweep["selected"][w_idx, step])
+                info_scores = {
+                    "sim_score": float(self.overall_scores[view_idx]),
+                    "mmr_score": float(sweep["mmr_score"][w_idx, step]),
+                    "max_sim_to_prev": as_float(sweep["max_sim_to_prev"][w_idx, step]),
+                    "min_sim_to_prev": as_float(sweep["min_sim_to_prev"][w_idx, step]),
+                    "avg_sim_to_prev": as_float(sweep["avg_sim_to_prev"][w_idx, step])
+                }
+                selected_results.append((view_idx, info_scores["mmr_score"], info_scores, finish_time))
+            selected_per_weight[weight] = selected_results
+
+        return selected_per_weight
@@ -1,18 +1,109 @@
 import json
 import logging
 import pickle
+import time
 
 import duckdb
 from abc import abstractmethod
 
 import numpy as np
-from tqdm import tqdm
 
+from src.strategies.sharded_scoring import ShardedPairScorer
+from src.util import memory_governor, metrics
+from src.util.nearest_context import EdgeSetIndex
+from src.util.posting_index import load_or_build
+from src.util.score_store import context_table_versions
+from src.util.view_tables import create_variant_tables, get_view_stats, has_table
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 
 results_path = "results/"
+join_chunk_rows = 1000000
+
+
+def max_sims_per_context(result, chunk_rows=join_chunk_rows):
+    """
+    Reduces the (o1contexts, o2contexts, sim) rows of a query result to the maximum sim per o1contexts and per
+    o2contexts. Rows are fetched in chunks of up to chunk_rows, fewer under memory pressure, so that only one chunk
+    and the maxima per process execution are held in memory.
+
+        @return: tuple (DataFrame of o1contexts and max sim, DataFrame of o2contexts and max sim, number of rows)
+    """
+    import pandas as pd
+    max_sims1, max_sims2, num_rows = [], [], 0
+    while True:
+        # DuckDB fetches in vectors of 2048 rows
+        chunk = result.fetch_df_chunk(max(1, memory_governor.batch_size(chunk_rows) // 2048))
+        if len(chunk) == 0:
+            break
+        num_rows += len(chunk)
+        max_sims1 = [pd.concat(max_sims1 + [chunk.groupby('o1contexts')['sim'].max()]).groupby(level=0).max()]
+        max_sims2 = [pd.concat(max_sims2 + [chunk.groupby('o2contexts')['sim'].max()]).groupby(level=0).max()]
+    if num_rows == 0:
+        empty = result.fetch_df_chunk(1)
+        return empty[['o1contexts', 'sim']], empty[['o2contexts', 'sim']], 0
+    return max_sims1[0].reset_index(), max_sims2[0].reset_index(), num_rows
+
+
+def variant_members(con, context_name):
+    """
+    @return: DataFrame (procExec, variant) of the process executions of a context table and their variants, and
+             Series of the multiplicity of each variant, indexed by variant
+    """
+    members = con.sql(f"SELECT procExec, variant FROM {context_name}VariantMembers").fetchdf()
+    multiplicities = con.sql(f"SELECT variant, multiplicity FROM {context_name}VariantsCounts").fetchdf()
+    return members, multiplicities.set_index('variant')['multiplicity']
+
+
+def weighted_sum(max_sims, column, multiplicities):
+    # every variant stands for multiplicity process executions with the same maximum similarity
+    return (max_sims['sim'].to_numpy() * multiplicities.reindex(max_sims[column]).to_numpy()).sum()
+
+
+def proc_exec_maxima(max_sims, column, members):
+    """
+    @return: DataFrame (column, sim) of the maximum similarities of the process executions, from the maxima of
+             their variants
+    """
+    merged = members.merge(max_sims, left_on='variant', right_on=column)
+    return merged[['procExec', 'sim']].rename(columns={'procExec': column})
+
+
+def edge_set_index(con, table_name, key="procExec", db_name=None):
+    """
+    @param db_name: view database file, the edge sets are read from the persisted posting index of the table next to
+                    it (built on first use); None to read them from the table
+    @return: tuple (array of the process executions (or variants) of a context table, EdgeSetIndex of their edge
+             sets)
+    """
+    if db_name is not None:
+        keys, edge_sets = load_or_build(con, db_name, table_name, key).edge_sets()
+        return keys, EdgeSetIndex(edge_sets)
+    rows = con.sql(f"SELECT {key}, list(DISTINCT edge) FROM {table_name} GROUP BY {key}").fetchall()
+    return np.array([row[0] for row in rows]), EdgeSetIndex([row[1] for row in rows])
+
+
+def nearest_max_sims(keys_index1, keys_index2):
+    """
+    Maximum similarity of each process execution of two context tables to any process execution of the other one,
+    by nearest-context search in their edge set indices instead of the join of all pairs sharing an edge.
+
+        @param keys_index1, keys_index2: results of edge_set_index for the two tables
+        @return: tuple (DataFrame of o1contexts and max sim, DataFrame of o2contexts and max sim, number of verified
+                 candidates), process executions without any shared edge are left out as in the join
+    """
+    import pandas as pd
+    (keys1, index1), (keys2, index2) = keys_index1, keys_index2
+    verified = index1.stats["verified"] + index2.stats["verified"]
+    max_sims1 = index2.max_similarities(index1.edge_sets)
+    max_sims2 = index1.max_similarities(index2.edge_sets)
+    verified = index1.stats["verified"] + index2.stats["verified"] - verified
+    return (pd.DataFrame({'o1contexts': keys1, 'sim': max_sims1})[max_sims1 > 0].reset_index(drop=True),
+            pd.DataFrame({'o2contexts': keys2, 'sim': max_sims2})[max_sims2 > 0].reset_index(drop=True), verified)
+
+
 class DBSubsetSelector:
-    def __init__(self,  db_name, object_types=None, counts_precomputed=False, duckdb_config=None, file_id=None):
+    def __init__(self,  db_name, object_types=None, counts_precomputed=False, duckdb_config=None, file_id=None,
+                 score_store=None):
         self.db_name = db_name
         self.duckdb_config = duckdb_config
         self.overall_scores = [-1 for _ in range(len(object_types))]
@@ -20,6 +111,8 @@ class DBSubsetSelector:
         self.object_types = object_types
         self.counts_precomputed = counts_precomputed
         self.file_id = file_id
+        # optional ScoreStore to reuse pairwise scores of unchanged context tables across runs
+        self.score_store = score_store
 
         self.compute_scores()
         logging.info("Computed scores")
@@ -38,6 +131,8 @@ class DBSubsetSelector:
         @return: similarity score and indices of views
     """
     def compute_pairwise_scores(self):
+        # imported on first scoring instead of on import, which keeps the startup of the entry points fast
+        from tqdm import tqdm
         config = {}
         if self.duckdb_config is not None:
             if "memory_limit" in self.duckdb_config:
@@ -47,61 +142,148 @@ class DBSubsetSelector:
         in_memory = True if self.duckdb_config is not None and "in_memory" in self.duckdb_config and self.duckdb_config["in_memory"] else False
 
         with (duckdb.connect() if in_memory else duckdb.connect(self.db_name, config = config) as con):
+                n = len(self.object_types)
+                missing_pairs = [(i, j) for i in range(n) for j in range(i + 1, n)]
+                if self.score_store is not None:
+                    versions = context_table_versions(con, self.object_types)
+                    missing_pairs = []
+                    for i in range(n):
+                        for j in range(i + 1, n):
+                            ot1 = self.object_types[i]
+                            ot2 = self.object_types[j]
+                            stored = self.score_store.get_pair(ot1, versions[ot1], ot2, versions[ot2])
+                            if stored is None:
+                                missing_pairs.append((i, j))
+                            else:
+                                self.pairwise_score[i][j] = stored[0]
+                                self.pairwise_score[j][i] = stored[0]
+                    logging.info(f"Reusing {n * (n - 1) // 2 - len(missing_pairs)} stored pairwise scores, "
+                                 f"computing {len(missing_pairs)}")
+
+                for i in range(n):
+                    self.pairwise_score[i][i] = 1
+                if len(missing_pairs) == 0:
+                    return
+
                 if not self.counts_precomputed:
                     for obj_type in tqdm(self.object_types):
-                        con.sql("DROP TABLE IF EXISTS " + obj_type + "Counts")
-                        con.sql("CREATE TABLE IF NOT EXISTS "+ obj_type + "Counts" +"(procExec integer, counts integer)")
-                        con.sql("INSERT INTO " + obj_type + "Counts" + " SELECT procExec, COUNT(*) as counts FROM "+ obj_type +" GROUP BY procExec ORDER BY procExec ASC")
+                        with metrics.timed("counts", context=obj_type):
+                            con.sql("DROP TABLE IF EXISTS " + obj_type + "Counts")
+                            con.sql("CREATE TABLE IF NOT EXISTS "+ obj_type + "Counts" +"(procExec integer, counts integer)")
+                            con.sql("INSERT INTO " + obj_type + "Counts" + " SELECT procExec, COUNT(*) as counts FROM "+ obj_type +" GROUP BY procExec ORDER BY procExec ASC")
+                            con.commit()
                         logging.info("Done computing counts for " + obj_type)
-                        con.commit()
 
                 logging.info("Done computing counts")
-                n = len(self.object_types)
-                for i in tqdm(range(n), desc=("Computing pairwise scores")):
-                    for j in tqdm(range(i, n)):
-                        if i == j:
-                            self.pairwise_score[i][i] = 1
-                        else:
-                            ot1 = self.object_types[i]
-                            ot2 = self.object_types[j]
+                # process executions with equal edge sets are scored once, as variant
+                use_variants = self.duckdb_config is None or self.duckdb_config.get("variants", True)
+                variants = {}
+                if use_variants:
+                    for obj_type in tqdm(self.object_types, desc="Computing variants"):
+                        if not self.counts_precomputed or not has_table(con, obj_type + "VariantsCounts"):
+                            with metrics.timed("variants", context=obj_type):
+                                num_members, num_variants = create_variant_tables(con, obj_type)
+                            metrics.gauge("variants", num_variants, context=obj_type)
+                            logging.info(f"{obj_type}: {num_variants} variants of {num_members} process executions")
+                        variants[obj_type] = variant_members(con, obj_type)
+                tables = {obj_type: obj_type + "Variants" if use_variants else obj_type
+                          for obj_type in self.object_types}
+                key = "variant" if use_variants else "procExec"
+                num_proc_execs = {stats["objecttype"]: stats["numProcExecs"] for stats in get_view_stats(con).values()}
+                # nearest-context search instead of the join, edge set indices are built once per table
+                nearest = self.duckdb_config is not None and self.duckdb_config.get("nearest", False)
+                edge_set_indices = {}
+                sharded = None
+                if not nearest and self.duckdb_config is not None and self.duckdb_config.get("shards") is not None:
+                    sharded = ShardedPairScorer(con, self.duckdb_config["shards"], key=key,
+                                                queue_dir=self.duckdb_config.get("shard_queue"),
+                                                num_workers=self.duckdb_config.get("shard_workers"),
+                                                worker_threads=self.duckdb_config.get("threads"),
+                                                lease=self.duckdb_config.get("shard_lease"),
+                                                timeout=self.duckdb_config.get("shard_timeout"))
+                # the local workers and the queue are closed also if scoring fails
+                try:
+                    if sharded is not None:
+                        sharded.submit([(tables[self.object_types[i]], tables[self.object_types[j]])
+                                        for i, j in missing_pairs])
+                    for i, j in tqdm(missing_pairs, desc=("Computing pairwise scores")):
+                        ot1 = self.object_types[i]
+                        ot2 = self.object_types[j]
+                        pair_start_time = time.perf_counter()
 
-                            # todo what to do with empty tables? what is the semantics?
-                            df = con.sql(f'''WITH intersectEdges AS 
-                               (SELECT obj1.procExec as o1contexts, obj2.procExec as o2contexts, COUNT(*) as intersectCounts
-                                FROM {ot1} obj1, {ot2} obj2
+                        # todo what to do with empty tables? what is the semantics?
+                        if nearest:
+                            for table in (tables[ot1], tables[ot2]):
+                                if table not in edge_set_indices:
+                                    with metrics.timed("edge_set_index", context=table):
+                                        edge_set_indices[table] = edge_set_index(con, table, key,
+                                                                                 None if in_memory else self.db_name)
+                            max_sim_per_o1contexts, max_sim_per_o2contexts, num_join_rows = \
+                                nearest_max_sims(edge_set_indices[tables[ot1]], edge_set_indices[tables[ot2]])
+                        elif sharded is not None:
+                            max_sim_per_o1contexts, max_sim_per_o2contexts, num_join_rows = \
+                                max_sims_per_context(sharded.pair_similarities(tables[ot1], tables[ot2]))
+                            sharded.release(tables[ot1], tables[ot2])
+                        else:
+                            t1, t2 = tables[ot1], tables[ot2]
+                            result = con.execute(f'''WITH intersectEdges AS 
+                               (SELECT obj1.{key} as o1contexts, obj2.{key} as o2contexts, COUNT(*) as intersectCounts
+                                FROM {t1} obj1, {t2} obj2
                                 WHERE obj1.edge = obj2.edge 
-                                GROUP BY obj1.procExec, obj2.procExec)
+                                GROUP BY obj1.{key}, obj2.{key})
                             SELECT intersectEdges.o1contexts, intersectEdges.o2contexts, 
                                 CASE WHEN obj1Counts.counts > 0 OR obj2Counts.counts > 0 THEN (SELECT intersectEdges.intersectCounts / (obj1Counts.counts + obj2Counts.counts - intersectEdges.intersectCounts)) ELSE 0 END AS sim
-                            FROM intersectEdges, {ot1 + "Counts"} obj1Counts, {ot2 + "Counts"} obj2Counts
-                            WHERE intersectEdges.o1contexts = obj1Counts.procExec AND intersectEdges.o2contexts = obj2Counts.procExec''').fetchdf()
-
-                            max_sim_per_o1contexts = df.groupby('o1contexts')['sim'].max().reset_index()
-                            max_sim_per_o2contexts = df.groupby('o2contexts')['sim'].max().reset_index()
+                            FROM intersectEdges, {t1 + "Counts"} obj1Counts, {t2 + "Counts"} obj2Counts
+                            WHERE intersectEdges.o1contexts = obj1Counts.{key} AND intersectEdges.o2contexts = obj2Counts.{key}''')
+                            max_sim_per_o1contexts, max_sim_per_o2contexts, num_join_rows = max_sims_per_context(result)
 
-                            #print(max_sim_per_o2contexts)
-                            #print(max_sim_per_o1contexts)
+                        #print(max_sim_per_o2contexts)
+                        #print(max_sim_per_o1contexts)
 
-                            # Sum the maximum 'sim' values
+                        # Sum the maximum 'sim' values
+                        if use_variants:
+                            sum_max_sim = weighted_sum(max_sim_per_o1contexts, 'o1contexts', variants[ot1][1]) + \
+                                          weighted_sum(max_sim_per_o2contexts, 'o2contexts', variants[ot2][1])
+                        else:
                             sum_max_sim = max_sim_per_o1contexts['sim'].sum() + max_sim_per_o2contexts['sim'].sum()
 
-                            # need to get num of all process executions in case one does not share any edge with another process execution
-                            # (i.e. not participating in the join above)
-                            # will be implicitly incl in sum through adding 0, but needs to be accounted for in total number of process executions
-                            ot1_numProcExecs = con.sql(f'''SELECT numProcExecs FROM viewmeta WHERE objecttype = '{ot1}';''').fetchone()[0]
-                            ot2_numProcExecs = con.sql(
-                                f'''SELECT numProcExecs FROM viewmeta WHERE objecttype = '{ot2}';''').fetchone()[0]
+                        # need to get num of all process executions in case one does not share any edge with another process execution
+                        # (i.e. not participating in the join above)
+                        # will be implicitly incl in sum through adding 0, but needs to be accounted for in total number of process executions
+                        ot1_numProcExecs = num_proc_execs[ot1]
+                        ot2_numProcExecs = num_proc_execs[ot2]
+
+                        # Count the number of unique values in 'o1contexts' and 'o2contexts'
+                        #num_unique_o1contexts = df['o1contexts'].nunique()
+                        #num_unique_o2contexts = df['o2contexts'].nunique()
+                        #print(ot1, ot2, num_unique_o1contexts, num_unique_o2contexts)
+
+                        # Calculate the result
+                        sim = sum_max_sim / (ot1_numProcExecs + ot2_numProcExecs)
 
-                            # Count the number of unique values in 'o1contexts' and 'o2contexts'
-                            #num_unique_o1contexts = df['o1contexts'].nunique()
-                            #num_unique_o2contexts = df['o2contexts'].nunique()
-                            #print(ot1, ot2, num_unique_o1contexts, num_unique_o2contexts)
+                        self.pairwise_score[i][j] = sim
+                        self.pairwise_score[j][i] = sim
+                        metrics.timing("pair_score", time.perf_counter() - pair_start_time, context1=ot1, context2=ot2)
+                        metrics.count("pair_join_rows", num_join_rows, context1=ot1, context2=ot2)
+                        metrics.sample_duckdb_memory(con, stage="score")
 
-                            # Calculate the result
-                            sim = sum_max_sim / (ot1_numProcExecs + ot2_numProcExecs)
+                        if self.score_store is not None:
+                            if use_variants:
+                                max_sim_per_o1contexts = proc_exec_maxima(max_sim_per_o1contexts, 'o1contexts',
+                                                                          variants[ot1][0])
+                                max_sim_per_o2contexts = proc_exec_maxima(max_sim_per_o2contexts, 'o2contexts',
+                                                                          variants[ot2][0])
+                            self.score_store.put_pair(ot1, versions[ot1], ot2, versions[ot2], sim,
+                                                      max_sim_per_o1contexts['o1contexts'].to_numpy(),
+                                                      max_sim_per_o1contexts['sim'].to_numpy(),
+                                                      max_sim_per_o2contexts['o2contexts'].to_numpy(),
+                                                      max_sim_per_o2contexts['sim'].to_numpy())
+                finally:
+                    if sharded is not None:
+                        sharded.close()
 
-                            self.pairwise_score[i][j] = sim
-                            self.pairwise_score[j][i] = sim
+                if self.score_store is not None:
+                    self.score_store.save()
 
     ''' 
     Computes the similarity scores for all views - overall and pairwise - and stores them for later use.
@@ -0,0 +1,318 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import duckdb
+
+from src.util import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+queue_dirs = ["shards", "tasks", "claimed", "done", "failed", "partials"]
+poll_interval = 0.05
+# seconds a claim stays valid without renewal, workers renew the claims of running tasks every third of it
+lease_seconds = 60
+
+
+def init_queue(queue_dir):
+    for name in queue_dirs:
+        os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+
+
+def write_atomic(path, content):
+    # readers never see a partially written file, renames within one directory are atomic
+    temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def partial_intersect_counts(queue_dir, task):
+    """
+    Computes the (o1contexts, o2contexts, intersectCounts) aggregate of one shard of a pair of context tables and
+    writes it as Parquet file to the partials of the queue. All occurrences of an edge are in the same shard, so the
+    intersect counts of a pair of process executions are the sum of their partial counts over all shards.
+    """
+    shard1, shard2, partial = (os.path.join(queue_dir, task[name]) for name in ("shard1", "shard2", "partial"))
+    # a requeued task can run twice, each run writes its own temporary file
+    temp_partial = f"{partial}.{uuid.uuid4().hex[:8]}.tmp"
+    with duckdb.connect() as con:
+        if "threads" in task:
+            con.sql(f"SET threads = {int(task['threads'])}")
+        con.sql(f'''COPY (SELECT obj1.procExec AS o1contexts, obj2.procExec AS o2contexts, COUNT(*) AS intersectCounts
+                    FROM read_parquet('{shard1}') obj1, read_parquet('{shard2}') obj2
+                    WHERE obj1.edge = obj2.edge
+                    GROUP BY obj1.procExec, obj2.procExec)
+                    TO '{temp_partial}' (FORMAT PARQUET)''')
+    os.replace(temp_partial, partial)
+
+
+def claim_task(queue_dir):
+    """
+    @return: tuple (task id, task) of a pending task, moved to the claimed tasks; None if no task is pending. The
+             modification time of the claimed task file is the start of the lease.
+    """
+    for file_name in sorted(os.listdir(os.path.join(queue_dir, "tasks"))):
+        if not file_name.endswith(".json"):
+            continue
+        claimed = os.path.join(queue_dir, "claimed", file_name)
+        try:
+            # of several workers renaming the same task, exactly one succeeds
+            os.rename(os.path.join(queue_dir, "tasks", file_name), claimed)
+            os.utime(claimed)
+            with open(claimed) as f:
+                return file_name[:-len(".json")], json.load(f)
+        except FileNotFoundError:
+            # claimed by another worker, or requeued right after the claim
+            continue
+    return None
+
+
+def renew_lease(claimed, lease, stopped):
+    """
+    Renews the lease of a claimed task until stopped is set.
+    """
+    while not stopped.wait(lease / 3):
+        try:
+            os.utime(claimed)
+        except FileNotFoundError:
+            # requeued by the coordinator, the task runs again elsewhere
+            return
+
+
+def run_worker(queue_dir, exit_when_idle=False, stop_event=None):
+    """
+    Worker loop of the file queue: claims tasks until the queue is stopped by a stop file in the queue directory, or
+    until stop_event is set (or, with exit_when_idle, until no task is pending). The queue is a directory, so workers
+    on other hosts take part through a shared file system.
+
+    @param stop_event: event stopping only this worker (after its current task), None to run until the queue is stopped
+    """
+    init_queue(queue_dir)
+    stop_file = os.path.join(queue_dir, "stop")
+    while not os.path.exists(stop_file) and not (stop_event is not None and stop_event.is_set()):
+        claimed = claim_task(queue_dir)
+        if claimed is None:
+            if exit_when_idle:
+                return
+            time.sleep(poll_interval)
+            continue
+        task_id, task = claimed
+        stopped = threading.Event()
+        renewal = threading.Thread(target=renew_lease, daemon=True,
+                                   args=(os.path.join(queue_dir, "claimed", task_id + ".json"),
+                                         task.get("lease", lease_seconds), stopped))
+        renewal.start()
+        try:
+            start_time = time.perf_counter()
+            partial_intersect_counts(queue_dir, task)
+            write_atomic(os.path.join(queue_dir, "done", task_id + ".json"),
+                         json.dumps({"host": os.uname().nodename, "seconds": time.perf_counter() - start_time}))
+        except Exception as e:
+            logging.exception(f"Shard task {task_id} failed")
+            write_atomic(os.path.join(queue_dir, "failed", task_id + ".json"), json.dumps({"error": repr(e)}))
+        finally:
+            stopped.set()
+            renewal.join()
+
+
+class LocalShardWorkers:
+
+    """
+    Local stand-in for the worker hosts: runs num_workers worker processes on the queue until closed. They are stopped
+    by an event of their own, the queue directory may be shared with remote workers that keep running.
+    """
+    def __init__(self, queue_dir, num_workers):
+        context = multiprocessing.get_context("spawn")
+        self.queue_dir = queue_dir
+        self.stop_event = context.Event()
+        self.processes = [context.Process(target=run_worker, args=(queue_dir,), kwargs={"stop_event": self.stop_event},
+                                          daemon=True)
+                          for _ in range(num_workers)]
+        for process in self.processes:
+            process.start()
+
+    def alive(self):
+        return any(process.is_alive() for process in self.processes)
+
+    def close(self):
+        self.stop_event.set()
+        for process in self.processes:
+            process.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ShardedPairScorer:
+
+    """
+    Coordinator of the sharded pairwise scoring. Context tables are hash-partitioned by edge into num_shards Parquet
+    shards in the queue directory, and every pair of context tables becomes one task per shard. Workers (local
+    processes or remote hosts sharing the queue directory) compute the partial intersect counts per shard; the
+    coordinator sums the partials per pair of process executions and joins them with the counts tables, which yields
+    the same (o1contexts, o2contexts, sim) rows as the join on the whole tables.
+
+    @param con: connection to the database with the context tables and their counts tables
+    @param num_shards: number of shards per context table
+    @param queue_dir: directory of shards, tasks and partial results (default: new temp directory, removed on close)
+    @param num_workers: number of local worker processes, 0 if only remote workers serve the queue
+    @param worker_threads: number of DuckDB threads of a worker per task
+    @param key: column of the context tables and counts tables identifying a process execution (or variant)
+    @param lease: seconds a claim stays valid without renewal, tasks of workers that stopped renewing are requeued
+    @param timeout: seconds to wait for the tasks of a pair before giving up, None to wait as long as workers are
+                    alive (local workers) or the queue is served (remote workers)
+    """
+    def __init__(self, con, num_shards, queue_dir=None, num_workers=None, worker_threads=None, key="procExec",
+                 lease=None, timeout=None):
+        self.con = con
+        self.key = key
+        self.num_shards = num_shards
+        self.owns_queue_dir = queue_dir is None
+        self.queue_dir = tempfile.mkdtemp(prefix="shard_queue_") if queue_dir is None else queue_dir
+        self.worker_threads = worker_threads
+        self.lease = lease_seconds if lease is None else lease
+        self.timeout = timeout
+        self.run_id = uuid.uuid4().hex[:8]
+        self.partitioned = set()
+        self.pair_tasks = {}
+        init_queue(self.queue_dir)
+        num_workers = min(num_shards, os.cpu_count() or 1) if num_workers is None else num_workers
+        self.workers = LocalShardWorkers(self.queue_dir, num_workers) if num_workers > 0 else None
+        logging.info(f"Sharded scoring with {num_shards} shards and {num_workers} local workers in {self.queue_dir}")
+
+    def shard_path(self, context, shard):
+        return os.path.join("shards", self.run_id, context, f"{shard}.parquet")
+
+    def partition(self, context):
+        """
+        Writes the shards of a context table, each occurrence of an edge goes to shard hash(edge) % num_shards.
+        """
+        if context in self.partitioned:
+            return
+        os.makedirs(os.path.join(self.queue_dir, "shards", self.run_id, context), exist_ok=True)
+        with metrics.timed("partition", context=context):
+            for shard in range(self.num_shards):
+                self.con.sql(f'''COPY (SELECT edge, {self.key} AS procExec FROM {context}
+                                 WHERE hash(edge) % {self.num_shards} = {shard})
+                                 TO '{os.path.join(self.queue_dir, self.shard_path(context, shard))}'
+                                 (FORMAT PARQUET)''')
+        self.partitioned.add(context)
+
+    def submit(self, pairs):
+        """
+        Partitions the context tables of the pairs and queues one task per pair and shard.
+
+        @param pairs: list of pairs of context table names
+        """
+        for context1, context2 in pairs:
+            self.partition(context1)
+            self.partition(context2)
+            task_ids = []
+            for shard in range(self.num_shards):
+                task_id = f"{self.run_id}_{context1}_{context2}_{shard}"
+                task = {"shard1": self.shard_path(context1, shard), "shard2": self.shard_path(context2, shard),
+                        "partial": os.path.join("partials", task_id + ".parquet"), "lease": self.lease}
+                if self.worker_threads is not None:
+                    task["threads"] = self.worker_threads
+                write_atomic(os.path.join(self.queue_dir, "tasks", task_id + ".json"), json.dumps(task))
+                task_ids.append(task_id)
+            self.pair_tasks[(context1, context2)] = task_ids
+
+    def wait(self, task_ids):
+        """
+        Waits until the tasks are done. Claims whose lease expired are requeued, so the tasks of a worker that died
+        are taken over by the others.
+        """
+        pending = set(task_ids)
+        start_time = time.monotonic()
+        while len(pending) > 0:
+            for task_id in list(pending):
+                failed = os.path.join(self.queue_dir, "failed", task_id + ".json")
+                if os.path.exists(failed):
+                    with open(failed) as f:
+                        raise RuntimeError(f"Shard task {task_id} failed: {json.load(f)['error']}")
+                if os.path.exists(os.path.join(self.queue_dir, "done", task_id + ".json")):
+                    pending.remove(task_id)
+                    continue
+                self.requeue_if_expired(task_id)
+            if len(pending) == 0:
+                break
+            if self.workers is not None and not self.workers.alive():
+                raise RuntimeError(f"Local shard workers exited with {len(pending)} tasks pending")
+            if self.timeout is not None and time.monotonic() - start_time > self.timeout:
+                raise TimeoutError(f"{len(pending)} shard tasks not done after {self.timeout} seconds")
+            time.sleep(poll_interval)
+
+    def requeue_if_expired(self, task_id):
+        claimed = os.path.join(self.queue_dir, "claimed", task_id + ".json")
+        try:
+            if time.time() - os.path.getmtime(claimed) <= self.lease:
+                return
+            os.rename(claimed, os.path.join(self.queue_dir, "tasks", task_id + ".json"))
+        except FileNotFoundError:
+            # not claimed, or done or requeued meanwhile
+            return
+        logging.warning(f"Lease of shard task {task_id} expired, requeued")
+        metrics.count("shard_requeue")
+
+    def pair_similarities(self, context1, context2):
+        """
+        Waits for the shard tasks of a submitted pair and merges their partial results.
+
+        @return: DuckDB result with the rows (o1contexts, o2contexts, sim) of the pair
+        """
+        task_ids = self.pair_tasks[(context1, context2)]
+        with metrics.timed("shard_wait", context1=context1, context2=context2):
+            self.wait(task_ids)
+        partials = ", ".join(f"'{os.path.join(self.queue_dir, 'partials', task_id + '.parquet')}'"
+                             for task_id in task_ids)
+        return self.con.execute(f'''WITH intersectEdges AS
+                   (SELECT o1contexts, o2contexts, SUM(intersectCounts) AS intersectCounts
+                    FROM read_parquet([{partials}])
+                    GROUP BY o1contexts, o2contexts)
+                SELECT intersectEdges.o1contexts, intersectEdges.o2contexts,
+                    CASE WHEN obj1Counts.counts > 0 OR obj2Counts.counts > 0 THEN (SELECT intersectEdges.intersectCounts / (obj1Counts.counts + obj2Counts.counts - intersectEdges.intersectCounts)) ELSE 0 END AS sim
+                FROM intersectEdges, {context1 + "Counts"} obj1Counts, {context2 + "Counts"} obj2Counts
+                WHERE intersectEdges.o1contexts = obj1Counts.{self.key} AND intersectEdges.o2contexts = obj2Counts.{self.key}''')
+
+    def release(self, context1, context2):
+        """
+        Removes the task files and partial results of a scored pair.
+        """
+        for task_id in self.pair_tasks.pop((context1, context2)):
+            # a requeued task can be done while its copy is still queued or claimed
+            for name in ("tasks", "claimed", "done"):
+                if os.path.exists(os.path.join(self.queue_dir, name, task_id + ".json")):
+                    os.remove(os.path.join(self.queue_dir, name, task_id + ".json"))
+            os.remove(os.path.join(self.queue_dir, "partials", task_id + ".parquet"))
+
+    def close(self):
+        if self.workers is not None:
+            self.workers.close()
+        if self.owns_queue_dir:
+            shutil.rmtree(self.queue_dir, ignore_errors=True)
+        else:
+            shutil.rmtree(os.path.join(self.queue_dir, "shards", self.run_id), ignore_errors=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Worker for sharded pairwise scoring.")
+    parser.add_argument("queue_dir", type=str, help="Queue directory of the coordinator (shared file system)")
+    parser.add_argument("--exit_when_idle", action="store_true", help="Exit once no task is pending")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_worker(args.queue_dir, exit_when_idle=args.exit_when_idle)
@@ -0,0 +1,101 @@
+import numpy as np
+
+from src.util.view_tables import has_table
+
+# number of bytes of the bitsets processed per pass step, bounds the memory of the intermediate arrays
+chunk_bytes = 1 << 20
+
+popcount_table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(packed, axis=-1):
+    """
+    @param packed: uint8 array of packed bits
+    @return: number of set bits along the axis
+    """
+    if hasattr(np, "bitwise_count"):
+        counts = np.bitwise_count(packed)
+    else:
+        counts = popcount_table[packed]
+    return counts.sum(axis=axis, dtype=np.int64)
+
+
+def coverage_stats(bitsets, chunk_size=chunk_bytes):
+    """
+    Event coverage of a selection of views in a single pass over their packed event bitsets (np.packbits of a bool
+    array over the event ordinals of the log).
+
+        @param bitsets: list of the packed bitsets of the selected views, in selection order
+        @return: tuple (array of the events covered by each view, array of the events covered by the first k + 1
+                 views for each k, matrix of the events covered by both of each pair of views)
+    """
+    num_views = len(bitsets)
+    num_bytes = max((len(bitset) for bitset in bitsets), default=0)
+    covered = np.zeros(num_views, dtype=np.int64)
+    cumulative = np.zeros(num_views, dtype=np.int64)
+    overlaps = np.zeros((num_views, num_views), dtype=np.int64)
+    for start in range(0, num_bytes, chunk_size):
+        block = np.zeros((num_views, min(chunk_size, num_bytes - start)), dtype=np.uint8)
+        for i, bitset in enumerate(bitsets):
+            chunk = np.frombuffer(bitset, dtype=np.uint8)[start:start + chunk_size]
+            block[i, :len(chunk)] = chunk
+        covered += popcount(block)
+        cumulative += popcount(np.bitwise_or.accumulate(block, axis=0))
+        for i in range(num_views):
+            overlaps[i] += popcount(block[i] & block)
+    return covered, cumulative, overlaps
+
+
+def stored_coverage(con, view_indices=None):
+    """
+        @param con: open duckdb connection to the view database
+        @param view_indices: indices of the views to fetch the coverage of (default: all views)
+        @return: dict of view index to tuple (number of events of the log, packed bitset of the covered events) from
+                 the viewcoverage table, None if the table does not exist
+    """
+    if not has_table(con, "viewcoverage"):
+        return None
+    query = "SELECT viewIdx, numEventsTotal, covered FROM viewcoverage"
+    if view_indices is not None:
+        if len(view_indices) == 0:
+            return {}
+        query += " WHERE viewIdx IN (" + ", ".join(str(int(i)) for i in view_indices) + ")"
+    return {view_idx: (num_events_total, bitset) for view_idx, num_events_total, bitset in con.sql(query).fetchall()}
+
+
+def selection_coverage(con, view_indices, stored=None):
+    """
+    Event coverage statistics of a view selection from the viewcoverage table of a view database.
+
+        @param con: open duckdb connection to the view database, unused if stored is given
+        @param view_indices: indices of the selected views, in selection order
+        @param stored: coverage of the views as returned by stored_coverage, if already fetched
+        @return: dict with the number of events of the log (numEventsTotal) and, per selected view, the events it
+                 covers (covered), the events covered by the views selected up to it (cumulative) and the events it
+                 shares with each selected view (overlaps); None if the coverage of a selected view is not stored
+    """
+    if stored is None:
+        stored = stored_coverage(con, view_indices)
+    if stored is None or any(view_idx not in stored for view_idx in view_indices):
+        return None
+    covered, cumulative, overlaps = coverage_stats([stored[view_idx][1] for view_idx in view_indices])
+    return {"numEventsTotal": max((int(stored[view_idx][0]) for view_idx in view_indices), default=0),
+            "covered": covered.tolist(), "cumulative": cumulative.tolist(), "overlaps": overlaps.tolist()}
+
+
+def add_coverage_to_results(result_json, coverage):
+    """
+    Adds the coverage statistics of selection_coverage to the results of a view selection.
+    """
+    if coverage is None:
+        return
+    num_events_total = coverage["numEventsTotal"]
+    result_json["num_events_total"] = num_events_total
+    for k, results_for_k in enumerate(result_json["selected_views"]):
+        results_for_k["event_coverage"] = coverage["covered"][k] / num_events_total if num_events_total > 0 else 0.0
+        results_for_k["cumulative_events_covered"] = coverage["cumulative"][k]
+        results_for_k["cumulative_event_coverage"] = \
+            coverage["cumulative"][k] / num_events_total if num_events_total > 0 else 0.0
+    result_json["event_overlaps"] = {"object_types": [results_for_k["object_type"]
+                                                      for results_for_k in result_json["selected_views"]],
+                                     "overlaps": coverage["overlaps"]}
@@ -0,0 +1,205 @@
+import logging
+
+from src.util import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+
+class CypherQueryLibrary:
+
+    """
+    Fixed Cypher query shapes for the EKG context queries. Values (object ids, types, id lists) are passed as Bolt
+    parameters and never rendered into the query text, so every call of a shape sends the same text and Neo4j can
+    reuse the cached plan. Path lengths are part of the shape as bounds of a variable-length pattern, which yields
+    one text per path length. Queries feeding a resumable index construction (entities, their REL edges and event
+    ids) return their rows ordered by id, so that an interrupted run sees the same order when it resumes.
+
+    @param entity_id_attr, entity_type_attr, event_time_attr, event_activity_attr: property names in the EKG
+    @param df_entity_id_attr: property of the :DF relationships with the id of the entity whose consecutive events
+                              they connect (default: entity_id_attr)
+    """
+    def __init__(self, entity_id_attr, entity_type_attr, event_time_attr, event_activity_attr,
+                 df_entity_id_attr=None):
+        self.entity_id_attr = entity_id_attr
+        self.entity_type_attr = entity_type_attr
+        self.event_time_attr = event_time_attr
+        self.event_activity_attr = event_activity_attr
+        self.df_entity_id_attr = entity_id_attr if df_entity_id_attr is None else df_entity_id_attr
+        self.texts = {}
+
+    @staticmethod
+    def from_ekg_queries():
+        """
+        Query library for the property names configured in ekg_queries.
+        """
+        from src.util import ekg_queries
+        return CypherQueryLibrary(ekg_queries.entity_id_attr, ekg_queries.entity_type_attr,
+                                  ekg_queries.event_time_attr, ekg_queries.event_activity_attr,
+                                  ekg_queries.df_entity_id_attr)
+
+    def query(self, shape, **shape_args):
+        """
+        @param shape: name of the query shape
+        @param shape_args: arguments changing the query text, e.g. path lengths
+        @return: tuple (shape key, query text), the text is built once per shape key
+        """
+        key = shape + "".join(f"_{name}{value}" for name, value in sorted(shape_args.items()))
+        if key not in self.texts:
+            self.texts[key] = getattr(self, "__" + shape + "__")(**shape_args)
+        return key, self.texts[key]
+
+    def __event_list__(self):
+        return f'''collect({{id: elementId(e), timestamp: e.{self.event_time_attr},
+                           activity: e.{self.event_activity_attr}}}) AS eventList'''
+
+    def __entity_types__(self):
+        return f'''
+                MATCH (e:Entity)
+                RETURN DISTINCT e.{self.entity_type_attr} AS type
+                ORDER BY type
+                '''
+
+    def __objects_of_type__(self):
+        return f'''
+                MATCH (ent:Entity)
+                WHERE ent.{self.entity_type_attr} = $type
+                RETURN ent.{self.entity_id_attr} AS id
+                ORDER BY id
+                '''
+
+    def __entities__(self):
+        return f'''
+                MATCH (ent:Entity)
+                RETURN ent.{self.entity_id_attr} AS id, ent.{self.entity_type_attr} AS type
+                ORDER BY id
+                '''
+
+    def __rel_edges__(self):
+        return f'''
+                MATCH (ent1:Entity)-[:REL]->(ent2:Entity)
+                RETURN ent1.{self.entity_id_attr} AS o1, ent2.{self.entity_id_attr} AS o2
+                ORDER BY o1, o2
+                '''
+
+    def __neighbors_at_path_length__(self, path_length):
+        return f'''
+                MATCH (ent:Entity)
+                WHERE ent.{self.entity_id_attr} = $objId
+                MATCH (ent)-[:REL*{path_length}..{path_length}]-(ent2:Entity)
+                RETURN DISTINCT ent2.{self.entity_id_attr} AS ent2Id, ent2.{self.entity_type_attr} AS entType
+                '''
+
+    def __object_pairs_at_path_length__(self, path_length, same_type):
+        if same_type:
+            pair_condition = f"ent1.{self.entity_id_attr} > ent2.{self.entity_id_attr}"
+        else:
+            pair_condition = "ent1 <> ent2"
+        return f'''
+                MATCH (ent1:Entity)-[:REL*{path_length}..{path_length}]-(ent2:Entity)
+                WHERE ent1.{self.entity_type_attr} = $type1 AND ent2.{self.entity_type_attr} = $type2
+                    AND {pair_condition}
+                RETURN DISTINCT ent1.{self.entity_id_attr} AS o1, ent2.{self.entity_id_attr} AS o2
+                '''
+
+    def __events_for_objects__(self):
+        return f'''
+                MATCH (e:Event)-[:CORR]->(ent:Entity)
+                WHERE ent.{self.entity_id_attr} IN $objectIds
+                WITH DISTINCT e
+                ORDER BY e.{self.event_time_attr}, elementId(e)
+                RETURN {self.__event_list__()}
+                '''
+
+    def __partial_order_for_objects__(self):
+        # DF relationships (one per entity and pair of its consecutive events) of the objects, a DF relationship of
+        # another entity between events of an object does not relate them
+        return f'''
+                MATCH (e:Event)-[:CORR]->(ent:Entity)
+                WHERE ent.{self.entity_id_attr} IN $objectIds
+                WITH DISTINCT e
+                ORDER BY e.{self.event_time_attr}, elementId(e)
+                WITH {self.__event_list__()}
+                OPTIONAL MATCH (n:Event)-[:CORR]->(ent:Entity)<-[:CORR]-(m:Event), (n)-[df:DF]->(m)
+                WHERE ent.{self.entity_id_attr} IN $objectIds
+                    AND df.{self.df_entity_id_attr} = ent.{self.entity_id_attr}
+                WITH eventList,
+                    collect(DISTINCT CASE WHEN n IS NULL THEN null ELSE [elementId(n), elementId(m)] END) AS relationList
+                RETURN eventList, relationList
+                '''
+
+    def __events_in_order__(self):
+        return f'''
+                MATCH (e:Event)
+                RETURN elementId(e) AS id, e.{self.event_time_attr} AS timestamp,
+                    e.{self.event_activity_attr} AS activity
+                ORDER BY e.{self.event_time_attr}, elementId(e)
+                '''
+
+    def __entity_event_ids__(self):
+        return f'''
+                MATCH (e:Event)-[:CORR]->(ent:Entity)
+                WHERE ent.{self.entity_id_attr} IN $objectIds
+                RETURN ent.{self.entity_id_attr} AS id, collect(DISTINCT elementId(e)) AS events
+                '''
+
+    def __entity_event_ids_of_type__(self):
+        return f'''
+                MATCH (e:Event)-[:CORR]->(ent:Entity)
+                WHERE ent.{self.entity_type_attr} = $type
+                RETURN ent.{self.entity_id_attr} AS id, collect(DISTINCT elementId(e)) AS events
+                ORDER BY id
+                '''
+
+    def __single_object_contexts__(self):
+        return f'''
+                MATCH (e:Event)-[:CORR]->(ent:Entity)
+                WHERE ent.{self.entity_type_attr} = $type
+                WITH ent, e
+                ORDER BY e.{self.event_time_attr}, elementId(e)
+                WITH ent, {self.__event_list__()}
+                RETURN elementId(ent) AS entID, eventList
+                '''
+
+
+class QueryTextStats:
+
+    """
+    Tracks per query shape how often it is executed and with how many distinct query texts. Neo4j caches plans by
+    query text, so reusing a text is what makes a plan-cache hit possible. The reuse rate is measured on the client and
+    is not the hit rate of the server's query cache, which can still evict or replan a reused text.
+    """
+    def __init__(self):
+        self.executions = {}
+        self.query_texts = {}
+
+    def record(self, shape, query_text):
+        self.executions[shape] = self.executions.get(shape, 0) + 1
+        self.query_texts.setdefault(shape, set()).add(query_text)
+
+    def reuse_rates(self):
+        """
+        @return: dict of shape to dict with executions, number of distinct query texts and the share of executions
+        that resent an already sent query text
+        """
+        return {shape: {"executions": executions,
+                        "query_texts": len(self.query_texts[shape]),
+                        "reuse_rate": (executions - len(self.query_texts[shape])) / executions}
+                for shape, executions in self.executions.items()}
+
+    def reuse_rate(self):
+        executions = sum(self.executions.values())
+        if executions == 0:
+            return None
+        return (executions - sum(len(texts) for texts in self.query_texts.values())) / executions
+
+    def report(self):
+        """
+        Logs the query text reuse rates and records them as metrics gauges.
+        """
+        for shape, stats in self.reuse_rates().items():
+            logging.info(f"Query shape {shape}: {stats['executions']} executions, {stats['query_texts']} query "
+                         f"texts, query text reuse rate {stats['reuse_rate']:.4f}")
+            metrics.gauge("query_text_reuse_rate", stats["reuse_rate"], query=shape)
+        reuse_rate = self.reuse_rate()
+        if reuse_rate is not None:
+            metrics.gauge("query_text_reuse_rate", reuse_rate)
@@ -4,11 +4,15 @@ from promg import Query
 #entity_id_attr = "id"
 #entity_type_attr = "type"
 #event_time_attr = "time"
+#event_activity_attr = "activity"
 
 # for BPI14
 entity_id_attr = "uID"
 entity_type_attr = "EntityType"
 event_time_attr = "timestamp"
+event_activity_attr = "activity"
+# property of the :DF relationships with the id of their entity
+df_entity_id_attr = entity_id_attr
 
 '''
    Applied this query to Order dataset beforehand:
@@ -87,7 +91,8 @@ def get_events_for_objects_query(o1, o2):
                 WHERE ent.{entity_id_attr} = "$o1" OR ent.{entity_id_attr} = "$o2"
                 WITH DISTINCT e
                 ORDER BY e.{event_time_attr}, elementId(e) ''' +\
-               '''WITH collect({id: elementId(e), timestamp: e.'''+ event_time_attr  +'''}) AS eventList
+               '''WITH collect({id: elementId(e), timestamp: e.'''+ event_time_attr  +''', activity: e.''' +\
+               event_activity_attr + '''}) AS eventList
                 RETURN eventList;
                '''
     return Query(query_str=query_str,
@@ -149,9 +154,10 @@ def get_process_instances_multiple_objects(objectIdList):
     query_str = f'''
                     MATCH (e : Event)-[:CORR]->(ent : Entity)
                     WHERE ent.{entity_id_attr} IN $objectIds
-                    WITH e
+                    WITH DISTINCT e
                     ORDER BY e.{event_time_attr} ASC, elementId(e)''' +\
-                ''' WITH collect({id: elementId(e), timestamp: e.''' + event_time_attr +'''}) AS eventList
+                ''' WITH collect({id: elementId(e), timestamp: e.''' + event_time_attr +''', activity: e.''' +\
+                event_activity_attr + '''}) AS eventList
                     RETURN eventList;
                 '''
     #print(query_str)
@@ -160,7 +166,7 @@ def get_process_instances_multiple_objects(objectIdList):
                      "objectIds": objectIds
                  })
 
-''' 
+'''
     Gets instances by leading types as proposed by (Adams, 2022)
     by collecting all event pairs that are connected by a direct follow relation
     and have a common entity in the set of entities that are related to a given leading type object
@@ -170,14 +176,16 @@ def get_process_instances_multiple_objects_partial_order(objectIdList):
     query_str = f'''
                     MATCH (e : Event)-[:CORR]->(ent : Entity)
                     WHERE ent.{entity_id_attr} IN $objectIds
-                    WITH collect(e) as events
-                    UNWIND nodes AS n
-                    UNWIND nodes AS m
-                    MATCH (n)-[:DF]->(m)
-                    MATCH (n)-[:DF]->(commonEntity : Entity)<-[:DF]-(m)
-                    WHERE n <> m AND commonEntity.{entity_id_attr} IN $objectIds''' + \
-                ''' WITH collect({source: elementId(n), target: elementId(m)}) AS eventList
-                    RETURN relationList;
+                    WITH DISTINCT e
+                    ORDER BY e.{event_time_attr} ASC, elementId(e)''' +\
+                ''' WITH collect({id: elementId(e), timestamp: e.''' + event_time_attr +''', activity: e.''' +\
+                event_activity_attr + '''}) AS eventList''' +\
+                f''' OPTIONAL MATCH (n : Event)-[:CORR]->(commonEntity : Entity)<-[:CORR]-(m : Event), (n)-[df : DF]->(m)
+                    WHERE commonEntity.{entity_id_attr} IN $objectIds
+                        AND df.{df_entity_id_attr} = commonEntity.{entity_id_attr}''' + \
+                ''' WITH eventList,
+                        collect(DISTINCT CASE WHEN n IS NULL THEN null ELSE [elementId(n), elementId(m)] END) AS relationList
+                    RETURN eventList, relationList;
                     '''
     return Query(query_str=query_str,
                  template_string_parameters={
@@ -191,7 +199,8 @@ def get_contexts_query_single_object(ot1):
                     MATCH (e : Event)-[:CORR]->(ent : Entity)
                     WITH ent, e
                     ORDER BY e.{event_time_attr}, elementId(e) ''' +\
-                ''' WITH elementId(ent) as entID, collect({id: elementId(e), timestamp: e.''' + event_time_attr +'''}) AS eventList
+                ''' WITH elementId(ent) as entID, collect({id: elementId(e), timestamp: e.''' + event_time_attr +\
+                ''', activity: e.''' + event_activity_attr + '''}) AS eventList
                     RETURN {id1: entID} AS context, eventList;
                 '''
     return Query(query_str=query_str,
@@ -0,0 +1,205 @@
+import logging
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from src.util import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+default_memory_budget = 256 * 1024 * 1024
+
+
+def merge_sequences(sequences):
+    """
+    Merges sorted event-ordinal arrays into one sorted array without duplicates, by a stable sort of their
+    concatenation.
+    """
+    sequences = [sequence for sequence in sequences if len(sequence) > 0]
+    if len(sequences) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if len(sequences) == 1:
+        return sequences[0]
+    merged = np.sort(np.concatenate(sequences), kind="stable")
+    return merged[np.r_[True, merged[1:] != merged[:-1]]]
+
+
+def concatenate_sequences(sequences):
+    """
+    @return: tuple (concatenated values, index of the sequence of each value, offset of each sequence)
+    """
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+    values = np.concatenate([np.asarray(sequence, dtype=np.int64) for sequence in sequences]) \
+        if len(sequences) > 0 else np.zeros(0, dtype=np.int64)
+    offsets = np.zeros(len(sequences), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    return values.astype(np.int64), np.repeat(np.arange(len(sequences)), lengths), offsets
+
+
+def merged_sequence_edges(sequences1, edge_ids1, sequences2, edge_ids2):
+    """
+    Derives the directly-follows edges of the merged event sequences of a batch of entity pairs from the sequences
+    of the entities. Two consecutive events of a merge that both belong to one entity are also consecutive in that
+    entity's sequence, so the edge between them is an edge of the entity and its id is reused. Only the edges at
+    interleaving points, from an event of one entity to an event of only the other, are not known yet.
+
+        @param sequences1, sequences2: sorted event-ordinal arrays of the first and second entity of each pair
+        @param edge_ids1, edge_ids2: ids of the edges between consecutive events of these sequences
+        @return: tuple (merged event ordinals of all pairs, pair index of each merged ordinal, position j in the
+                 merged ordinals of each edge (ordinals j, j + 1), edge id of each edge with -1 at interleaving
+                 points)
+    """
+    values1, seq_of1, offsets1 = concatenate_sequences(sequences1)
+    values2, seq_of2, offsets2 = concatenate_sequences(sequences2)
+    edges1, _, edge_offsets1 = concatenate_sequences(edge_ids1)
+    edges2, _, edge_offsets2 = concatenate_sequences(edge_ids2)
+
+    # sort the events of both entities of all pairs by pair and ordinal, shared events become one merged event
+    pair = np.concatenate([seq_of1, seq_of2])
+    ordinals = np.concatenate([values1, values2])
+    origin = np.repeat(np.array([0, 1], dtype=np.int8), [len(values1), len(values2)])
+    position = np.concatenate([np.arange(len(values1)) - offsets1[seq_of1],
+                               np.arange(len(values2)) - offsets2[seq_of2]])
+    order = np.lexsort((origin, ordinals, pair))
+    pair, ordinals, origin, position = pair[order], ordinals[order], origin[order], position[order]
+    first = np.ones(len(ordinals), dtype=bool)
+    first[1:] = (pair[1:] != pair[:-1]) | (ordinals[1:] != ordinals[:-1])
+    merged_idx = np.cumsum(first) - 1
+    merged_ordinals, merged_pair = ordinals[first], pair[first]
+
+    edge_positions = np.flatnonzero(merged_pair[1:] == merged_pair[:-1])
+    edge_ids = np.full(len(edge_positions), -1, dtype=np.int64)
+    for source, edges, edge_offsets in ((0, edges1, edge_offsets1), (1, edges2, edge_offsets2)):
+        member = np.zeros(len(merged_ordinals), dtype=bool)
+        member_position = np.zeros(len(merged_ordinals), dtype=np.int64)
+        from_source = origin == source
+        member[merged_idx[from_source]] = True
+        member_position[merged_idx[from_source]] = position[from_source]
+        own_edge = member[edge_positions] & member[edge_positions + 1]
+        own_positions = edge_positions[own_edge]
+        edge_ids[own_edge] = edges[edge_offsets[merged_pair[own_positions]] + member_position[own_positions]]
+    return merged_ordinals, merged_pair, edge_positions, edge_ids
+
+
+def unique_per_pair(values, pair):
+    """
+    @return: tuple (distinct values of each pair, sorted by pair and value, pair index of each of them)
+    """
+    order = np.lexsort((values, pair))
+    values, pair = values[order], pair[order]
+    first = np.ones(len(values), dtype=bool)
+    first[1:] = (pair[1:] != pair[:-1]) | (values[1:] != values[:-1])
+    return values[first], pair[first]
+
+
+def union_sequence_edges(sequences1, edge_ids1, sequences2, edge_ids2):
+    """
+    Derives the partial-order edges of a batch of entity pairs: the union of the directly-follows edges of the two
+    entities. Unlike merged_sequence_edges, there are no edges at interleaving points, so every edge id is known.
+
+        @param sequences1, sequences2: sorted event-ordinal arrays of the first and second entity of each pair
+        @param edge_ids1, edge_ids2: ids of the edges between consecutive events of these sequences
+        @return: tuple (merged event ordinals of all pairs, pair index of each merged ordinal, distinct edge ids of
+                 all pairs, pair index of each edge id)
+    """
+    values1, seq_of1, _ = concatenate_sequences(sequences1)
+    values2, seq_of2, _ = concatenate_sequences(sequences2)
+    edges1, edge_of1, _ = concatenate_sequences(edge_ids1)
+    edges2, edge_of2, _ = concatenate_sequences(edge_ids2)
+    ordinals, ordinal_pair = unique_per_pair(np.concatenate([values1, values2]), np.concatenate([seq_of1, seq_of2]))
+    edge_ids, edge_pair = unique_per_pair(np.concatenate([edges1, edges2]), np.concatenate([edge_of1, edge_of2]))
+    return ordinals, ordinal_pair, edge_ids, edge_pair
+
+
+class EventSequenceCache:
+
+    """
+    Per-run cache of the time-ordered event sequence of every entity, as sorted array of event ordinals. Arrays are
+    kept in memory up to memory_budget bytes and evicted in least recently used order; evicted arrays are spilled to
+    disk and read back on their next use instead of being fetched from the graph source again.
+
+    @param fetch: function from a list of entity ids to a dict of entity id to event-ordinal array
+    @param memory_budget: maximum number of bytes of the cached arrays in memory
+    @param spill_dir: parent directory of the spill files (default: system temp directory)
+    """
+    def __init__(self, fetch, memory_budget=default_memory_budget, spill_dir=None):
+        self.fetch = fetch
+        self.memory_budget = memory_budget
+        self.spill_parent_dir = spill_dir
+        self.spill_dir = None
+        self.sequences = OrderedDict()
+        self.spilled = {}
+        self.memory_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "spills": 0, "spill_loads": 0}
+
+    def put(self, entity, sequence):
+        sequence = np.asarray(sequence, dtype=np.int64)
+        if entity in self.sequences:
+            self.memory_bytes -= self.sequences.pop(entity).nbytes
+        self.sequences[entity] = sequence
+        self.memory_bytes += sequence.nbytes
+        self.__evict__()
+
+    def get(self, entity):
+        return self.get_many([entity])[entity]
+
+    def get_many(self, entities):
+        """
+        @return: dict of entity id to its event-ordinal array, fetching the entities that were never cached at once
+        """
+        result = {}
+        missing = []
+        for entity in entities:
+            if entity in self.sequences:
+                self.sequences.move_to_end(entity)
+                result[entity] = self.sequences[entity]
+                self.stats["hits"] += 1
+            elif entity in self.spilled:
+                file_name = self.spilled.pop(entity)
+                result[entity] = np.load(file_name)
+                os.remove(file_name)
+                self.stats["spill_loads"] += 1
+            else:
+                missing.append(entity)
+        if len(missing) > 0:
+            self.stats["misses"] += len(missing)
+            fetched = self.fetch(missing)
+            for entity in missing:
+                result[entity] = np.asarray(fetched.get(entity, []), dtype=np.int64)
+        for entity in entities:
+            if entity not in self.sequences:
+                self.put(entity, result[entity])
+        return result
+
+    def merged(self, entities):
+        """
+        @return: sorted event ordinals of the union of the entities' event sequences
+        """
+        sequences = self.get_many(entities)
+        return merge_sequences([sequences[entity] for entity in entities])
+
+    def __evict__(self):
+        while self.memory_bytes > self.memory_budget and len(self.sequences) > 1:
+            entity, sequence = self.sequences.popitem(last=False)
+            self.memory_bytes -= sequence.nbytes
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix="event_sequences_", dir=self.spill_parent_dir)
+            file_name = os.path.join(self.spill_dir, f"{self.stats['spills']}.npy")
+            np.save(file_name, sequence)
+            self.spilled[entity] = file_name
+            self.stats["spills"] += 1
+
+    def close(self):
+        for name, value in self.stats.items():
+            metrics.count("event_cache_" + name, value)
+        logging.info(f"Event sequence cache: {self.stats['hits']} hits, {self.stats['misses']} misses, "
+                     f"{self.stats['spills']} spills, {self.stats['spill_loads']} spill loads")
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+        self.sequences.clear()
+        self.spilled.clear()
+        self.memory_bytes = 0
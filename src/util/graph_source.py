@@ -0,0 +1,683 @@
+import asyncio
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+
+import duckdb
+import numpy as np
+
+from src.util import metrics
+from src.util.cypher_queries import CypherQueryLibrary, QueryTextStats
+from src.util.metrics import MeteredConnection
+from src.util.rel_graph import RelGraph, to_csr
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+# relations between the events of a process execution: the total time order of its events, or the partial order of
+# the directly-follows relations of its objects
+relation_kinds = ["total", "partial"]
+# file of the REL distance index in the directory of an EKG export
+distance_index_file_name = "rel_distance_index.npz"
+
+
+class GraphSource(ABC):
+
+    """
+    Source of the event knowledge graph (Entity and Event nodes, CORR and REL relationships) the EKG context
+    definitions are computed on. Implementations answer the context queries of the view generation, either against
+    a graph database or in-process. Sources with event ordinals also implement EventOrdinalSource.
+    """
+    @abstractmethod
+    def entity_types(self):
+        """
+        @return: list of distinct entity types
+        """
+        pass
+
+    @abstractmethod
+    def objects_of_type(self, entity_type):
+        """
+        @return: list of ids of the entities of the given type
+        """
+        pass
+
+    @abstractmethod
+    def leading_type_context(self, obj_id, max_path_length=1000, entity_types=None):
+        """
+        Collects the objects related to a leading type object: per entity type, the objects at minimum REL distance.
+
+            @param entity_types: all entity types, the search stops once each of them has been seen
+            @return: list of object ids, starting with obj_id
+        """
+        pass
+
+    @abstractmethod
+    def object_pairs(self, ot1, ot2, max_path_length=10):
+        """
+        Collects the pairs of objects of the two types connected by a REL path of at most max_path_length.
+        For ot1 == ot2, each pair is contained once, with the larger id first.
+
+            @return: set of (object id of type ot1, object id of type ot2)
+        """
+        pass
+
+    def stream_object_pairs(self, ot1, ot2, max_path_length=10):
+        """
+        Yields the pairs of object_pairs in sorted order.
+        """
+        yield from sorted(self.object_pairs(ot1, ot2, max_path_length))
+
+    @abstractmethod
+    def events_for_objects(self, object_ids):
+        """
+        @return: list of the distinct events correlated to any of the objects, ordered by time, as dicts with
+                 id, timestamp and activity
+        """
+        pass
+
+    @abstractmethod
+    def single_object_contexts(self, entity_type):
+        """
+        @return: list with one event list (as returned by events_for_objects) per entity of the given type
+        """
+        pass
+
+    @abstractmethod
+    def partial_order_for_objects(self, object_ids):
+        """
+        Collects the events of the objects with the partial order of the ocpa execution graphs: the directly-follows
+        relations of the single objects (their :DF relationships), instead of the total time order of all events.
+
+            @return: tuple (event list as returned by events_for_objects, list of (source event id, target event id))
+        """
+        pass
+
+    def report_stats(self):
+        """
+        Logs and records statistics of the queries answered so far.
+        """
+        pass
+
+    def refresh(self):
+        """
+        Drops the data cached from the graph, so that events added since are seen by the next queries.
+        """
+        pass
+
+
+class EventOrdinalSource(ABC):
+
+    """
+    Optional interface of graph sources with event ordinals, the position of an event in the time order of all events.
+    The view generation uses the ordinal queries for sources implementing it and falls back to event lists otherwise.
+    """
+    @abstractmethod
+    def event_ordinals(self, object_ids):
+        """
+        @return: dict of object id to the sorted array of the ordinals of its events
+        """
+        pass
+
+    @abstractmethod
+    def entity_event_ordinals(self, entity_type):
+        """
+        @return: iterable of (object id, sorted array of event ordinals) for the entities of the type with events
+        """
+        pass
+
+    @abstractmethod
+    def events_by_ordinals(self, ordinals):
+        """
+        @return: list of the events with the given ordinals, as dicts with id, timestamp and activity
+        """
+        pass
+
+    @abstractmethod
+    def event_activity_codes(self):
+        """
+        @return: int array with an activity code per event ordinal, equal codes for equal activities
+        """
+        pass
+
+    @abstractmethod
+    def event_coverage(self, event_ids):
+        """
+        @return: bool array over the event ordinals, True for the events with the given ids
+        """
+        pass
+
+
+class Neo4jGraphSource(GraphSource, EventOrdinalSource):
+
+    """
+    Graph source answering the context queries on a Neo4j database with the fixed query shapes of
+    CypherQueryLibrary and Bolt parameters, via the official Neo4j driver.
+
+    @param driver: Neo4j driver to use instead of connecting to uri
+    @param queries: CypherQueryLibrary (default: property names configured in ekg_queries)
+    @param use_local_rel_graph: fetch the REL relationships once and answer neighborhood and pair queries on the
+                                local RelGraph (leading type contexts via its RelDistanceIndex) instead of querying
+                                the neighborhood of every object
+    @param distance_index_file: file to keep the RelDistanceIndex in, reused while the REL relationships do not
+                                change (default: built on every run)
+    """
+    def __init__(self, uri="bolt://localhost:7687", user="neo4j", password="12341234", database="neo4j",
+                 driver=None, queries=None, use_local_rel_graph=True, distance_index_file=None):
+        if driver is None:
+            from neo4j import GraphDatabase
+            driver = GraphDatabase.driver(uri, auth=(user, password))
+        self.driver = driver
+        self.database = database
+        self.queries = queries if queries is not None else CypherQueryLibrary.from_ekg_queries()
+        self.query_text_stats = QueryTextStats()
+        self.use_local_rel_graph = use_local_rel_graph
+        self.distance_index_file = distance_index_file
+        self.refresh()
+
+    def refresh(self):
+        self.rel_graph = None
+        self.events = None
+        self.activity_codes = None
+
+    def run(self, shape, shape_args=None, **parameters):
+        """
+        Runs a query shape with the given Bolt parameters.
+
+            @return: list of records as dicts
+        """
+        shape_key, query_text = self.queries.query(shape, **(shape_args or {}))
+        self.query_text_stats.record(shape_key, query_text)
+        start = time.perf_counter()
+        with self.driver.session(database=self.database) as session:
+            records = session.run(query_text, parameters).data()
+        metrics.timing("neo4j_query", time.perf_counter() - start, query=shape)
+        return records
+
+    def entity_types(self):
+        return [record["type"] for record in self.run("entity_types")]
+
+    def objects_of_type(self, entity_type):
+        return [record["id"] for record in self.run("objects_of_type", type=entity_type)]
+
+    def get_rel_graph(self):
+        if self.rel_graph is None:
+            entities = [(record["id"], record["type"]) for record in self.run("entities")]
+            rel = [(record["o1"], record["o2"]) for record in self.run("rel_edges")]
+            self.entity_ids, self.entity_idx, self.rel_graph_types, self.rel_graph = build_rel_graph(entities, rel)
+            self.rel_graph.distance_index_file = self.distance_index_file
+        return self.rel_graph
+
+    def leading_type_context(self, obj_id, max_path_length=1000, entity_types=None):
+        if self.use_local_rel_graph:
+            return leading_type_context_from_index(self.get_rel_graph(), self.entity_ids, self.entity_idx[obj_id],
+                                                   max_path_length)
+        context = [obj_id]
+        types_seen_distance = {}
+        for i in range(max_path_length):
+            # path lengths 0 and 1 both query the direct REL neighbors
+            result = self.run("neighbors_at_path_length", {"path_length": max(1, i)}, objId=obj_id)
+            for record in result:
+                if record['entType'] not in types_seen_distance:
+                    types_seen_distance[record['entType']] = i
+                    context.append(record['ent2Id'])
+                else:
+                    if i <= types_seen_distance[record['entType']]:
+                        context.append(record['ent2Id'])
+            if entity_types is not None:
+                if all([ot in types_seen_distance for ot in entity_types]):
+                    break
+        return context
+
+    def object_pairs(self, ot1, ot2, max_path_length=10):
+        if self.use_local_rel_graph:
+            return set(self.stream_object_pairs(ot1, ot2, max_path_length))
+        obj_pairs = set()
+        for path_length in range(1, max_path_length + 1):
+            result = self.run("object_pairs_at_path_length", {"path_length": path_length, "same_type": ot1 == ot2},
+                              type1=ot1, type2=ot2)
+            obj_pairs.update([(record["o1"], record["o2"]) for record in result])
+        return obj_pairs
+
+    def stream_object_pairs(self, ot1, ot2, max_path_length=10):
+        if not self.use_local_rel_graph:
+            yield from GraphSource.stream_object_pairs(self, ot1, ot2, max_path_length)
+            return
+        yield from stream_object_pairs_from_graph(self.get_rel_graph(), self.entity_ids, self.rel_graph_types,
+                                                  ot1, ot2, max_path_length)
+
+    def events_for_objects(self, object_ids):
+        result = self.run("events_for_objects", objectIds=list(object_ids))
+        return result[0]['eventList'] if len(result) > 0 else []
+
+    def single_object_contexts(self, entity_type):
+        return [record['eventList'] for record in self.run("single_object_contexts", type=entity_type)]
+
+    def partial_order_for_objects(self, object_ids):
+        result = self.run("partial_order_for_objects", objectIds=list(object_ids))
+        return to_partial_order(result[0] if len(result) > 0 else None)
+
+    def get_event_table(self):
+        if self.events is None:
+            self.events = [{"id": record["id"], "timestamp": record["timestamp"], "activity": record["activity"]}
+                           for record in self.run("events_in_order")]
+            self.event_ordinal = {event["id"]: i for i, event in enumerate(self.events)}
+        return self.events
+
+    def __to_ordinals__(self, event_ids):
+        return np.sort(np.array([self.event_ordinal[event_id] for event_id in event_ids], dtype=np.int64))
+
+    def event_ordinals(self, object_ids):
+        self.get_event_table()
+        return {record["id"]: self.__to_ordinals__(record["events"])
+                for record in self.run("entity_event_ids", objectIds=list(object_ids))}
+
+    def entity_event_ordinals(self, entity_type):
+        self.get_event_table()
+        for record in self.run("entity_event_ids_of_type", type=entity_type):
+            yield record["id"], self.__to_ordinals__(record["events"])
+
+    def events_by_ordinals(self, ordinals):
+        events = self.get_event_table()
+        return [events[ordinal] for ordinal in ordinals]
+
+    def event_activity_codes(self):
+        if self.activity_codes is None:
+            self.activity_codes = to_activity_codes(self.get_event_table())
+        return self.activity_codes
+
+    def event_coverage(self, event_ids):
+        covered = np.zeros(len(self.get_event_table()), dtype=bool)
+        covered[self.__to_ordinals__(event_ids)] = True
+        return covered
+
+    def report_stats(self):
+        self.query_text_stats.report()
+
+    def close(self):
+        self.driver.close()
+
+
+class AsyncNeo4jGraphSource:
+
+    """
+    Asynchronous variant of Neo4jGraphSource on the async Neo4j driver, with the same query shapes and methods as
+    coroutines. Used by the leading type index construction to keep up to max_in_flight context queries running
+    concurrently.
+
+    @param max_in_flight: maximum number of concurrently processed objects
+    @param distance_index_file: file to keep the RelDistanceIndex in, as for Neo4jGraphSource
+    """
+    def __init__(self, uri="bolt://localhost:7687", user="neo4j", password="12341234", database="neo4j",
+                 max_in_flight=16, driver=None, queries=None, use_local_rel_graph=True, distance_index_file=None):
+        if driver is None:
+            from neo4j import AsyncGraphDatabase
+            driver = AsyncGraphDatabase.driver(uri, auth=(user, password),
+                                               max_connection_pool_size=max(100, max_in_flight))
+        self.driver = driver
+        self.database = database
+        self.max_in_flight = max_in_flight
+        self.queries = queries if queries is not None else CypherQueryLibrary.from_ekg_queries()
+        self.query_text_stats = QueryTextStats()
+        self.use_local_rel_graph = use_local_rel_graph
+        self.distance_index_file = distance_index_file
+        self.rel_graph = None
+        self.rel_graph_lock = None
+        self.events = None
+
+    async def run(self, shape, shape_args=None, **parameters):
+        shape_key, query_text = self.queries.query(shape, **(shape_args or {}))
+        self.query_text_stats.record(shape_key, query_text)
+        start = time.perf_counter()
+        async with self.driver.session(database=self.database) as session:
+            result = await session.run(query_text, parameters)
+            records = await result.data()
+        metrics.timing("neo4j_query", time.perf_counter() - start, query=shape)
+        return records
+
+    async def entity_types(self):
+        return [record["type"] for record in await self.run("entity_types")]
+
+    async def objects_of_type(self, entity_type):
+        return [record["id"] for record in await self.run("objects_of_type", type=entity_type)]
+
+    async def get_rel_graph(self):
+        if self.rel_graph_lock is None:
+            self.rel_graph_lock = asyncio.Lock()
+        async with self.rel_graph_lock:
+            if self.rel_graph is None:
+                entities = [(record["id"], record["type"]) for record in await self.run("entities")]
+                rel = [(record["o1"], record["o2"]) for record in await self.run("rel_edges")]
+                self.entity_ids, self.entity_idx, self.rel_graph_types, self.rel_graph = build_rel_graph(entities, rel)
+                self.rel_graph.distance_index_file = self.distance_index_file
+        return self.rel_graph
+
+    async def leading_type_context(self, obj_id, max_path_length=1000, entity_types=None):
+        if self.use_local_rel_graph:
+            return leading_type_context_from_index(await self.get_rel_graph(), self.entity_ids,
+                                                   self.entity_idx[obj_id], max_path_length)
+        context = [obj_id]
+        types_seen_distance = {}
+        for i in range(max_path_length):
+            result = await self.run("neighbors_at_path_length", {"path_length": max(1, i)}, objId=obj_id)
+            for record in result:
+                if record['entType'] not in types_seen_distance:
+                    types_seen_distance[record['entType']] = i
+                    context.append(record['ent2Id'])
+                else:
+                    if i <= types_seen_distance[record['entType']]:
+                        context.append(record['ent2Id'])
+            if entity_types is not None:
+                if all([ot in types_seen_distance for ot in entity_types]):
+                    break
+        return context
+
+    async def events_for_objects(self, object_ids):
+        result = await self.run("events_for_objects", objectIds=list(object_ids))
+        return result[0]['eventList'] if len(result) > 0 else []
+
+    async def partial_order_for_objects(self, object_ids):
+        result = await self.run("partial_order_for_objects", objectIds=list(object_ids))
+        return to_partial_order(result[0] if len(result) > 0 else None)
+
+    async def get_event_table(self):
+        if self.events is None:
+            self.events = [{"id": record["id"], "timestamp": record["timestamp"], "activity": record["activity"]}
+                           for record in await self.run("events_in_order")]
+            self.event_ordinal = {event["id"]: i for i, event in enumerate(self.events)}
+        return self.events
+
+    async def event_coverage(self, event_ids):
+        """
+        @return: bool array over the event ordinals, True for the events with the given ids
+        """
+        covered = np.zeros(len(await self.get_event_table()), dtype=bool)
+        covered[[self.event_ordinal[event_id] for event_id in event_ids]] = True
+        return covered
+
+    def report_stats(self):
+        self.query_text_stats.report()
+
+    async def close(self):
+        await self.driver.close()
+
+
+class PromgGraphSource(GraphSource):
+
+    """
+    Graph source answering the context queries with the string-templated Cypher queries of ekg_queries through a
+    promg DatabaseConnection.
+
+    @param connection: promg DatabaseConnection
+    """
+    def __init__(self, connection):
+        self.connection = MeteredConnection(connection)
+
+    def exec_query(self, function, **kwargs):
+        return self.connection.exec_query(function, **kwargs)
+
+    def entity_types(self):
+        from src.util.ekg_queries import get_entity_types_query, entity_type_attr
+        result = self.exec_query(get_entity_types_query)
+        return [record["e." + entity_type_attr] for record in result]
+
+    def objects_of_type(self, entity_type):
+        from src.util.ekg_queries import get_objects_for_leading_type
+        return [record["id"] for record in self.exec_query(get_objects_for_leading_type, **{"ot1": entity_type})]
+
+    def leading_type_context(self, obj_id, max_path_length=1000, entity_types=None):
+        from src.util.ekg_queries import get_objects_for_leading_type_object_iteratively
+        context = [obj_id]
+        types_seen_distance = {}
+        for i in range(max_path_length):
+            result = self.exec_query(get_objects_for_leading_type_object_iteratively,
+                                     **{"objId": obj_id, "path_length": i})
+            for record in result:
+                if record['entType'] not in types_seen_distance:
+                    types_seen_distance[record['entType']] = i
+                    context.append(record['ent2Id'])
+                else:
+                    if i <= types_seen_distance[record['entType']]:
+                        context.append(record['ent2Id'])
+            if entity_types is not None:
+                if all([ot in types_seen_distance for ot in entity_types]):
+                    break
+        return context
+
+    def object_pairs(self, ot1, ot2, max_path_length=10):
+        from src.util.ekg_queries import get_object_pairs_query_iterative
+        obj_pairs = set()
+        for path_length in range(1, max_path_length + 1):
+            obj_pair_result = self.exec_query(get_object_pairs_query_iterative,
+                                              **{"ot1": ot1, "ot2": ot2, "path_length": path_length})
+            obj_pairs.update([(record["o1"], record["o2"]) for record in obj_pair_result])
+        return obj_pairs
+
+    def events_for_objects(self, object_ids):
+        from src.util.ekg_queries import get_process_instances_multiple_objects
+        return self.exec_query(get_process_instances_multiple_objects, **{"objectIdList": list(object_ids)})[0]['eventList']
+
+    def partial_order_for_objects(self, object_ids):
+        from src.util.ekg_queries import get_process_instances_multiple_objects_partial_order
+        result = self.exec_query(get_process_instances_multiple_objects_partial_order,
+                                 **{"objectIdList": list(object_ids)})
+        return to_partial_order(result[0] if len(result) > 0 else None)
+
+    def single_object_contexts(self, entity_type):
+        from src.util.ekg_queries import get_contexts_query_single_object
+        return [record['eventList'] for record in self.exec_query(get_contexts_query_single_object,
+                                                                  **{"ot1": entity_type})]
+
+
+class LocalGraphSource(GraphSource, EventOrdinalSource):
+
+    """
+    Graph source answering the context queries in-process on an EKG export, loaded via DuckDB into NumPy arrays:
+    REL as adjacency lists (CSR) over entity indices and CORR as time-ordered event ordinals per entity.
+    Needs neither a running Neo4j server nor a network round trip per query, and serves as stand-in for tests.
+
+    The export directory contains, as .parquet or .csv files:
+        entities (id, type), events (id, timestamp, activity), corr (event, entity), rel (entity1, entity2)
+
+    Distances are shortest REL path lengths. They match the Cypher queries, as the union of REL paths of length
+    1..k reaches exactly the objects within distance k.
+
+    @param directory: directory of the export files
+    @param store_distance_index: keep the REL distance index in the export directory (distance_index_file_name),
+                                 to reuse it while the REL relationships do not change
+    """
+    def __init__(self, directory, store_distance_index=True):
+        self.directory = directory
+        self.store_distance_index = store_distance_index
+        self.refresh()
+
+    def refresh(self):
+        # the export files are reloaded as a whole
+        directory = self.directory
+        with duckdb.connect() as con:
+            for table in ["entities", "events", "corr", "rel"]:
+                con.sql(f"CREATE TABLE {table} AS SELECT * FROM {self.__table_reader__(table)}")
+
+            entities = con.sql("SELECT id, type FROM entities ORDER BY rowid").fetchall()
+
+            # event ordinal = position in time order, ties broken by position in the export
+            events = con.sql("SELECT id, timestamp, activity FROM events ORDER BY timestamp, rowid").fetchall()
+            self.events = [{"id": event_id, "timestamp": timestamp, "activity": activity}
+                           for event_id, timestamp, activity in events]
+            self.event_ordinal = {event_id: i for i, (event_id, _, _) in enumerate(events)}
+
+            corr = con.sql("SELECT DISTINCT event, entity FROM corr").fetchall()
+            rel = con.sql("SELECT entity1, entity2 FROM rel").fetchall()
+
+        self.entity_ids, self.entity_idx, self.types, self.rel_graph = build_rel_graph(entities, rel)
+        self.entity_type_idx = self.rel_graph.entity_type_idx
+        if self.store_distance_index:
+            self.rel_graph.distance_index_file = os.path.join(directory, distance_index_file_name)
+
+        corr_entities = np.array([self.entity_idx[entity] for _, entity in corr], dtype=np.int64)
+        corr_events = np.array([self.event_ordinal[event] for event, _ in corr], dtype=np.int64)
+        self.corr_offsets, self.corr_events = to_csr(corr_entities, corr_events, len(self.entity_ids))
+        self.activity_codes = None
+        logging.info(f"Loaded graph with {len(self.entity_ids)} entities, {len(self.events)} events, "
+                     f"{len(corr)} CORR and {len(rel)} REL relationships from {directory}")
+
+    def __table_reader__(self, table):
+        parquet_file = os.path.join(self.directory, table + ".parquet")
+        if os.path.exists(parquet_file):
+            return f"read_parquet('{parquet_file}')"
+        return f"read_csv_auto('{os.path.join(self.directory, table + '.csv')}', header=true)"
+
+    def entity_types(self):
+        return list(self.types)
+
+    def objects_of_type(self, entity_type):
+        if entity_type not in self.types:
+            return []
+        type_idx = self.types.index(entity_type)
+        return [self.entity_ids[i] for i in np.flatnonzero(self.entity_type_idx == type_idx)]
+
+    def leading_type_context(self, obj_id, max_path_length=1000, entity_types=None):
+        return leading_type_context_from_index(self.rel_graph, self.entity_ids, self.entity_idx[obj_id],
+                                               max_path_length)
+
+    def object_pairs(self, ot1, ot2, max_path_length=10):
+        return set(self.stream_object_pairs(ot1, ot2, max_path_length))
+
+    def stream_object_pairs(self, ot1, ot2, max_path_length=10):
+        yield from stream_object_pairs_from_graph(self.rel_graph, self.entity_ids, self.types, ot1, ot2,
+                                                  max_path_length)
+
+    def events_for_objects(self, object_ids):
+        indices = [self.entity_idx[obj_id] for obj_id in object_ids if obj_id in self.entity_idx]
+        if len(indices) == 0:
+            return []
+        ordinals = np.unique(np.concatenate([self.corr_events[self.corr_offsets[i]:self.corr_offsets[i + 1]]
+                                             for i in indices]))
+        return [self.events[ordinal] for ordinal in ordinals]
+
+    def partial_order_for_objects(self, object_ids):
+        # the DF relationships of an entity connect its consecutive events in time order
+        sequences = [self.__entity_ordinals__(self.entity_idx[obj_id]) for obj_id in object_ids
+                     if obj_id in self.entity_idx]
+        if len(sequences) == 0:
+            return [], []
+        relations = sorted(set(edge for sequence in sequences
+                               for edge in zip(sequence[:-1].tolist(), sequence[1:].tolist())))
+        return ([self.events[ordinal] for ordinal in np.unique(np.concatenate(sequences))],
+                [(self.events[source]["id"], self.events[target]["id"]) for source, target in relations])
+
+    def single_object_contexts(self, entity_type):
+        contexts = []
+        for obj_id in self.objects_of_type(entity_type):
+            events = self.events_for_objects([obj_id])
+            if len(events) > 0:
+                contexts.append(events)
+        return contexts
+
+    def __entity_ordinals__(self, entity):
+        return self.corr_events[self.corr_offsets[entity]:self.corr_offsets[entity + 1]]
+
+    def event_ordinals(self, object_ids):
+        return {obj_id: self.__entity_ordinals__(self.entity_idx[obj_id])
+                for obj_id in object_ids if obj_id in self.entity_idx}
+
+    def entity_event_ordinals(self, entity_type):
+        for obj_id in self.objects_of_type(entity_type):
+            ordinals = self.__entity_ordinals__(self.entity_idx[obj_id])
+            if len(ordinals) > 0:
+                yield obj_id, ordinals
+
+    def events_by_ordinals(self, ordinals):
+        return [self.events[ordinal] for ordinal in ordinals]
+
+    def event_activity_codes(self):
+        if self.activity_codes is None:
+            self.activity_codes = to_activity_codes(self.events)
+        return self.activity_codes
+
+    def event_coverage(self, event_ids):
+        covered = np.zeros(len(self.events), dtype=bool)
+        covered[[self.event_ordinal[event_id] for event_id in event_ids]] = True
+        return covered
+
+
+def as_graph_source(source):
+    """
+    @param source: GraphSource, directory of an EKG export, or promg DatabaseConnection
+    """
+    if isinstance(source, GraphSource):
+        return source
+    if isinstance(source, str):
+        return LocalGraphSource(source)
+    return PromgGraphSource(source)
+
+
+def directly_follows(events):
+    """
+    @return: list of (event id, event id) of the consecutive events of a time-ordered event list, the total order
+    """
+    return [(events[j]["id"], events[j + 1]["id"]) for j in range(len(events) - 1)]
+
+
+def to_partial_order(record):
+    """
+    @param record: query result with eventList and relationList (lists of source and target event id)
+    @return: tuple (event list, list of (source event id, target event id))
+    """
+    if record is None:
+        return [], []
+    return record["eventList"], [(source, target) for source, target in record["relationList"]]
+
+
+def to_activity_codes(events):
+    """
+    @return: int array with the code of the activity of each event, codes in order of first occurrence
+    """
+    codes = {}
+    return np.array([codes.setdefault(event["activity"], len(codes)) for event in events], dtype=np.int64)
+
+
+def build_rel_graph(entities, rel):
+    """
+    @param entities: list of (entity id, entity type)
+    @param rel: list of (entity id, entity id) REL relationships
+    @return: tuple (entity ids by ordinal, dict of entity id to ordinal, sorted entity types, RelGraph)
+    """
+    entity_ids = [entity_id for entity_id, _ in entities]
+    entity_idx = {entity_id: i for i, entity_id in enumerate(entity_ids)}
+    types = sorted(set(entity_type for _, entity_type in entities))
+    type_idx = {entity_type: i for i, entity_type in enumerate(types)}
+    rel_graph = RelGraph(len(entity_ids), [entity_idx[e1] for e1, _ in rel], [entity_idx[e2] for _, e2 in rel],
+                         [type_idx[entity_type] for _, entity_type in entities], len(types))
+    return entity_ids, entity_idx, types, rel_graph
+
+
+def leading_type_context_from_index(rel_graph, entity_ids, entity, max_path_length=1000):
+    """
+    Looks up the leading type context of an entity in the REL distance index of the graph: per entity type, the
+    entities at minimum REL distance.
+    """
+    distance_index = rel_graph.get_distance_index()
+    # the iterative Cypher queries use one REL hop for path lengths 0 and 1
+    max_distance = max(1, max_path_length - 1)
+    context = [entity_ids[entity]]
+    for type_idx in range(rel_graph.num_types):
+        context.extend(entity_ids[i] for i in distance_index.nearest_of_type(entity, type_idx, max_distance))
+    return context
+
+
+def stream_object_pairs_from_graph(rel_graph, entity_ids, types, ot1, ot2, max_path_length=10):
+    """
+    Enumerates the object pairs of two types within max_path_length REL hops on the RelGraph, deduplicated and in
+    sorted order, streamed per source object.
+    """
+    if ot1 not in types or ot2 not in types:
+        return
+    # rank of the entity ids, pairs are ordered and same-type pairs oriented by id as in the Cypher queries
+    id_rank = np.empty(len(entity_ids), dtype=np.int64)
+    id_rank[sorted(range(len(entity_ids)), key=entity_ids.__getitem__)] = np.arange(len(entity_ids))
+    for source, partners in rel_graph.stream_object_pairs(types.index(ot1), types.index(ot2), max_path_length,
+                                                          id_rank):
+        o1 = entity_ids[source]
+        for partner in partners:
+            yield o1, entity_ids[partner]
@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+checkpoint_tables = ["checkpoint_contexts", "checkpoint_edges", "checkpoint_counters"]
+
+
+class ContextProgress:
+
+    """
+    Progress of one context table: the process executions 0..proc_execs_done - 1 are written to the table, with the
+    view statistics accumulated over them.
+
+    @param covered: bool array over event ordinals, the events covered by the written process executions
+    @param last_key: key (see checkpoint_key) of the object or pair of objects of the last written process execution
+    """
+    def __init__(self, covered, proc_execs_done=0, num_events=0, num_unique_activities=0, num_rows=0,
+                 complete=False, last_key=None):
+        self.covered = covered
+        self.last_key = last_key
+        self.proc_execs_done = proc_execs_done
+        self.num_events = num_events
+        self.num_unique_activities = num_unique_activities
+        self.num_rows = num_rows
+        self.complete = complete
+
+
+class IndexCheckpoint:
+
+    """
+    Durable progress of an index construction, kept in checkpoint tables of the DuckDB file of the index: the
+    progress of every context table, the edge dictionary (SpillableEdgeDict of event-ordinal pairs) and the
+    counters of the generator (e.g. the next edge id). Context rows, new edges, progress and counters are committed
+    in one transaction, so an interrupted run resumes from its last commit. Resuming assumes the same graph source
+    and configuration as the interrupted run; a context continues after the object ids of its last committed process
+    execution, which the graph source has to stream in the same order.
+
+    @param duckdb_conn: open connection to the index database
+    @param resume: continue from the stored checkpoint instead of starting over
+    @param temp_dir: directory of the files staging new edges (default: system temp directory)
+    """
+    def __init__(self, duckdb_conn, resume=False, temp_dir=None):
+        self.duckdb_conn = duckdb_conn
+        self.temp_dir = temp_dir
+        if not resume:
+            for table in checkpoint_tables:
+                duckdb_conn.sql("DROP TABLE IF EXISTS " + table)
+        duckdb_conn.sql("CREATE TABLE IF NOT EXISTS checkpoint_contexts(context STRING PRIMARY KEY, "
+                        "procExecsDone BIGINT, numEvents BIGINT, numUniqueActivities BIGINT, numRows BIGINT, "
+                        "covered BLOB, complete BOOLEAN, lastKey STRING)")
+        # checkpoints written before the key of the last process execution was recorded
+        duckdb_conn.sql("ALTER TABLE checkpoint_contexts ADD COLUMN IF NOT EXISTS lastKey STRING")
+        duckdb_conn.sql("CREATE TABLE IF NOT EXISTS checkpoint_edges(source BIGINT, target BIGINT, edgeId BIGINT)")
+        duckdb_conn.sql("CREATE TABLE IF NOT EXISTS checkpoint_counters(name STRING PRIMARY KEY, value BIGINT)")
+        duckdb_conn.commit()
+        self.num_edges_saved = duckdb_conn.sql("SELECT COUNT(*) FROM checkpoint_edges").fetchone()[0]
+
+    def counters(self):
+        return dict(self.duckdb_conn.sql("SELECT name, value FROM checkpoint_counters").fetchall())
+
+    def load_edges(self, edges):
+        """
+        Adds the edges of the last commit, (source ordinal, target ordinal) to edge id, to edges in id order.
+        """
+        columns = self.duckdb_conn.sql("SELECT source, target, edgeId FROM checkpoint_edges "
+                                       "ORDER BY edgeId").fetchnumpy()
+        for edge, edge_id in zip(zip(columns["source"].tolist(), columns["target"].tolist()),
+                                 columns["edgeId"].tolist()):
+            edges[edge] = edge_id
+        if len(edges) > 0:
+            logging.info(f"Resuming with {len(edges)} edges from checkpoint")
+        return edges
+
+    def context_progress(self, context_name, num_events):
+        """
+        @param num_events: number of events of the graph source, the length of the covered array
+        @return: ContextProgress of the context, empty if the context was not started
+        """
+        row = self.duckdb_conn.execute("SELECT procExecsDone, numEvents, numUniqueActivities, numRows, covered, "
+                                       "complete, lastKey FROM checkpoint_contexts WHERE context = ?",
+                                       [context_name]).fetchone()
+        if row is None:
+            return ContextProgress(np.zeros(num_events, dtype=bool))
+        proc_execs_done, context_events, num_unique_activities, num_rows, covered, complete, last_key = row
+        covered = np.unpackbits(np.frombuffer(covered, dtype=np.uint8), count=num_events).astype(bool)
+        return ContextProgress(covered, proc_execs_done, context_events, num_unique_activities, num_rows, complete,
+                               last_key)
+
+    def begin(self):
+        self.duckdb_conn.begin()
+
+    def commit(self, context_name, progress, edges, counters):
+        """
+        Stores the progress of the context, the edges added since the last commit and the counters, and commits
+        the transaction opened with begin().
+        """
+        self.__save_new_edges__(edges)
+        self.duckdb_conn.execute("INSERT OR REPLACE INTO checkpoint_contexts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                 [context_name, progress.proc_execs_done, progress.num_events,
+                                  progress.num_unique_activities, progress.num_rows,
+                                  np.packbits(progress.covered).tobytes(), progress.complete, progress.last_key])
+        for name, value in counters.items():
+            self.duckdb_conn.execute("INSERT OR REPLACE INTO checkpoint_counters VALUES (?, ?)", [name, value])
+        self.duckdb_conn.commit()
+
+    def __save_new_edges__(self, edges):
+        # edges are only ever added, the edges of the last num_new additions are new
+        num_new = len(edges) - self.num_edges_saved
+        if num_new <= 0:
+            return
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.csv', mode='w', dir=self.temp_dir)
+        with temp_file:
+            temp_file.write("\n".join(f"{source},{target},{edge_id}"
+                                      for (source, target), edge_id in edges.recent_items(num_new)) + "\n")
+        self.duckdb_conn.sql(f"COPY checkpoint_edges FROM '{temp_file.name}' (DELIMITER ',')")
+        os.remove(temp_file.name)
+        self.num_edges_saved = len(edges)
+
+    def is_complete(self, context_name):
+        row = self.duckdb_conn.execute("SELECT complete FROM checkpoint_contexts WHERE context = ?",
+                                       [context_name]).fetchone()
+        return row is not None and row[0]
+
+
+def checkpoint_key(key):
+    """
+    @param key: object id, or tuple of the object ids of a pair
+    @return: key as stored in the checkpoint
+    """
+    return json.dumps(key, default=str)
+
+
+def resume_after(items, progress, key=lambda item: item):
+    """
+    Skips the items of a stream up to the last process execution of progress. The stream is matched by key, not by
+    position: a stream of another order or content than the interrupted run's raises ValueError instead of skipping
+    the wrong items.
+
+        @param items: iterable of the process executions of a context, in the order of the interrupted run
+        @param key: function of an item to its object id or pair of object ids
+        @return: iterator over the items after the last one written
+    """
+    items = iter(items)
+    if progress.proc_execs_done == 0:
+        return items
+    if progress.last_key is None:
+        raise ValueError("Checkpoint has no key of its last process execution, it has to be rebuilt")
+    for position, item in enumerate(items, start=1):
+        if checkpoint_key(key(item)) == progress.last_key:
+            if position != progress.proc_execs_done:
+                raise ValueError(f"Last process execution of the checkpoint found at position {position} instead of "
+                                 f"{progress.proc_execs_done}, the graph source changed since the interrupted run")
+            return items
+    raise ValueError(f"Last process execution of the checkpoint {progress.last_key} not found, the graph source "
+                     f"changed since the interrupted run")
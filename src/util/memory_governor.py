@@ -0,0 +1,207 @@
+import itertools
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import time
+
+from src.util import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+memory_units = {"B": 1, "KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4,
+                "KIB": 1024, "MIB": 1024 ** 2, "GIB": 1024 ** 3, "TIB": 1024 ** 4}
+
+
+def parse_memory_size(size):
+    """
+    @param size: number of bytes or size string in the format of the DuckDB memory_limit, e.g. 4GB or 512MiB
+    @return: number of bytes
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([a-zA-Z]*)\s*", size)
+    unit = match.group(2).upper() or "B" if match is not None else None
+    if unit not in memory_units:
+        raise ValueError(f"Invalid memory size: {size}")
+    return int(float(match.group(1)) * memory_units[unit])
+
+
+def current_rss_bytes():
+    """
+    @return: resident set size of the process, the peak RSS where the current one is not available
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return metrics.peak_rss_bytes()
+
+
+class MemoryGovernor:
+
+    """
+    Tracks the resident set size of the process against a memory budget. Above soft_limit of the budget, batch and
+    flush sizes are scaled down linearly, to min_fraction of their default at hard_limit; above hard_limit, buffers
+    should be spilled to disk. Without a budget nothing is throttled.
+
+    @param budget: memory budget in bytes or as size string (e.g. the value of --maxmem), None for no budget
+    @param check_interval: seconds a RSS reading is reused for
+    """
+    def __init__(self, budget=None, soft_limit=0.6, hard_limit=0.85, min_fraction=1 / 64, check_interval=0.5):
+        self.budget_bytes = parse_memory_size(budget) if budget is not None else None
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.min_fraction = min_fraction
+        self.check_interval = check_interval
+        self.last_check = None
+        self.last_usage = 0.0
+        self.throttle_level = 0
+
+    def usage(self):
+        """
+        @return: RSS as fraction of the budget, 0 without budget
+        """
+        if self.budget_bytes is None:
+            return 0.0
+        now = time.monotonic()
+        if self.last_check is None or now - self.last_check >= self.check_interval:
+            self.last_check = now
+            rss = current_rss_bytes()
+            self.last_usage = rss / self.budget_bytes
+            self.__update_throttle_level__(rss)
+        return self.last_usage
+
+    def __update_throttle_level__(self, rss):
+        # logs only when the throttle level changes, not on every throttled batch
+        level = 0 if self.last_usage < self.soft_limit else 1 if self.last_usage < self.hard_limit else 2
+        if level != self.throttle_level:
+            if level > self.throttle_level:
+                logging.info(f"Memory governor: RSS {rss / 1024 ** 2:.0f} MB is {self.last_usage:.0%} of the "
+                             f"budget, {'spilling buffers' if level == 2 else 'reducing batch sizes'}")
+                metrics.count("memory_throttles", level=level)
+            else:
+                logging.info(f"Memory governor: RSS {rss / 1024 ** 2:.0f} MB is {self.last_usage:.0%} of the "
+                             f"budget, {'batch sizes restored' if level == 0 else 'spilling stopped'}")
+            metrics.gauge("rss_bytes", rss)
+            self.throttle_level = level
+
+    def batch_size(self, default, minimum=1):
+        """
+        @return: default while below the soft limit, scaled down with the memory usage above it
+        """
+        usage = self.usage()
+        if usage <= self.soft_limit:
+            return default
+        fraction = min(1.0, (usage - self.soft_limit) / (self.hard_limit - self.soft_limit))
+        return max(minimum, int(default * (1 - fraction * (1 - self.min_fraction))))
+
+    def should_spill(self):
+        return self.usage() >= self.hard_limit
+
+
+# memory governor used by the pipeline, replaced via set_memory_budget
+governor = MemoryGovernor()
+
+
+def set_memory_budget(budget):
+    """
+    Installs a governor for the memory budget (bytes or size string, None for no budget).
+    """
+    global governor
+    governor = MemoryGovernor(budget)
+    if governor.budget_bytes is not None:
+        logging.info(f"Memory governor budget: {governor.budget_bytes / 1024 ** 2:.0f} MB")
+    return governor
+
+
+def batch_size(default, minimum=1):
+    return governor.batch_size(default, minimum)
+
+
+def should_spill():
+    return governor.should_spill()
+
+
+class SpillableEdgeDict:
+
+    """
+    Edge dictionary (edge -> edge id) shared by the contexts of an index. New edges are kept in memory; when the
+    memory governor asks to spill, maybe_spill moves them to an SQLite table on disk. Lookups check the in-memory
+    edges first, then the spilled ones. Edges are keyed by their string form, as in the dbm-backed edge store.
+
+    @param spill_dir: directory of the spill file (default: system temp directory)
+    """
+    def __init__(self, spill_dir=None):
+        self.spill_dir = spill_dir
+        self.memory = {}
+        self.num_spilled = 0
+        self.db = None
+        self.file_name = None
+
+    def __len__(self):
+        return len(self.memory) + self.num_spilled
+
+    def get(self, edge, default=None):
+        edge_id = self.memory.get(edge)
+        if edge_id is not None or self.db is None:
+            return edge_id if edge_id is not None else default
+        row = self.db.execute("SELECT edgeId FROM edges WHERE edge = ?", (str(edge),)).fetchone()
+        return row[0] if row is not None else default
+
+    def __contains__(self, edge):
+        return self.get(edge) is not None
+
+    def __getitem__(self, edge):
+        edge_id = self.get(edge)
+        if edge_id is None:
+            raise KeyError(edge)
+        return edge_id
+
+    def __setitem__(self, edge, edge_id):
+        self.memory[edge] = edge_id
+
+    def recent_items(self, num):
+        """
+        @return: the num most recently added (edge, edge id) items in insertion order, from the in-memory edges
+        """
+        assert num <= len(self.memory), "recent edges were spilled"
+        return list(itertools.islice(reversed(self.memory.items()), num))[::-1]
+
+    def items(self):
+        """
+        Yields all (edge, edge id) items, the spilled ones with the source and target of their edge as strings.
+        """
+        if self.db is not None:
+            for source, target, edge_id in self.db.execute("SELECT source, target, edgeId FROM edges"):
+                yield (source, target), edge_id
+        yield from self.memory.items()
+
+    def maybe_spill(self):
+        if len(self.memory) > 0 and should_spill():
+            self.spill()
+
+    def spill(self):
+        if self.db is None:
+            self.file_name = tempfile.NamedTemporaryFile(delete=False, suffix='.sqlite', dir=self.spill_dir).name
+            self.db = sqlite3.connect(self.file_name)
+            self.db.execute("CREATE TABLE IF NOT EXISTS edges(edge TEXT PRIMARY KEY, edgeId INTEGER, source TEXT, "
+                            "target TEXT) WITHOUT ROWID")
+        with metrics.timed("edge_dict_spill"):
+            self.db.executemany("INSERT INTO edges VALUES (?, ?, ?, ?)",
+                                ((str(edge), edge_id, str(edge[0]), str(edge[1]))
+                                 for edge, edge_id in self.memory.items()))
+            self.db.commit()
+        logging.info(f"Spilled {len(self.memory)} edges to {self.file_name}")
+        metrics.count("edge_dict_spills")
+        self.num_spilled += len(self.memory)
+        self.memory = {}
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            os.remove(self.file_name)
+            self.db = None
+        self.memory = {}
+        self.num_spilled = 0
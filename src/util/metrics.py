@@ -0,0 +1,157 @@
+import json
+import logging
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+
+class MetricsHook:
+
+    """
+    Receives the metrics recorded along the view-materialization pipeline. The base class discards everything;
+    implementations can aggregate, log or forward the metrics.
+    """
+    def timing(self, name, seconds, **labels):
+        pass
+
+    def count(self, name, value=1, **labels):
+        pass
+
+    def gauge(self, name, value, **labels):
+        pass
+
+    def emit(self, file_name):
+        pass
+
+
+class JsonMetricsCollector(MetricsHook):
+
+    """
+    Aggregates timings (count, total, max), counters and gauges (last, max) per metric name and label set,
+    and writes them as structured JSON.
+    """
+    def __init__(self):
+        self.start_time = time.time()
+        self.timings = {}
+        self.counters = {}
+        self.gauges = {}
+
+    @staticmethod
+    def __key__(name, labels):
+        return (name,) + tuple(sorted(labels.items()))
+
+    def timing(self, name, seconds, **labels):
+        entry = self.timings.setdefault(self.__key__(name, labels), {"count": 0, "total": 0.0, "max": 0.0})
+        entry["count"] += 1
+        entry["total"] += seconds
+        entry["max"] = max(entry["max"], seconds)
+
+    def count(self, name, value=1, **labels):
+        key = self.__key__(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        entry = self.gauges.setdefault(self.__key__(name, labels), {"last": value, "max": value})
+        entry["last"] = value
+        entry["max"] = max(entry["max"], value)
+
+    def totals(self, name):
+        """
+        Sums the total time of a timing over all label sets.
+        """
+        return sum(entry["total"] for key, entry in self.timings.items() if key[0] == name)
+
+    def to_json(self):
+        def as_records(metric_dict, value_name=None):
+            records = []
+            for key, value in metric_dict.items():
+                record = {"name": key[0], "labels": dict(key[1:])}
+                if value_name is None:
+                    record.update(value)
+                else:
+                    record[value_name] = value
+                records.append(record)
+            return records
+
+        self.gauge("peak_rss_bytes", peak_rss_bytes())
+        return {
+            "wall_time": time.time() - self.start_time,
+            "timings": as_records(self.timings),
+            "counters": as_records(self.counters, "value"),
+            "gauges": as_records(self.gauges)
+        }
+
+    def emit(self, file_name):
+        with open(file_name, "w") as f:
+            json.dump(self.to_json(), f, indent=4)
+        logging.info("Wrote metrics to " + file_name)
+
+
+# metrics hook used by the pipeline, replaced via set_metrics_hook
+hook = MetricsHook()
+
+
+def set_metrics_hook(metrics_hook):
+    global hook
+    hook = metrics_hook if metrics_hook is not None else MetricsHook()
+    return hook
+
+
+def timing(name, seconds, **labels):
+    hook.timing(name, seconds, **labels)
+
+
+def count(name, value=1, **labels):
+    hook.count(name, value, **labels)
+
+
+def gauge(name, value, **labels):
+    hook.gauge(name, value, **labels)
+
+
+@contextmanager
+def timed(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        hook.timing(name, time.perf_counter() - start, **labels)
+
+
+def peak_rss_bytes():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def sample_duckdb_memory(con, **labels):
+    """
+    Records the current DuckDB buffer memory and the size of data spilled to temporary files.
+    """
+    memory_bytes, spilled_bytes = con.sql(
+        "SELECT SUM(memory_usage_bytes), SUM(temporary_storage_bytes) FROM duckdb_memory()").fetchone()
+    hook.gauge("duckdb_memory_bytes", int(memory_bytes or 0), **labels)
+    hook.gauge("duckdb_spilled_bytes", int(spilled_bytes or 0), **labels)
+    hook.gauge("peak_rss_bytes", peak_rss_bytes(), **labels)
+
+
+class MeteredConnection:
+
+    """
+    Wraps a Neo4j DatabaseConnection and records count and latency of every query, labeled by query function.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+    def exec_query(self, function, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.connection.exec_query(function, **kwargs)
+        finally:
+            hook.timing("neo4j_query", time.perf_counter() - start, query=function.__name__)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
@@ -0,0 +1,101 @@
+import numpy as np
+
+
+class EdgeSetIndex:
+
+    """
+    Inverted edge -> contexts index over the edge sets of the contexts of a view, for finding the context with the
+    maximum Jaccard similarity to a query edge set without counting the intersections with every context that
+    shares an edge. A query first verifies a few contexts of its rarest edge, which gives a lower bound t of the
+    maximum similarity. A context with similarity above t shares more than t * |query| edges with the query, so it
+    contains one of the |query| - floor(t * |query|) rarest query edges (prefix filtering), and only the postings of
+    these edges are probed; the most frequent edges, with the longest postings, are skipped. The candidates are
+    verified in the order of their similarity upper bound from the probed edges and the sizes of both sets, until no
+    upper bound exceeds the best similarity found.
+
+    @param edge_sets: list of the edge sets of the contexts (iterables of hashable edges)
+    @param num_seeds: number of contexts of the rarest query edge verified for the first lower bound
+    """
+    def __init__(self, edge_sets, num_seeds=8):
+        self.edge_sets = [frozenset(edge_set) for edge_set in edge_sets]
+        self.sizes = np.array([len(edge_set) for edge_set in self.edge_sets], dtype=np.int64)
+        self.size_list = self.sizes.tolist()
+        self.num_seeds = num_seeds
+        postings = {}
+        for context, edge_set in enumerate(self.edge_sets):
+            for edge in edge_set:
+                postings.setdefault(edge, []).append(context)
+        self.postings = {edge: np.array(contexts, dtype=np.int64) for edge, contexts in postings.items()}
+        self.stats = {"queries": 0, "candidates": 0, "verified": 0}
+
+    def __len__(self):
+        return len(self.edge_sets)
+
+    def __jaccard__(self, edge_set, context):
+        overlap = len(edge_set & self.edge_sets[context])
+        return overlap / (len(edge_set) + self.size_list[context] - overlap)
+
+    def nearest(self, edge_set):
+        """
+        @return: tuple (index of the context with the maximum Jaccard similarity to edge_set, similarity), (-1, 0.0)
+                 if no context shares an edge with edge_set
+        """
+        edge_set = edge_set if isinstance(edge_set, frozenset) else frozenset(edge_set)
+        size = len(edge_set)
+        self.stats["queries"] += 1
+        best_context, best_sim = -1, 0.0
+        postings = sorted((self.postings[edge] for edge in edge_set if edge in self.postings), key=len)
+        if len(postings) == 0:
+            return best_context, best_sim
+
+        for context in postings[0][:self.num_seeds].tolist():
+            sim = self.__jaccard__(edge_set, context)
+            if sim > best_sim:
+                best_context, best_sim = context, sim
+        self.stats["verified"] += min(len(postings[0]), self.num_seeds)
+
+        # edges without postings are the rarest ones, they count towards the prefix without being probed
+        prefix_length = size - int(np.floor(best_sim * size - 1e-9)) - (size - len(postings))
+        if prefix_length <= 0:
+            return int(best_context), best_sim
+        candidates, counts = np.unique(np.concatenate(postings[:prefix_length]), return_counts=True)
+        self.stats["candidates"] += len(candidates)
+        # a candidate shares at most the probed edges it is in and the edges after the prefix
+        other_sizes = self.sizes[candidates]
+        max_overlap = np.minimum(counts + (len(postings) - prefix_length), np.minimum(size, other_sizes))
+        upper_bounds = max_overlap / (size + other_sizes - max_overlap)
+        promising = np.flatnonzero(upper_bounds > best_sim)
+        if len(promising) == 0:
+            return int(best_context), best_sim
+        # exact overlaps of the promising candidates: the probed edges they are in and the (sorted) postings of the
+        # edges after the prefix they are found in
+        contexts = candidates[promising]
+        overlaps = counts[promising]
+        for posting in postings[prefix_length:]:
+            positions = np.minimum(np.searchsorted(posting, contexts), len(posting) - 1)
+            overlaps += posting[positions] == contexts
+        self.stats["verified"] += len(contexts)
+        sims = overlaps / (size + other_sizes[promising] - overlaps)
+        best = np.argmax(sims)
+        if sims[best] > best_sim:
+            best_context, best_sim = contexts[best], sims[best]
+        return int(best_context), float(best_sim)
+
+    def max_similarities(self, edge_sets):
+        """
+        @return: array of the maximum Jaccard similarity of each of the edge sets to any context of the index
+        """
+        return np.array([self.nearest(edge_set)[1] for edge_set in edge_sets], dtype=float)
+
+
+def nearest_max_similarities(edge_sets, other_edge_sets, index=None, other_index=None):
+    """
+    Maximum Jaccard similarities of the contexts of two views, as needed for the matching similarity of the views.
+
+        @param index, other_index: EdgeSetIndex of edge_sets and other_edge_sets, if already built
+        @return: tuple (array of the maximum similarity of each of edge_sets to other_edge_sets, array of the maximum
+                 similarity of each of other_edge_sets to edge_sets)
+    """
+    index = EdgeSetIndex(edge_sets) if index is None else index
+    other_index = EdgeSetIndex(other_edge_sets) if other_index is None else other_index
+    return other_index.max_similarities(index.edge_sets), index.max_similarities(other_index.edge_sets)
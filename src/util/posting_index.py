@@ -0,0 +1,222 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+from src.util.score_store import context_table_versions
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+delta_dtypes = [np.uint8, np.uint16, np.uint32, np.uint64]
+
+
+def posting_index_dir(db_name):
+    """
+    @return: directory of the posting indices of the views of a view database, next to the database file
+    """
+    return db_name + ".postings"
+
+
+def delta_encode(values, offsets):
+    """
+    Delta-encodes sorted posting lists, the first value of each list is stored as is. The deltas are stored in the
+    smallest unsigned type holding them.
+
+        @param values: concatenated sorted posting lists
+        @param offsets: start of each posting list in values, followed by len(values)
+    """
+    deltas = np.diff(values, prepend=0)
+    starts = offsets[:-1][np.diff(offsets) > 0]
+    deltas[starts] = values[starts]
+    max_delta = deltas.max() if len(deltas) > 0 else 0
+    dtype = next(dtype for dtype in delta_dtypes if max_delta <= np.iinfo(dtype).max)
+    return deltas.astype(dtype)
+
+
+def delta_decode(deltas, offsets):
+    values = np.cumsum(deltas, dtype=np.int64)
+    lengths = np.diff(offsets)
+    # the cumulative sum runs over all lists, subtract the sum of the lists before each list
+    starts = offsets[:-1][lengths > 0]
+    base = np.zeros(len(offsets) - 1, dtype=np.int64)
+    base[lengths > 0] = values[starts] - deltas[starts].astype(np.int64)
+    return values - np.repeat(base, lengths)
+
+
+class PostingIndex:
+
+    """
+    Inverted edge -> process executions index of a view, persisted as arrays: the sorted distinct edges, the offsets
+    of their posting lists and the sorted, delta-encoded process executions of all posting lists. The arrays are
+    stored as .npy files and memory-mapped on load, so lookups read only the postings they need, without a database
+    connection.
+
+    @param edges: sorted array of the distinct edges
+    @param offsets: array of the start of the posting list of each edge, followed by the number of postings
+    @param deltas: delta-encoded posting lists
+    @param meta: dict with the context table (context), the key column (key), the number of process executions
+                 (numProcExecs) and the version of the context table the index was built from (version)
+    """
+    def __init__(self, edges, offsets, deltas, meta):
+        self.edges = edges
+        self.offsets = offsets
+        self.deltas = deltas
+        self.meta = meta
+
+    @staticmethod
+    def build(con, table_name, key="procExec", num_proc_execs=None):
+        """
+        Builds the posting index of a context table (or variant table, with key variant).
+        """
+        columns = con.sql(f"SELECT DISTINCT edge, CAST({key} AS BIGINT) AS procExec FROM {table_name} "
+                          f"ORDER BY edge, procExec").fetchnumpy()
+        edge_column, proc_execs = columns["edge"].astype(np.int64), columns["procExec"].astype(np.int64)
+        edges, starts = np.unique(edge_column, return_index=True)
+        offsets = np.append(starts, len(edge_column)).astype(np.int64)
+        if num_proc_execs is None:
+            num_proc_execs = len(np.unique(proc_execs))
+        meta = {"context": table_name, "key": key, "numProcExecs": int(num_proc_execs),
+                "version": context_table_versions(con, [table_name], key)[table_name]}
+        return PostingIndex(edges, offsets, delta_encode(proc_execs, offsets), meta)
+
+    def save(self, index_dir):
+        view_dir = os.path.join(index_dir, self.meta["context"])
+        temp_dir = view_dir + ".tmp"
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+        for name in ("edges", "offsets", "deltas"):
+            np.save(os.path.join(temp_dir, name + ".npy"), getattr(self, name))
+        with open(os.path.join(temp_dir, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+        # replace a previous index of the view only once the new one is complete
+        shutil.rmtree(view_dir, ignore_errors=True)
+        os.rename(temp_dir, view_dir)
+
+    @staticmethod
+    def load(index_dir, table_name, mmap=True):
+        """
+        @return: PostingIndex of the table, None if no index is stored for it
+        """
+        view_dir = os.path.join(index_dir, table_name)
+        if not os.path.exists(os.path.join(view_dir, "meta.json")):
+            return None
+        with open(os.path.join(view_dir, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = [np.load(os.path.join(view_dir, name + ".npy"), mmap_mode="r" if mmap else None)
+                  for name in ("edges", "offsets", "deltas")]
+        return PostingIndex(*arrays, meta)
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __position__(self, edge):
+        position = np.searchsorted(self.edges, edge)
+        return position if position < len(self.edges) and self.edges[position] == edge else None
+
+    def __contains__(self, edge):
+        return self.__position__(edge) is not None
+
+    def postings(self, edge):
+        """
+        @return: sorted array of the process executions containing the edge
+        """
+        position = self.__position__(edge)
+        if position is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.cumsum(self.deltas[self.offsets[position]:self.offsets[position + 1]], dtype=np.int64)
+
+    def edge_sets(self):
+        """
+        @return: tuple (sorted array of the process executions, list of the edge set of each of them)
+        """
+        proc_execs = delta_decode(self.deltas, self.offsets)
+        edges = np.repeat(np.asarray(self.edges), np.diff(self.offsets))
+        order = np.argsort(proc_execs, kind="stable")
+        proc_execs, edges = proc_execs[order], edges[order]
+        keys, starts = np.unique(proc_execs, return_index=True)
+        if len(keys) == 0:
+            return keys, []
+        return keys, [frozenset(edge_set.tolist()) for edge_set in np.split(edges, starts[1:])]
+
+    def relation_index(self):
+        """
+        @return: tuple (dictionary of edges to the list of process executions containing them, number of process
+                 executions), the view format of matching_similarities
+        """
+        proc_execs = delta_decode(self.deltas, self.offsets).tolist()
+        offsets = self.offsets.tolist()
+        return ({edge: proc_execs[offsets[i]:offsets[i + 1]] for i, edge in enumerate(self.edges.tolist())},
+                self.meta["numProcExecs"])
+
+    def view_dict(self, view_idx):
+        """
+        @return: view dictionary as taken by compute_matching_sim
+        """
+        relation_index, num_proc_execs = self.relation_index()
+        return {"relation_index": relation_index, "num_proc_exec": num_proc_execs, "view_idx": view_idx}
+
+
+def load_or_build(con, db_name, table_name, key="procExec", num_proc_execs=None):
+    """
+    Loads the persisted posting index of a table, building and persisting it if it is missing or was built from
+    another version of the table.
+    """
+    index_dir = posting_index_dir(db_name)
+    index = PostingIndex.load(index_dir, table_name)
+    if index is not None and index.meta["key"] == key and \
+            index.meta["version"] == context_table_versions(con, [table_name], key)[table_name]:
+        return index
+    index = PostingIndex.build(con, table_name, key, num_proc_execs)
+    index.save(index_dir)
+    logging.info(f"Stored posting index of {table_name} ({len(index)} edges) in {index_dir}")
+    return index
+
+
+def write_posting_indices(con, db_name):
+    """
+    Builds and persists the posting indices of all views of a view database.
+    """
+    rows = con.sql("SELECT objecttype, numProcExecs FROM viewmeta ORDER BY viewIdx").fetchall()
+    return {context: load_or_build(con, db_name, context, num_proc_execs=num_proc_execs)
+            for context, num_proc_execs in rows}
+
+
+def views_containing(db_name, edge):
+    """
+    @return: list of the views of a view database with the edge, from their persisted posting indices
+    """
+    index_dir = posting_index_dir(db_name)
+    if not os.path.isdir(index_dir):
+        return []
+    views = []
+    for table_name in sorted(os.listdir(index_dir)):
+        index = PostingIndex.load(index_dir, table_name)
+        if index is not None and index.meta["key"] == "procExec" and edge in index:
+            views.append(table_name)
+    return views
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build and query the posting indices of a view database.")
+    parser.add_argument("db_name", type=str, help="View database (.duckdb file)")
+    parser.add_argument("--build", action="store_true", help="Build the missing or outdated posting indices")
+    parser.add_argument("--edge", type=int, default=None, help="Edge id to look up the views containing it")
+    parser.add_argument("--view", type=str, default=None,
+                        help="With --edge, print the process executions of this view containing the edge")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.build:
+        import duckdb
+        with duckdb.connect(args.db_name) as con:
+            write_posting_indices(con, args.db_name)
+    if args.edge is not None and args.view is not None:
+        index = PostingIndex.load(posting_index_dir(args.db_name), args.view)
+        print(index.postings(args.edge).tolist() if index is not None else f"No posting index of {args.view}")
+    elif args.edge is not None:
+        print(views_containing(args.db_name, args.edge))
@@ -0,0 +1,279 @@
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+unreachable = -1
+
+
+def to_csr(rows, values, num_rows):
+    """
+    Builds adjacency lists in CSR layout, with sorted and deduplicated values per row.
+
+        @return: tuple (offsets, values), the values of row i are values[offsets[i]:offsets[i + 1]]
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    values = np.asarray(values, dtype=np.int64)
+    if len(rows) > 0:
+        pairs = np.unique(np.stack([rows, values], axis=1), axis=0)
+        rows, values = pairs[:, 0], pairs[:, 1]
+    offsets = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_rows), out=offsets[1:])
+    return offsets, values
+
+
+def gather(offsets, values, rows):
+    """
+    Concatenates the values of the given rows of a CSR structure.
+
+        @return: tuple (values, position of the row in rows for each value)
+    """
+    counts = offsets[rows + 1] - offsets[rows]
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    row_positions = np.repeat(np.arange(len(rows)), counts)
+    starts = np.repeat(offsets[rows] - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts)
+    return values[starts + np.arange(total)], row_positions
+
+
+class RelGraph:
+
+    """
+    REL relationships of an EKG as undirected adjacency lists (CSR) over entity ordinals, with the type ordinal of
+    every entity.
+
+    @param rel_sources, rel_targets: entity ordinals of the REL relationships
+    @param entity_type_idx: type ordinal per entity ordinal
+
+    distance_index_file: .npz file the distance index is stored in and reused from while the REL graph is unchanged,
+    None to build it in memory on every run
+    """
+    def __init__(self, num_entities, rel_sources, rel_targets, entity_type_idx, num_types):
+        rel_sources = np.asarray(rel_sources, dtype=np.int64)
+        rel_targets = np.asarray(rel_targets, dtype=np.int64)
+        not_loop = rel_sources != rel_targets
+        rel_sources, rel_targets = rel_sources[not_loop], rel_targets[not_loop]
+        self.num_entities = num_entities
+        self.offsets, self.neighbors = to_csr(np.concatenate([rel_sources, rel_targets]),
+                                              np.concatenate([rel_targets, rel_sources]), num_entities)
+        self.entity_type_idx = np.asarray(entity_type_idx, dtype=np.int32)
+        self.num_types = num_types
+        self.distance_index = None
+        self.distance_index_file = None
+
+    def digest(self):
+        """
+        @return: hash of the adjacency lists and entity types, equal for equal REL graphs over the same ordinals
+        """
+        sha = hashlib.sha1(np.array([self.num_entities, self.num_types], dtype=np.int64).tobytes())
+        for array in (self.offsets, self.neighbors, self.entity_type_idx):
+            sha.update(array.tobytes())
+        return sha.hexdigest()
+
+    def neighbors_of(self, frontier):
+        return gather(self.offsets, self.neighbors, np.asarray(frontier, dtype=np.int64))[0]
+
+    def bfs_levels(self, source, max_distance):
+        """
+        Yields (distance, entity ordinals at that distance) for distances 1..max_distance.
+        """
+        visited = np.zeros(self.num_entities, dtype=bool)
+        visited[source] = True
+        frontier = np.array([source], dtype=np.int64)
+        for distance in range(1, max_distance + 1):
+            frontier = np.unique(self.neighbors_of(frontier))
+            frontier = frontier[~visited[frontier]]
+            if len(frontier) == 0:
+                return
+            visited[frontier] = True
+            yield distance, frontier
+
+    def reachable_within(self, sources, max_distance):
+        """
+        Computes for up to 64 sources at once which entities they reach within max_distance REL hops, as bitsets
+        over the sources. The frontier is propagated level by level along the adjacency lists of its entities only.
+
+            @return: uint64 array with bit b of entry v set if sources[b] reaches v (v = sources[b] is included)
+        """
+        assert len(sources) <= 64
+        reach = np.zeros(self.num_entities, dtype=np.uint64)
+        sources = np.asarray(sources, dtype=np.int64)
+        np.bitwise_or.at(reach, sources, np.left_shift(np.uint64(1), np.arange(len(sources), dtype=np.uint64)))
+        frontier_entities, frontier_bits = np.unique(sources), reach[np.unique(sources)]
+        for _ in range(max_distance):
+            targets, positions = gather(self.offsets, self.neighbors, frontier_entities)
+            if len(targets) == 0:
+                break
+            order = np.argsort(targets, kind="stable")
+            targets, bits = targets[order], frontier_bits[positions[order]]
+            group_starts = np.flatnonzero(np.r_[True, targets[1:] != targets[:-1]])
+            targets = targets[group_starts]
+            new_bits = np.bitwise_or.reduceat(bits, group_starts) & ~reach[targets]
+            changed = new_bits != 0
+            frontier_entities, frontier_bits = targets[changed], new_bits[changed]
+            if len(frontier_entities) == 0:
+                break
+            reach[frontier_entities] |= frontier_bits
+        return reach
+
+    def stream_object_pairs(self, type1_idx, type2_idx, max_distance, sort_keys, batch_size=64):
+        """
+        Enumerates the deduplicated pairs of entities of the two types within max_distance REL hops. Sources are
+        processed in batches of bitset width and the pairs are yielded per source entity, so memory is bounded by
+        one batch. For equal types, each pair is yielded once, with the larger entity first.
+
+            @param sort_keys: sort key per entity ordinal, sources and their pair partners are yielded in this order
+            @return: generator of (source ordinal, sorted array of partner ordinals), for sources with partners
+        """
+        sources = np.flatnonzero(self.entity_type_idx == type1_idx)
+        sources = sources[np.argsort(sort_keys[sources], kind="stable")]
+        targets = np.flatnonzero(self.entity_type_idx == type2_idx)
+        targets = targets[np.argsort(sort_keys[targets], kind="stable")]
+        target_rank = np.full(self.num_entities, -1, dtype=np.int64)
+        target_rank[targets] = np.arange(len(targets))
+        for start in range(0, len(sources), batch_size):
+            batch = sources[start:start + batch_size]
+            target_bits = self.reachable_within(batch, max_distance)[targets]
+            for b, source in enumerate(batch):
+                partners = targets[(target_bits >> np.uint64(b)) & np.uint64(1) == 1]
+                partners = partners[partners != source]
+                if type1_idx == type2_idx:
+                    partners = partners[target_rank[partners] < target_rank[source]]
+                if len(partners) > 0:
+                    yield source, partners
+
+    def get_distance_index(self):
+        """
+        @return: RelDistanceIndex of the graph, loaded from distance_index_file or built on first use and shared by
+                 all leading types
+        """
+        if self.distance_index is None and self.distance_index_file is not None:
+            self.distance_index = RelDistanceIndex.load(self, self.distance_index_file)
+        if self.distance_index is None:
+            self.distance_index = RelDistanceIndex.build(self)
+            if self.distance_index_file is not None:
+                self.distance_index.save(self.distance_index_file)
+        return self.distance_index
+
+
+class RelDistanceIndex:
+
+    """
+    Minimum REL distance of every entity to every entity type, excluding the entity itself. Built with one
+    multi-source BFS per entity type, started from all entities of the type at once, that keeps the two nearest
+    distinct sources per entity; the second one gives the distance of an entity to the nearest other entity of its
+    own type.
+
+    Per type and entity, the index stores the nearest source, its distance and the distance of the second nearest
+    source (unreachable = -1). The objects of a type at minimum distance are found by descending along the
+    distances from the entity, visiting only the entities on shortest paths.
+    """
+    def __init__(self, rel_graph, nearest_source, nearest_distance, second_distance):
+        self.rel_graph = rel_graph
+        self.nearest_source = nearest_source
+        self.nearest_distance = nearest_distance
+        self.second_distance = second_distance
+
+    @staticmethod
+    def build(rel_graph):
+        num_types, n = rel_graph.num_types, rel_graph.num_entities
+        nearest_source = np.full((num_types, n), unreachable, dtype=np.int64)
+        nearest_distance = np.full((num_types, n), unreachable, dtype=np.int16)
+        second_distance = np.full((num_types, n), unreachable, dtype=np.int16)
+        for type_idx in range(num_types):
+            sources = np.flatnonzero(rel_graph.entity_type_idx == type_idx)
+            RelDistanceIndex.__two_nearest_sources__(rel_graph, sources, nearest_source[type_idx],
+                                                     nearest_distance[type_idx], second_distance[type_idx])
+        logging.info(f"Built REL distance index for {n} entities and {num_types} entity types")
+        return RelDistanceIndex(rel_graph, nearest_source, nearest_distance, second_distance)
+
+    @staticmethod
+    def __two_nearest_sources__(rel_graph, sources, nearest_source, nearest_distance, second_distance):
+        # level-synchronous BFS over (entity, source) labels, an entity accepts at most two distinct sources
+        second_source = np.full(rel_graph.num_entities, unreachable, dtype=np.int64)
+        nearest_source[sources] = sources
+        nearest_distance[sources] = 0
+        frontier_entities, frontier_sources = sources.astype(np.int64), sources.astype(np.int64)
+        distance = 0
+        while len(frontier_entities) > 0:
+            distance += 1
+            candidates, positions = gather(rel_graph.offsets, rel_graph.neighbors, frontier_entities)
+            candidate_sources = frontier_sources[positions]
+            new_label = (nearest_source[candidates] != candidate_sources) & \
+                        (second_source[candidates] != candidate_sources) & (second_source[candidates] == unreachable)
+            candidates, candidate_sources = candidates[new_label], candidate_sources[new_label]
+            if len(candidates) == 0:
+                break
+            labels = np.unique(np.stack([candidates, candidate_sources], axis=1), axis=0)
+            candidates, candidate_sources = labels[:, 0], labels[:, 1]
+
+            # rank of each label among the labels reaching the same entity in this level
+            group_start = np.r_[True, candidates[1:] != candidates[:-1]]
+            rank = np.arange(len(candidates)) - np.maximum.accumulate(np.where(group_start,
+                                                                                np.arange(len(candidates)), 0))
+            has_nearest = nearest_source[candidates] != unreachable
+            accepted = rank < np.where(has_nearest, 1, 2)
+            candidates, candidate_sources = candidates[accepted], candidate_sources[accepted]
+            has_nearest, rank = has_nearest[accepted], rank[accepted]
+
+            to_nearest = ~has_nearest & (rank == 0)
+            nearest_source[candidates[to_nearest]] = candidate_sources[to_nearest]
+            nearest_distance[candidates[to_nearest]] = distance
+            second_source[candidates[~to_nearest]] = candidate_sources[~to_nearest]
+            second_distance[candidates[~to_nearest]] = distance
+            frontier_entities, frontier_sources = candidates, candidate_sources
+
+    def __distance_excluding__(self, entities, type_idx, excluded):
+        # distance to the nearest entity of the type other than excluded
+        return np.where(self.nearest_source[type_idx][entities] == excluded,
+                        self.second_distance[type_idx][entities], self.nearest_distance[type_idx][entities])
+
+    def distance(self, entity, type_idx):
+        """
+        @return: minimum REL distance from the entity to another entity of the type, -1 if unreachable
+        """
+        return int(self.__distance_excluding__(np.array([entity]), type_idx, entity)[0])
+
+    def nearest_of_type(self, entity, type_idx, max_distance=None):
+        """
+        @return: ordinals of the entities of the type (other than entity) at minimum REL distance from the entity
+        """
+        target_distance = self.distance(entity, type_idx)
+        if target_distance == unreachable or (max_distance is not None and target_distance > max_distance):
+            return np.zeros(0, dtype=np.int64)
+        frontier = np.array([entity], dtype=np.int64)
+        for step in range(1, target_distance + 1):
+            frontier = np.unique(self.rel_graph.neighbors_of(frontier))
+            frontier = frontier[self.__distance_excluding__(frontier, type_idx, entity) == target_distance - step]
+        return frontier[frontier != entity]
+
+    def save(self, file_name):
+        """
+        Stores the index with the digest of its REL graph.
+        """
+        temp_file_name = file_name + ".tmp.npz"
+        np.savez_compressed(temp_file_name, digest=np.array(self.rel_graph.digest()),
+                            nearest_source=self.nearest_source, nearest_distance=self.nearest_distance,
+                            second_distance=self.second_distance)
+        os.replace(temp_file_name, file_name)
+        logging.info(f"Stored REL distance index in {file_name}")
+
+    @staticmethod
+    def load(rel_graph, file_name):
+        """
+        @return: RelDistanceIndex stored in the file for the REL graph, None if there is none or it was stored for
+                 another REL graph
+        """
+        if not os.path.exists(file_name):
+            return None
+        with np.load(file_name, allow_pickle=False) as data:
+            if str(data["digest"]) != rel_graph.digest():
+                logging.info(f"REL graph changed since the distance index in {file_name} was stored")
+                return None
+            logging.info(f"Loaded REL distance index from {file_name}")
+            return RelDistanceIndex(rel_graph, data["nearest_source"], data["nearest_distance"],
+                                    data["second_distance"])
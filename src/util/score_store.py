@@ -0,0 +1,149 @@
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+from src.util.view_tables import has_table
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+score_store_path = "results/score_store/"
+key_separator = "\x1f"
+
+
+def database_path_hash(db_name):
+    """
+    Hash of the resolved file path of a view database, naming its score store file. It does not depend on the
+    content of the database, the entries of the store are versioned per context table (see context_table_versions).
+    """
+    return hashlib.sha1(os.path.realpath(db_name).encode("utf-8")).hexdigest()[:16]
+
+
+def context_table_versions(con, object_types, key="procExec"):
+    """
+    Computes a version string per context table from its row count and an order-independent hash of its rows,
+    so that rebuilt or changed context tables invalidate the scores stored for them. The number of process
+    executions of the view (viewmeta) is part of the version as well: process executions without edges are not in
+    the table, but count in the score of the view. If the view database stores
+    the events of its edges (viewedges), rows are hashed with the events of their edge instead of the edge id, as
+    edge ids of a rebuild change with every edge added before them.
+
+        @param con: open duckdb connection to the view database
+        @param key: column identifying the process executions
+        @return: dict of object type (context table name) to version string
+    """
+    if len(object_types) == 0:
+        return {}
+    if has_table(con, "viewedges"):
+        query = " UNION ALL ".join(
+            [f"SELECT '{obj_type}' AS objecttype, COUNT(*) AS numRows, "
+             f"bit_xor(hash(viewedges.source, viewedges.target, CAST(ctx.{key} AS BIGINT))) AS rowHash "
+             f"FROM {obj_type} ctx JOIN viewedges ON ctx.edge = viewedges.edge" for obj_type in object_types])
+    else:
+        query = " UNION ALL ".join(
+            [f"SELECT '{obj_type}' AS objecttype, COUNT(*) AS numRows, "
+             f"bit_xor(hash(edge, CAST({key} AS BIGINT))) AS rowHash FROM {obj_type}" for obj_type in object_types])
+    num_proc_execs = dict(con.sql("SELECT objecttype, numProcExecs FROM viewmeta").fetchall()) \
+        if has_table(con, "viewmeta") else {}
+    return {obj_type: f"{num_rows}-{row_hash}-{num_proc_execs.get(obj_type)}"
+            for obj_type, num_rows, row_hash in con.sql(query).fetchall()}
+
+
+class ScoreStore:
+
+    """
+    Persistent store for the pairwise scores of views and the per-procExec maximum similarities they are computed
+    from. Entries are keyed by context table name and version, so scores are reused across runs and values of k as
+    long as the underlying context tables do not change. One compressed .npz file is kept per view database.
+
+    @param db_name: path of the view database the scores are computed on
+    @param store_path: directory of the score store files
+    """
+    def __init__(self, db_name, store_path=score_store_path):
+        self.db_name = db_name
+        self.file_name = os.path.join(store_path, database_path_hash(db_name) + ".npz")
+        # (ot1, version1, ot2, version2) -> (sim, o1 procExecs, o1 max sims, o2 procExecs, o2 max sims)
+        self.pairs = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.file_name):
+            return
+        with np.load(self.file_name, allow_pickle=False) as data:
+            keys = data["keys"]
+            sims = data["sims"]
+            o1_offsets, o1_procexecs, o1_max = data["o1_offsets"], data["o1_procexecs"], data["o1_max"]
+            o2_offsets, o2_procexecs, o2_max = data["o2_offsets"], data["o2_procexecs"], data["o2_max"]
+            for i, key in enumerate(keys):
+                self.pairs[tuple(str(key).split(key_separator))] = (
+                    float(sims[i]),
+                    o1_procexecs[o1_offsets[i]:o1_offsets[i + 1]], o1_max[o1_offsets[i]:o1_offsets[i + 1]],
+                    o2_procexecs[o2_offsets[i]:o2_offsets[i + 1]], o2_max[o2_offsets[i]:o2_offsets[i + 1]])
+        logging.info(f"Loaded {len(self.pairs)} stored pairwise scores from {self.file_name}")
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+        keys = [key_separator.join(key) for key in self.pairs.keys()]
+        entries = list(self.pairs.values())
+        o1_lengths = [len(entry[1]) for entry in entries]
+        o2_lengths = [len(entry[3]) for entry in entries]
+
+        def concat(arrays, dtype):
+            return np.concatenate(arrays).astype(dtype) if len(arrays) > 0 else np.zeros(0, dtype=dtype)
+
+        temp_file_name = self.file_name + ".tmp.npz"
+        np.savez_compressed(
+            temp_file_name,
+            keys=np.array(keys, dtype=str),
+            sims=np.array([entry[0] for entry in entries], dtype=float),
+            o1_offsets=np.concatenate([[0], np.cumsum(o1_lengths)]).astype(np.int64),
+            o1_procexecs=concat([entry[1] for entry in entries], np.int64),
+            o1_max=concat([entry[2] for entry in entries], np.float64),
+            o2_offsets=np.concatenate([[0], np.cumsum(o2_lengths)]).astype(np.int64),
+            o2_procexecs=concat([entry[3] for entry in entries], np.int64),
+            o2_max=concat([entry[4] for entry in entries], np.float64))
+        os.replace(temp_file_name, self.file_name)
+
+    '''
+    Returns the stored entry (sim, o1 procExecs, o1 max sims, o2 procExecs, o2 max sims) for the pair of
+    context tables in the given versions, or None if it has not been computed yet.
+    '''
+    def get_pair(self, ot1, version1, ot2, version2):
+        entry = self.pairs.get((ot1, version1, ot2, version2))
+        if entry is not None:
+            return entry
+        entry = self.pairs.get((ot2, version2, ot1, version1))
+        if entry is not None:
+            sim, o2_procexecs, o2_max, o1_procexecs, o1_max = entry
+            return sim, o1_procexecs, o1_max, o2_procexecs, o2_max
+        return None
+
+    def put_pair(self, ot1, version1, ot2, version2, sim, o1_procexecs, o1_max, o2_procexecs, o2_max):
+        # drop entries of older versions of the same pair
+        for key in [key for key in self.pairs if (key[0], key[2]) in ((ot1, ot2), (ot2, ot1))]:
+            del self.pairs[key]
+        self.pairs[(ot1, version1, ot2, version2)] = (float(sim), np.asarray(o1_procexecs, dtype=np.int64),
+                                                      np.asarray(o1_max, dtype=np.float64),
+                                                      np.asarray(o2_procexecs, dtype=np.int64),
+                                                      np.asarray(o2_max, dtype=np.float64))
+
+    '''
+    Returns the pairwise score matrix for the given views as stored (latest stored version per pair if no
+    versions are given), with nan for pairs that have not been computed. Diagonal entries are 1.
+    '''
+    def pairwise_matrix(self, object_types, versions=None):
+        n = len(object_types)
+        matrix = np.full((n, n), np.nan)
+        latest = {}
+        for (ot1, version1, ot2, version2), entry in self.pairs.items():
+            if versions is not None and (versions.get(ot1) != version1 or versions.get(ot2) != version2):
+                continue
+            latest[(ot1, ot2)] = entry[0]
+            latest[(ot2, ot1)] = entry[0]
+        for i, ot1 in enumerate(object_types):
+            matrix[i][i] = 1
+            for j, ot2 in enumerate(object_types):
+                if i != j and (ot1, ot2) in latest:
+                    matrix[i][j] = latest[(ot1, ot2)]
+        return matrix
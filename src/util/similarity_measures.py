@@ -1,5 +1,7 @@
 import numpy as np
 
+from src.util.nearest_context import nearest_max_similarities
+
 
 def jaccard_sim_edges(view_info, other_view_info):
     edge_indices = view_info[0]
@@ -12,59 +14,38 @@ def jaccard_sim_edges(view_info, other_view_info):
         return 0
     return len(intersection) / (len(edges1) + len(edges2) - len(intersection))
 
-def matching_similarities(view_info, other_view_info):
-    view, num_view = view_info  # view is a dictionary of edges to contexts they are in, num_view is the number of contexts
-    other_view, num_other_view = other_view_info # same for other view
-
-    context_edge_counts_view = np.zeros(num_view) # number of edges in each context
-    context_edge_counts_other_view = np.zeros(num_other_view) # same for other view
-    intersect_counts = np.zeros((num_view, num_other_view)) # rows denote contexts from view,
-                                                        # columns denote contexts from other_view,
-                                                        # cell (i,j) denotes number of edges in context i that are also in context j
+def edge_set_variants(view, num_view):
+    """
+    Compresses the contexts of a view into variants, the distinct edge sets of its contexts.
 
+        @param view: dictionary of edges to the contexts they are in
+        @param num_view: number of contexts, contexts without edges are not in view
+        @return: tuple (list of the edge sets of the variants, array of the number of contexts per variant)
+    """
+    context_edges = {}
     for edge, contexts in view.items():
-        context_edge_counts_view[contexts] += 1
-        #for context in contexts:
-            #context_edge_counts_view[context] += 1 # count edge for each context it is in in view
-
-    for edge, contexts in other_view.items():
-        context_edge_counts_other_view[contexts] += 1
-        #for context in contexts:
-        #    context_edge_counts_other_view[context] += 1  # count edge for each containing context if has not been counted yet
+        for context in contexts:
+            context_edges.setdefault(context, []).append(edge)
+    multiplicities = {}
+    for edges in context_edges.values():
+        edge_set = frozenset(edges)
+        multiplicities[edge_set] = multiplicities.get(edge_set, 0) + 1
+    return list(multiplicities.keys()), np.array(list(multiplicities.values()), dtype=float)
 
-    if len(view) > len(other_view):
-        smaller_view = other_view
-        larger_view = view
-    else:
-        smaller_view = view
-        larger_view = other_view
 
-    for edge, contexts in smaller_view.items():
-        if edge in larger_view:
-            other_contexts = larger_view[edge]
-
-            for context in contexts:
-                for other_context in other_contexts:
-                    intersect_counts[context, other_context] += 1 # count edge for each pair of contexts it is in in view and other view
-
-    #for edge, contexts in other_view.items():
-    #    if edge not in view:
-    #        for context in contexts:
-    #            context_edge_counts_other_view[context] += 1    # count edge for each containing context if has not been counted yet
+def matching_similarities(view_info, other_view_info):
+    view, num_view = view_info  # view is a dictionary of edges to contexts they are in, num_view is the number of contexts
+    other_view, num_other_view = other_view_info # same for other view
 
-    sim_values = np.zeros((num_view, num_other_view))
-    #for i in range(num_view):
-    #    for j in range(num_other_view):
-    #        sim_values[i, j] = intersect_counts[i, j] / (context_edge_counts_view[i] + context_edge_counts_other_view[j] - intersect_counts[i, j])
-    sim_values = intersect_counts / (
-                context_edge_counts_view[:, None] + context_edge_counts_other_view - intersect_counts)
-    #sum_sim = 0
-    #for i in range(num_view):
-    #    sum_sim += np.max(sim_values[i, :])
-    #for j in range(num_other_view):
-    #    sum_sim += np.max(sim_values[:, j])
+    # contexts with the same edge set have the same similarities, they are scored once as variant and weighted
+    # by the number of contexts of the variant
+    variants, multiplicities = edge_set_variants(view, num_view)
+    other_variants, other_multiplicities = edge_set_variants(other_view, num_other_view)
 
-    sum_sim = np.sum(np.max(sim_values, axis=1)) + np.sum(np.max(sim_values, axis=0))
+    # maximum similarity of each variant to the variants of the other view, by nearest-context search instead of
+    # the intersect counts of all pairs of variants
+    max_sims, other_max_sims = nearest_max_similarities(variants, other_variants)
+    sum_sim = np.dot(max_sims, multiplicities) + np.dot(other_max_sims, other_multiplicities)
 
     return sum_sim / (num_view + num_other_view)
 
@@ -0,0 +1,228 @@
+import argparse
+import itertools
+import logging
+
+import duckdb
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+viewmeta_columns = ["viewIdx", "objecttype", "numProcExecs", "numEvents", "AvgNumEventsPerTrace", "numEdges",
+                    "numEventsCovered", "AvgNumUniqueActivitiesPerTrace"]
+
+# layout of the view database, stored in viewschema:
+#   1 -- the EKG generators stored procExec as String, so joins and GROUP BYs of the scoring ran on VARCHAR keys
+#   2 -- every context table is (edge INTEGER, procExec INTEGER), as defined by context_table_columns
+schema_version = 2
+context_table_columns = [("edge", "INTEGER"), ("procExec", "INTEGER")]
+
+# tables derived from a context table, keyed by its procExec
+derived_table_suffixes = ["Counts", "VariantMembers", "Variants", "VariantsCounts"]
+
+
+def create_context_table(con, context_name):
+    """
+    (Re-)creates the context table of a view, with one row (edge, procExec) per edge of each process execution.
+    """
+    con.sql("DROP TABLE IF EXISTS " + context_name)
+    con.sql(f"CREATE TABLE {context_name}(" +
+            ", ".join(f"{column} {column_type}" for column, column_type in context_table_columns) + ")")
+
+
+def set_schema_version(con, version=schema_version):
+    con.sql("CREATE TABLE IF NOT EXISTS viewschema(version INTEGER)")
+    con.sql("DELETE FROM viewschema")
+    con.execute("INSERT INTO viewschema VALUES (?)", [version])
+
+
+def get_schema_version(con):
+    """
+    @return: schema version of the view database, 1 for databases from before the version was stored, None for
+             databases without views
+    """
+    if has_table(con, "viewschema"):
+        return con.sql("SELECT max(version) FROM viewschema").fetchone()[0]
+    return 1 if has_table(con, "viewmeta") else None
+
+
+def migrate_view_database(con):
+    """
+    Upgrades a view database to the current schema version. Context tables with other column types than
+    context_table_columns are rewritten with typed columns and their edge index; the tables derived from them are
+    dropped and recomputed by the next scoring. Context table versions (see score_store) hash the procExec as
+    BIGINT, so the stored scores of migrated tables stay valid.
+
+        @return: list of the migrated context tables
+    """
+    version = get_schema_version(con)
+    if version is None or version >= schema_version:
+        return []
+    migrated = []
+    for (context_name,) in con.sql("SELECT objecttype FROM viewmeta ORDER BY viewIdx").fetchall():
+        if not has_table(con, context_name):
+            continue
+        column_types = {column[0]: column[1] for column in con.sql("DESCRIBE " + context_name).fetchall()}
+        if all(column_types.get(column) == column_type for column, column_type in context_table_columns):
+            continue
+        con.sql(f"CREATE TABLE {context_name}Migrated AS SELECT " +
+                ", ".join(f"CAST({column} AS {column_type}) AS {column}"
+                          for column, column_type in context_table_columns) + f" FROM {context_name}")
+        # dropping the table drops its edge index as well
+        con.sql("DROP TABLE " + context_name)
+        con.sql(f"ALTER TABLE {context_name}Migrated RENAME TO {context_name}")
+        con.sql(f"CREATE INDEX IF NOT EXISTS {context_name}_edge_index ON {context_name}(edge)")
+        for suffix in derived_table_suffixes:
+            con.sql(f"DROP TABLE IF EXISTS {context_name}{suffix}")
+        migrated.append(context_name)
+    set_schema_version(con)
+    con.commit()
+    logging.info(f"Migrated view database from schema version {version} to {schema_version}, rewrote context "
+                 f"tables {migrated}")
+    return migrated
+
+
+def create_viewmeta_table(con):
+    con.sql("DROP TABLE IF EXISTS viewmeta")
+    con.sql("CREATE TABLE IF NOT EXISTS viewmeta(viewIdx INTEGER, objecttype STRING, numProcExecs INTEGER, "
+            "numEvents INTEGER, AvgNumEventsPerTrace FLOAT, numEdges INTEGER, numEventsCovered INTEGER, "
+            "AvgNumUniqueActivitiesPerTrace FLOAT)")
+    con.sql("DROP TABLE IF EXISTS viewcoverage")
+    create_coverage_table(con)
+    con.sql("DROP TABLE IF EXISTS viewedges")
+    set_schema_version(con)
+
+
+def create_coverage_table(con):
+    # covered: bitset over the event ordinals of the log (np.packbits), numEventsTotal: number of events of the log
+    con.sql("CREATE TABLE IF NOT EXISTS viewcoverage(viewIdx INTEGER, objecttype STRING, numEventsTotal BIGINT, "
+            "covered BLOB)")
+
+
+def write_edge_keys(con, edge_keys, batch_size=1000000):
+    """
+    Stores the events of every edge id in viewedges. Edge ids are numbered in the order the edges are first seen,
+    so a new edge renumbers all edges seen after it; the versions of the context tables (see score_store) hash the
+    events of the edges instead of their ids, which keeps the versions of unchanged views across rebuilds.
+
+        @param edge_keys: iterable of (edge id, source event id, target event id)
+    """
+    import pandas as pd
+    con.sql("DROP TABLE IF EXISTS viewedges")
+    con.sql("CREATE TABLE viewedges(edge INTEGER, source STRING, target STRING)")
+    edge_keys = iter(edge_keys)
+    while True:
+        batch = list(itertools.islice(edge_keys, batch_size))
+        if len(batch) == 0:
+            break
+        batch_df = pd.DataFrame([(int(edge_id), str(source), str(target)) for edge_id, source, target in batch],
+                                columns=["edge", "source", "target"])
+        con.sql("INSERT INTO viewedges SELECT * FROM batch_df")
+
+
+def has_table(con, table_name):
+    return con.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?",
+                       [table_name]).fetchone()[0] > 0
+
+
+def insert_view_meta(con, view_idx, context_name, num_proc_execs, num_events, num_events_covered=None,
+                     num_unique_activities=None, covered=None):
+    """
+    Stores the statistics of a view once its context table is filled. The number of distinct edges is counted
+    here, while the table has just been written, instead of on every evaluation.
+
+        @param num_events: number of events over all process executions, incl. duplicates
+        @param num_events_covered: number of distinct events covered by the view
+        @param num_unique_activities: sum over all process executions of their number of distinct activities
+        @param covered: bool array over the event ordinals of the log, the events covered by the view; stored as
+                        bitset for the coverage statistics of view selections
+    """
+    num_edges = con.sql("SELECT COUNT(DISTINCT edge) FROM " + context_name).fetchone()[0]
+    avg_num_events_per_trace = num_events / num_proc_execs if num_proc_execs > 0 else 0
+    avg_num_unique_activities = None
+    if num_unique_activities is not None:
+        avg_num_unique_activities = num_unique_activities / num_proc_execs if num_proc_execs > 0 else 0
+    if covered is not None and num_events_covered is None:
+        num_events_covered = int(np.count_nonzero(covered))
+    con.execute("INSERT INTO viewmeta VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (view_idx, context_name, num_proc_execs, num_events, avg_num_events_per_trace, num_edges,
+                 num_events_covered, avg_num_unique_activities))
+    if covered is not None:
+        create_coverage_table(con)
+        con.execute("INSERT INTO viewcoverage VALUES (?, ?, ?, ?)",
+                    (view_idx, context_name, len(covered), np.packbits(np.asarray(covered, dtype=bool)).tobytes()))
+
+
+def get_view_stats(con, view_indices=None):
+    """
+    Fetches the statistics of views from viewmeta with a single query.
+
+        @param con: open duckdb connection to the view database
+        @param view_indices: indices of views to get statistics for (default: all views)
+        @return: dict of view index to dict of statistics (viewmeta column to value)
+    """
+    columns = [column[0] for column in con.sql("DESCRIBE viewmeta").fetchall()]
+    query = "SELECT * FROM viewmeta"
+    if view_indices is not None:
+        query += " WHERE viewIdx IN (" + ", ".join(str(int(i)) for i in view_indices) + ")"
+    rows = con.sql(query).fetchall()
+    view_stats = {row[0]: dict(zip(columns, row)) for row in rows}
+
+    if "numEdges" not in columns and len(view_stats) > 0:
+        # view database from before the statistics were stored at index construction, count in one pass
+        logging.info("viewmeta without numEdges, counting distinct edges of views")
+        num_edges = con.sql(" UNION ALL ".join(
+            [f"SELECT {view_idx} AS viewIdx, COUNT(DISTINCT edge) FROM {stats['objecttype']}"
+             for view_idx, stats in view_stats.items()])).fetchall()
+        for view_idx, count in num_edges:
+            view_stats[view_idx]["numEdges"] = count
+    for stats in view_stats.values():
+        for column in viewmeta_columns:
+            stats.setdefault(column, None)
+    return view_stats
+
+
+def create_variant_tables(con, context_name):
+    """
+    Compresses the process executions of a context table into variants, the distinct edge sets. Process executions
+    with the same edge set have the same similarities to every other process execution, so scoring only needs one
+    of them, weighted by the number of process executions sharing it.
+    Creates the tables <context>Variants(edge, variant) with the edges of each variant, <context>VariantsCounts(
+    variant, counts, multiplicity) with the number of edges and of process executions of each variant and
+    <context>VariantMembers(procExec, variant) with the variant of each process execution.
+
+        @return: tuple (number of process executions, number of variants)
+    """
+    con.sql(f"DROP TABLE IF EXISTS {context_name}VariantMembers")
+    con.sql(f'''CREATE TABLE {context_name}VariantMembers AS
+                WITH edgeSets AS (SELECT procExec, list(edge ORDER BY edge) AS edges FROM {context_name}
+                                  GROUP BY procExec)
+                SELECT procExec, CAST(dense_rank() OVER (ORDER BY edges) - 1 AS INTEGER) AS variant FROM edgeSets''')
+    con.sql(f"DROP TABLE IF EXISTS {context_name}Variants")
+    con.sql(f'''CREATE TABLE {context_name}Variants AS
+                WITH representatives AS (SELECT variant, min(procExec) AS procExec FROM {context_name}VariantMembers
+                                         GROUP BY variant)
+                SELECT ctx.edge, representatives.variant FROM {context_name} ctx, representatives
+                WHERE ctx.procExec = representatives.procExec''')
+    con.sql(f"DROP TABLE IF EXISTS {context_name}VariantsCounts")
+    con.sql(f'''CREATE TABLE {context_name}VariantsCounts AS
+                WITH multiplicities AS (SELECT variant, COUNT(*) AS multiplicity FROM {context_name}VariantMembers
+                                        GROUP BY variant)
+                SELECT multiplicities.variant, CAST(COUNT(*) AS INTEGER) AS counts,
+                    CAST(multiplicities.multiplicity AS INTEGER) AS multiplicity
+                FROM {context_name}Variants variants, multiplicities
+                WHERE variants.variant = multiplicities.variant
+                GROUP BY multiplicities.variant, multiplicities.multiplicity''')
+    con.commit()
+    return con.sql(f"SELECT COUNT(*), COUNT(DISTINCT variant) FROM {context_name}VariantMembers").fetchone()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Migrate view databases to the current schema version.")
+    parser.add_argument("db_names", type=str, nargs="+", help="View database files (.duckdb)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    for db_name in parse_args().db_names:
+        with duckdb.connect(db_name) as con:
+            migrate_view_database(con)
@@ -6,10 +6,16 @@ import tempfile
 import dbm
 
 import duckdb
+import numpy as np
 
-from src.util.ekg_queries import get_entity_types_query, get_contexts_query_single_object, get_object_pairs_query, \
-    get_events_for_objects_query, entity_type_attr, get_object_pairs_query_iterative
-from src.util.query_result_parser import parse_to_list
+from src.util import memory_governor, metrics
+from src.util.event_sequence_cache import EventSequenceCache, default_memory_budget, merged_sequence_edges, \
+    union_sequence_edges
+from src.util.graph_source import as_graph_source, directly_follows, relation_kinds, EventOrdinalSource
+from src.util.index_checkpoint import IndexCheckpoint, checkpoint_key, resume_after
+from src.util.memory_governor import SpillableEdgeDict
+from src.util.view_tables import create_context_table, create_viewmeta_table, has_table, insert_view_meta, \
+    write_edge_keys
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
@@ -17,9 +23,32 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 incr_edge_idx = 0
 incr_context_idx = 0
 
-def compute_indices_by_interacting_entities(neo4j_connection, temp_db_path, short_name="", duckdb_config=None):
-    result = neo4j_connection.exec_query(get_entity_types_query)
-    entity_types = parse_to_list(result, "e." + entity_type_attr)
+def compute_indices_by_interacting_entities(graph_source, temp_db_path, short_name="", duckdb_config=None,
+                                            event_cache_budget=default_memory_budget, resume=False,
+                                            checkpoint_rows=1000000, relation="total"):
+    """
+    @param relation: relation between the events of a pair context, total (time order of the events of both
+                     objects) or partial (union of the DF edges of the two objects); single-object contexts are the
+                     same for both
+    """
+    global incr_edge_idx
+    global incr_context_idx
+    if relation not in relation_kinds:
+        raise ValueError(f"Unknown relation {relation} (expected one of {relation_kinds})")
+    # ids are numbered per run (a resumed run restores them from the checkpoint), a rebuild of unchanged events
+    # has to yield the same context tables
+    incr_edge_idx = 0
+    incr_context_idx = 0
+    graph_source = as_graph_source(graph_source)
+    entity_types = graph_source.entity_types()
+
+    # event sequences of entities and the ids of their edges are cached for the pair contexts they take part in
+    event_cache = None
+    edge_id_cache = None
+    if isinstance(graph_source, EventOrdinalSource):
+        spill_dir = os.path.dirname(temp_db_path) or None
+        event_cache = EventSequenceCache(graph_source.event_ordinals, memory_budget=event_cache_budget // 2,
+                                         spill_dir=spill_dir)
 
     context_defs = []
     context_defs = [(t,None) for t in entity_types]
@@ -39,46 +68,96 @@ def compute_indices_by_interacting_entities(neo4j_connection, temp_db_path, shor
     with duckdb.connect(temp_db_path, config=config) as duckdb_conn:#,\
         #dbm.open(temp_edges_path, 'c') as edges_db:
 
-        duckdb_conn.sql("DROP TABLE IF EXISTS viewmeta")
-        duckdb_conn.sql(
-            "CREATE TABLE IF NOT EXISTS viewmeta(viewIdx INTEGER, objecttype STRING, numProcExecs INTEGER, numEvents INTEGER, AvgNumEventsPerTrace FLOAT)")
+        if not resume or not has_table(duckdb_conn, "viewmeta"):
+            create_viewmeta_table(duckdb_conn)
 
         #duckdb_conn.sql("DROP TABLE IF EXISTS edges")
         #duckdb_conn.sql("CREATE TABLE IF NOT EXISTS edges(source INTEGER, target INTEGER, edgeId INTEGER primary key)")
 
-        edges_db = {}
+        edges_db = SpillableEdgeDict(spill_dir=os.path.dirname(temp_db_path) or None)
+        checkpoint = None
+        if event_cache is not None:
+            # progress is committed to the index database, resuming restores the edges and counters of the last commit
+            checkpoint = IndexCheckpoint(duckdb_conn, resume=resume, temp_dir=spill_dir)
+            checkpoint.load_edges(edges_db)
+            counters = checkpoint.counters()
+            incr_edge_idx = counters.get("incr_edge_idx", incr_edge_idx)
+            incr_context_idx = counters.get("incr_context_idx", incr_context_idx)
+            if counters.get("partial_order", int(relation == "partial")) != int(relation == "partial"):
+                raise ValueError(f"Checkpoint was written for another relation than {relation}")
+            edge_id_cache = EventSequenceCache(
+                lambda object_ids: {obj_id: sequence_edge_ids(sequence, edges_db)
+                                    for obj_id, sequence in event_cache.get_many(object_ids).items()},
+                memory_budget=event_cache_budget // 2, spill_dir=spill_dir)
+
+        elif resume:
+            raise ValueError("Resuming index construction requires a graph source with event ordinals")
 
         for i, context_def in enumerate(context_defs):
+            if checkpoint is not None and checkpoint.is_complete(context_names[i]):
+                logging.info(f"Relation index for {context_names[i]} complete in checkpoint, skipping")
+                continue
             logging.info(f"Start building relation index for {context_names[i]}")
-            compute_relation_index(neo4j_connection, context_def, context_names[i], duckdb_conn, edges_db)
+            with metrics.timed("context_index", context=context_names[i]):
+                compute_relation_index(graph_source, context_def, context_names[i], duckdb_conn, edges_db,
+                                       event_cache=event_cache, edge_id_cache=edge_id_cache, checkpoint=checkpoint,
+                                       checkpoint_rows=checkpoint_rows, relation=relation)
             logging.info(f"Finished building relation index for {context_names[i]}")
 
+        edge_keys = ((edge_id, source, target) for (source, target), edge_id in edges_db.items())
+        if event_cache is not None:
+            # edges are keyed by event ordinals
+            events = graph_source.events_by_ordinals(range(len(graph_source.event_activity_codes())))
+            edge_keys = ((edge_id, events[int(source)]["id"], events[int(target)]["id"])
+                         for (source, target), edge_id in edges_db.items())
+        write_edge_keys(duckdb_conn, edge_keys)
+
+    edges_db.close()
+    if event_cache is not None:
+        event_cache.close()
+        edge_id_cache.close()
+
+    graph_source.report_stats()
+
+
+def compute_relation_index(graph_source, context_def, context_name, duckdb_conn, edges, event_cache=None,
+                           edge_id_cache=None, checkpoint=None, checkpoint_rows=1000000, relation="total"):
+    if event_cache is not None:
+        compute_relation_index_from_ordinals(graph_source, context_def, context_name, duckdb_conn, edges,
+                                             event_cache, edge_id_cache, checkpoint, checkpoint_rows=checkpoint_rows,
+                                             relation=relation)
+        return
 
-def compute_relation_index(neo4j_connection, context_def, context_name, duckdb_conn, edges):
     global incr_edge_idx
     global incr_context_idx
     ot1, ot2 = context_def
     edge2obj = []
-    batch_size = 100000
+    batch_size = memory_governor.batch_size(100000, minimum=1000)
     i = 0
     temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.csv', dir='data/temp')
     temp_file.close()
+    num_unique_activities = 0
+    events_covered = set()
+    num_rows = 0
 
     if ot2 is None:
         logging.info("start context query for %s", context_name)
-        query_result = neo4j_connection.exec_query(get_contexts_query_single_object, **{"ot1": ot1})
+        query_result = graph_source.single_object_contexts(ot1)
         num_proc_execs = len(query_result)
-        num_events = sum([len(r['eventList']) for r in query_result])
+        num_events = sum([len(events) for events in query_result])
 
-        for pi_idx, record in enumerate(query_result):
-            events = record['eventList']
+        for pi_idx, events in enumerate(query_result):
+            num_unique_activities += len(set(event.get("activity") for event in events))
+            events_covered.update(event["id"] for event in events)
             for j in range(len(events) - 1):
-                if i == batch_size:
+                if i >= batch_size:
                     with open(temp_file.name, 'a', newline='') as csvfile:
                         writer = csv.writer(csvfile)
                         writer.writerows(edge2obj)
                     edge2obj = []
                     i = 0
+                    batch_size = memory_governor.batch_size(100000, minimum=1000)
+                    edges.maybe_spill()
                 #edge = str((events[j]["id"], events[j + 1]["id"]))
                 edge = (events[j]["id"], events[j + 1]["id"])
                 if edge not in edges:
@@ -87,17 +166,15 @@ def compute_relation_index(neo4j_connection, context_def, context_name, duckdb_c
                     incr_edge_idx += 1
                 edge2obj.append((edges[edge], pi_idx))
                 i += 1
+                num_rows += 1
 
         logging.info("Finished context query for %s", context_name)
 
     else:
         logging.info("start context query for %s", context_name)
         #obj_pair_result = neo4j_connection.exec_query(get_object_pairs_query, **{"ot1": ot1, "ot2": ot2})
-        obj_pairs = set()
-        for path_length in range(1,11):
-            obj_pair_result = neo4j_connection.exec_query(get_object_pairs_query_iterative, **{"ot1": ot1, "ot2": ot2, "path_length": path_length})
-            obj_pairs.update([(record["o1"], record["o2"]) for record in obj_pair_result])
-        num_proc_execs = len(obj_pairs)
+        obj_pairs = graph_source.stream_object_pairs(ot1, ot2, max_path_length=10)
+        num_proc_execs = 0
         num_events = 0
         logging.info("Collecting contexts for %s", context_name)
         #obj_pairs = [[o1, o2] for o1, o2 in obj_pairs]
@@ -106,19 +183,27 @@ def compute_relation_index(neo4j_connection, context_def, context_name, duckdb_c
         logging.info("query done")
         for pi_idx, obj_pair in enumerate(obj_pairs):
             o1, o2 = obj_pair
+            num_proc_execs += 1
             #query_result = neo4j_connection.exec_query(get_events_for_objects_query, **{"o1": obj_pair["o1"], "o2": obj_pair["o1"]})
-            query_result = neo4j_connection.exec_query(get_events_for_objects_query, **{"o1": o1, "o2": o2})
-            events = query_result[0]['eventList']
+            if relation == "partial":
+                events, event_relations = graph_source.partial_order_for_objects([o1, o2])
+            else:
+                events = graph_source.events_for_objects([o1, o2])
+                event_relations = directly_follows(events)
         #for pi_idx, obj_pair_res in enumerate(obj_pair_events):
         #    events = obj_pair_res['eventList']
             num_events += len(events)
-            for j in range(len(events) - 1):
-                if i == batch_size:
+            num_unique_activities += len(set(event.get("activity") for event in events))
+            events_covered.update(event["id"] for event in events)
+            for edge in event_relations:
+                if i >= batch_size:
                     with open(temp_file.name, 'a', newline='') as csvfile:
                         writer = csv.writer(csvfile)
                         writer.writerows(edge2obj)
                     edge2obj = []
                     i = 0
+                    batch_size = memory_governor.batch_size(100000, minimum=1000)
+                    edges.maybe_spill()
 
                     if os.path.getsize(temp_file.name) > 50000000000:
                         duckdb_conn.close()
@@ -126,14 +211,13 @@ def compute_relation_index(neo4j_connection, context_def, context_name, duckdb_c
                         #edges.close()
                         raise Exception("Relation index too large")
 
-                #edge = str((events[j]["id"], events[j + 1]["id"]))
-                edge = (events[j]["id"], events[j + 1]["id"])
                 if edge not in edges:
                     #edges[edge] = str(incr_edge_idx)
                     edges[edge] = incr_edge_idx
                     incr_edge_idx += 1
                 edge2obj.append((edges[edge], pi_idx))
                 i += 1
+                num_rows += 1
         logging.info("Collected contexts for %s", context_name)
 
     # write remaining edges
@@ -145,28 +229,185 @@ def compute_relation_index(neo4j_connection, context_def, context_name, duckdb_c
     # only store non-empty views
     if num_proc_execs > 0:
         # create db table
-        duckdb_conn.sql("DROP TABLE IF EXISTS " + context_name)
-        duckdb_conn.sql("CREATE TABLE IF NOT EXISTS " + context_name + "(edge INTEGER, procExec String)")
+        create_context_table(duckdb_conn, context_name)
+
+        # transfer entries from temp csv file to corresponding duck db table
+        with metrics.timed("relation_index_ingest", context=context_name):
+            duckdb_conn.sql(f"COPY {context_name} FROM '{temp_file.name}' (DELIMITER ',')")
+            duckdb_conn.commit()
 
         # store meta information on view, esp. cidx and name for reuse in scoring
-        avg_num_events_per_trace = num_events / num_proc_execs if num_proc_execs > 0 else 0
-        duckdb_conn.execute("INSERT INTO viewmeta VALUES (?, ?, ?, ?, ?)",
-                            (incr_context_idx, context_name, num_proc_execs, num_events, avg_num_events_per_trace))
+        insert_view_meta(duckdb_conn, incr_context_idx, context_name, num_proc_execs, num_events,
+                         num_events_covered=len(events_covered), num_unique_activities=num_unique_activities)
         duckdb_conn.commit()
 
         # only counting indices for non-empty views, to match indices for list of views later on
         incr_context_idx += 1
 
-        # transfer entries from temp csv file to corresponding duck db table
-        duckdb_conn.sql(f"COPY {context_name} FROM '{temp_file.name}' (DELIMITER ',')")
-        duckdb_conn.commit()
-
         #create index on edge column for join later on
         duckdb_conn.sql(
             "CREATE INDEX IF NOT EXISTS " + context_name + "_edge_index ON " + context_name + "(edge)")
         duckdb_conn.commit()
 
+    metrics.count("rows_written", num_rows, context=context_name)
+    metrics.count("bytes_staged", os.path.getsize(temp_file.name), context=context_name)
+    metrics.sample_duckdb_memory(duckdb_conn, context=context_name)
+
     temp_file.close()
     os.remove(temp_file.name)
 
     logging.info("Ingested relation index for context %s", context_name)
+
+
+def assign_edge_ids(sources, targets, edges):
+    """
+    @return: ids of the edges from the source to the target event ordinals, new edges get new ids
+    """
+    global incr_edge_idx
+    edge_ids = np.empty(len(sources), dtype=np.int64)
+    for j, edge in enumerate(zip(sources.tolist(), targets.tolist())):
+        edge_id = edges.get(edge)
+        if edge_id is None:
+            edge_id = incr_edge_idx
+            edges[edge] = edge_id
+            incr_edge_idx += 1
+        edge_ids[j] = edge_id
+    return edge_ids
+
+
+def sequence_edge_ids(sequence, edges):
+    """
+    @return: ids of the edges between consecutive events of the event-ordinal sequence
+    """
+    return assign_edge_ids(sequence[:-1], sequence[1:], edges)
+
+
+def compute_relation_index_from_ordinals(graph_source, context_def, context_name, duckdb_conn, edges, event_cache,
+                                         edge_id_cache, checkpoint, checkpoint_rows=1000000, relation="total"):
+    """
+    Builds the context table from event ordinals. Rows are ingested and committed together with the checkpoint
+    every checkpoint_rows rows, a resumed context continues after its last committed process execution.
+    """
+    progress = checkpoint.context_progress(context_name, len(graph_source.event_activity_codes()))
+    if progress.proc_execs_done == 0:
+        create_context_table(duckdb_conn, context_name)
+    else:
+        logging.info(f"Resuming {context_name} after {progress.proc_execs_done} process executions")
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.csv', dir='data/temp')
+    temp_file.close()
+    bytes_staged = 0
+
+    def commit():
+        global incr_context_idx
+        nonlocal bytes_staged
+        staged = os.path.getsize(temp_file.name)
+        bytes_staged += staged
+        checkpoint.begin()
+        if staged > 0:
+            with metrics.timed("relation_index_ingest", context=context_name):
+                duckdb_conn.sql(f"COPY {context_name} FROM '{temp_file.name}' (DELIMITER ',')")
+        if progress.complete and progress.proc_execs_done > 0:
+            # store meta information on view, esp. cidx and name for reuse in scoring
+            insert_view_meta(duckdb_conn, incr_context_idx, context_name, progress.proc_execs_done,
+                             progress.num_events, num_unique_activities=progress.num_unique_activities,
+                             covered=progress.covered)
+            incr_context_idx += 1
+            duckdb_conn.sql(
+                "CREATE INDEX IF NOT EXISTS " + context_name + "_edge_index ON " + context_name + "(edge)")
+        elif progress.complete:
+            # only store non-empty views
+            duckdb_conn.sql("DROP TABLE " + context_name)
+        checkpoint.commit(context_name, progress, edges,
+                          {"incr_edge_idx": incr_edge_idx, "incr_context_idx": incr_context_idx,
+                           "partial_order": int(relation == "partial")})
+        # committed edges can leave memory, the checkpoint only needs the ones added after this commit
+        edges.maybe_spill()
+
+    logging.info("start context query for %s", context_name)
+    write_edges_from_ordinals(graph_source, context_def, temp_file.name, edges, event_cache, edge_id_cache, progress,
+                              on_checkpoint=commit, checkpoint_rows=checkpoint_rows, relation=relation)
+    logging.info("Finished context query for %s", context_name)
+    progress.complete = True
+    commit()
+
+    metrics.count("rows_written", progress.num_rows, context=context_name)
+    metrics.count("bytes_staged", bytes_staged, context=context_name)
+    metrics.sample_duckdb_memory(duckdb_conn, context=context_name)
+    os.remove(temp_file.name)
+    logging.info("Ingested relation index for context %s", context_name)
+
+
+def write_edges_from_ordinals(graph_source, context_def, file_name, edges, event_cache, edge_id_cache, progress,
+                              on_checkpoint=None, checkpoint_rows=1000000, pair_batch_size=1024, relation="total"):
+    """
+    Writes the (edge, procExec) rows of a context to file_name, with edges keyed by event ordinals. The edge ids of
+    each single-object context are cached per entity; the edges of pair contexts are derived from the cached
+    sequences and edge ids of the two objects, a batch of pairs at a time, so only the edges at interleaving points
+    of the two sequences are looked up. With the partial order, the edges of a pair are those of its two objects
+    and no edge is looked up.
+
+    Starts after the last process execution done in progress, found by its object ids (see resume_after), and
+    accumulates the view statistics in progress. Every
+    checkpoint_rows rows, on_checkpoint is called with the rows staged in file_name, which is emptied afterwards.
+    """
+    ot1, ot2 = context_def
+    activity_codes = graph_source.event_activity_codes()
+    num_activities = int(activity_codes.max()) + 1 if len(activity_codes) > 0 else 1
+    first_proc_exec = progress.proc_execs_done
+
+    with open(file_name, 'a', newline='') as csvfile:
+        staged_rows = 0
+
+        def write_contexts(num_contexts, last_key, ordinals, ordinal_pi, edge_ids, edge_pi):
+            nonlocal staged_rows
+            progress.proc_execs_done += num_contexts
+            progress.last_key = checkpoint_key(last_key)
+            progress.num_events += len(ordinals)
+            progress.num_unique_activities += len(np.unique(ordinal_pi * num_activities + activity_codes[ordinals]))
+            progress.num_rows += len(edge_ids)
+            progress.covered[ordinals] = True
+            if len(edge_ids) > 0:
+                csvfile.write("\n".join(map("{},{}".format, edge_ids.tolist(), edge_pi.tolist())) + "\n")
+            staged_rows += len(edge_ids)
+            # commits come more often under memory pressure, which bounds the edges kept for the next commit
+            if on_checkpoint is not None and \
+                    staged_rows >= memory_governor.batch_size(checkpoint_rows, minimum=1000):
+                csvfile.flush()
+                on_checkpoint()
+                csvfile.seek(0)
+                csvfile.truncate()
+                staged_rows = 0
+
+        if ot2 is None:
+            contexts = resume_after(graph_source.entity_event_ordinals(ot1), progress, key=lambda context: context[0])
+            for pi_idx, (obj_id, ordinals) in enumerate(contexts, start=first_proc_exec):
+                event_cache.put(obj_id, ordinals)
+                edge_ids = sequence_edge_ids(ordinals, edges)
+                edge_id_cache.put(obj_id, edge_ids)
+                write_contexts(1, obj_id, ordinals, np.zeros(len(ordinals), dtype=np.int64), edge_ids,
+                               np.full(len(edge_ids), pi_idx, dtype=np.int64))
+        else:
+            pairs = resume_after(graph_source.stream_object_pairs(ot1, ot2, max_path_length=10), progress)
+            pi_offset = first_proc_exec
+            while True:
+                batch = list(itertools.islice(pairs, memory_governor.batch_size(pair_batch_size, minimum=16)))
+                if len(batch) == 0:
+                    break
+                objects = [obj_id for pair in batch for obj_id in pair]
+                sequences = event_cache.get_many(objects)
+                object_edge_ids = edge_id_cache.get_many(objects)
+                if relation == "partial":
+                    ordinals, ordinal_pair, edge_ids, edge_pair = union_sequence_edges(
+                        [sequences[o1] for o1, _ in batch], [object_edge_ids[o1] for o1, _ in batch],
+                        [sequences[o2] for _, o2 in batch], [object_edge_ids[o2] for _, o2 in batch])
+                    write_contexts(len(batch), batch[-1], ordinals, ordinal_pair, edge_ids, edge_pair + pi_offset)
+                    pi_offset += len(batch)
+                    continue
+                ordinals, ordinal_pair, edge_positions, edge_ids = merged_sequence_edges(
+                    [sequences[o1] for o1, _ in batch], [object_edge_ids[o1] for o1, _ in batch],
+                    [sequences[o2] for _, o2 in batch], [object_edge_ids[o2] for _, o2 in batch])
+                interleavings = edge_positions[edge_ids == -1]
+                edge_ids[edge_ids == -1] = assign_edge_ids(ordinals[interleavings], ordinals[interleavings + 1], edges)
+                write_contexts(len(batch), batch[-1], ordinals, ordinal_pair, edge_ids,
+                               ordinal_pair[edge_positions] + pi_offset)
+                pi_offset += len(batch)
@@ -1,85 +1,119 @@
+import asyncio
 import csv
 import dbm
 import logging
 import os
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 import duckdb
 
-from src.util.ekg_queries import \
-    get_leading_type_query, get_process_instances_multiple_objects, get_objects_for_leading_type, \
-    get_objects_for_leading_type_object_iteratively, get_entity_types_query, entity_type_attr, \
-    get_objects_for_leading_type_object_union
-from src.util.query_result_parser import parse_to_list
+from src.util import memory_governor, metrics
+from src.util.graph_source import as_graph_source, AsyncNeo4jGraphSource, directly_follows, relation_kinds, \
+    EventOrdinalSource
+from src.util.memory_governor import SpillableEdgeDict
+from src.util.view_tables import create_context_table, create_viewmeta_table, insert_view_meta, write_edge_keys
 
 
 incr_edge_idx = 0
 
-def compute_indices_by_ekg_leading_types(neo4j_connection, temp_db_path, short_name="", duckdb_config=None, max_path_length=1000):
-    result = neo4j_connection.exec_query(get_entity_types_query)
-    entity_types = parse_to_list(result, "e." + entity_type_attr)
+def compute_indices_by_ekg_leading_types(graph_source, temp_db_path, short_name="", duckdb_config=None, max_path_length=1000,
+                                         relation="total"):
+    if relation not in relation_kinds:
+        raise ValueError(f"Unknown relation {relation} (expected one of {relation_kinds})")
+    if isinstance(graph_source, AsyncNeo4jGraphSource):
+        asyncio.run(compute_indices_by_ekg_leading_types_async(graph_source, temp_db_path, duckdb_config=duckdb_config,
+                                                               max_path_length=max_path_length, relation=relation))
+        return
 
-    config = {}
-    if duckdb_config is not None:
-        if "memory_limit" in duckdb_config:
-            config["memory_limit"] = duckdb_config["memory_limit"]
-        if "threads" in duckdb_config:
-            config["threads"] = duckdb_config["threads"]
+    global incr_edge_idx
+    # edge ids are numbered per run, a rebuild of unchanged events has to yield the same context tables
+    incr_edge_idx = 0
+    graph_source = as_graph_source(graph_source)
+    entity_types = graph_source.entity_types()
 
     #temp_edges_path = os.path.join(os.path.dirname(temp_db_path), f"ekg_leading_types_edges_{short_name}.dbm")
-    with duckdb.connect(temp_db_path, config=config) as duckdb_conn: #, \
+    with duckdb.connect(temp_db_path, config=get_duckdb_config(duckdb_config)) as duckdb_conn: #, \
            # dbm.open(temp_edges_path, 'c') as edges_db:
 
-        duckdb_conn.sql("DROP TABLE IF EXISTS viewmeta")
-        duckdb_conn.sql(
-            "CREATE TABLE IF NOT EXISTS viewmeta(viewIdx INTEGER, objecttype STRING, numProcExecs INTEGER, numEvents INTEGER, AvgNumEventsPerTrace FLOAT)")
+        create_context_tables(duckdb_conn, entity_types)
 
-        # duckdb_conn.sql("DROP TABLE IF EXISTS edges")
-        # duckdb_conn.sql("CREATE TABLE IF NOT EXISTS edges(source INTEGER, target INTEGER, edgeId INTEGER primary key)")
-
-        for context_name in entity_types:
-            duckdb_conn.sql("DROP TABLE IF EXISTS " + context_name)
-            duckdb_conn.sql("CREATE TABLE IF NOT EXISTS " + context_name + "(edge INTEGER, procExec String)")
-        duckdb_conn.commit()
-
-        edges_db = {}
+        edges_db = SpillableEdgeDict(spill_dir=os.path.dirname(temp_db_path) or None)
         for cidx, entity_type in enumerate(entity_types):
             logging.info("Computing leading type context for %s", entity_type)
-            compute_leading_type_context_iteratively(cidx, entity_type, neo4j_connection, duckdb_conn, edges_db, max_path_length=max_path_length, entity_types=entity_types)
+            with metrics.timed("context_index", context=entity_type):
+                compute_leading_type_context_iteratively(cidx, entity_type, graph_source, duckdb_conn, edges_db, max_path_length=max_path_length, entity_types=entity_types,
+                                                         relation=relation)
             #compute_leading_type_context_union(i, entity_type, neo4j_connection, duckdb_conn, edges_db,
             #                                         max_path_length=10, entity_types=entity_types)
             duckdb_conn.sql("CREATE INDEX IF NOT EXISTS " + entity_type + "_edge_index ON " + entity_type + "(edge)")
             duckdb_conn.commit()
+        write_edge_keys(duckdb_conn, ((edge_id, source, target) for (source, target), edge_id in edges_db.items()))
+        edges_db.close()
 
-def compute_leading_type_context_iteratively(cidx, ot1, neo4j_connection, duckdb_conn, edges_db, max_path_length=10, entity_types=None):
-    query_results = neo4j_connection.exec_query(get_objects_for_leading_type, **{"ot1": ot1})
-    contexts4leading = []
-    for record in query_results:
-        objId = record['id']
-        context = [objId]
-        types_seen_distance = {}
+    graph_source.report_stats()
 
-        logging.info("start query for %s", objId)
+async def compute_indices_by_ekg_leading_types_async(graph_source, temp_db_path, duckdb_config=None, max_path_length=1000,
+                                                     relation="total"):
+    global incr_edge_idx
+    incr_edge_idx = 0
+    entity_types = await graph_source.entity_types()
 
-        for i in range(max_path_length):
-            result = neo4j_connection.exec_query(get_objects_for_leading_type_object_iteratively, **{"objId": objId, "path_length": i})
-            #print(result)
-            for record in result:
-                if record['entType'] not in types_seen_distance:
-                    types_seen_distance[record['entType']] = i
-                    context.append(record['ent2Id'])
-                else:
-                    if i <= types_seen_distance[record['entType']]:
-                        context.append(record['ent2Id'])
-            if entity_types is not None:
-                if all([ot in types_seen_distance for ot in entity_types]):
-                    break
-        logging.info("finished queries for %s", objId)
-        contexts4leading.append(context)
+    with duckdb.connect(temp_db_path, config=get_duckdb_config(duckdb_config)) as duckdb_conn:
+        create_context_tables(duckdb_conn, entity_types)
+
+        edges_db = SpillableEdgeDict(spill_dir=os.path.dirname(temp_db_path) or None)
+        for cidx, entity_type in enumerate(entity_types):
+            logging.info("Computing leading type context for %s", entity_type)
+            with metrics.timed("context_index", context=entity_type):
+                await compute_leading_type_context_async(cidx, entity_type, graph_source, duckdb_conn, edges_db,
+                                                         max_path_length=max_path_length, entity_types=entity_types,
+                                                         max_in_flight=graph_source.max_in_flight,
+                                                         relation=relation)
+            duckdb_conn.sql("CREATE INDEX IF NOT EXISTS " + entity_type + "_edge_index ON " + entity_type + "(edge)")
+            duckdb_conn.commit()
+        write_edge_keys(duckdb_conn, ((edge_id, source, target) for (source, target), edge_id in edges_db.items()))
+        edges_db.close()
+
+    graph_source.report_stats()
+    await graph_source.close()
+
+def get_duckdb_config(duckdb_config):
+    config = {}
+    if duckdb_config is not None:
+        if "memory_limit" in duckdb_config:
+            config["memory_limit"] = duckdb_config["memory_limit"]
+        if "threads" in duckdb_config:
+            config["threads"] = duckdb_config["threads"]
+    return config
+
+def create_context_tables(duckdb_conn, entity_types):
+    create_viewmeta_table(duckdb_conn)
+
+    # duckdb_conn.sql("DROP TABLE IF EXISTS edges")
+    # duckdb_conn.sql("CREATE TABLE IF NOT EXISTS edges(source INTEGER, target INTEGER, edgeId INTEGER primary key)")
+
+    for context_name in entity_types:
+        create_context_table(duckdb_conn, context_name)
+    duckdb_conn.commit()
 
-    compute_relation_index(contexts4leading, neo4j_connection, duckdb_conn, cidx, ot1, edges_db)
+def compute_leading_type_context_iteratively(cidx, ot1, graph_source, duckdb_conn, edges_db, max_path_length=10, entity_types=None,
+                                             relation="total"):
+    objects = graph_source.objects_of_type(ot1)
+
+    def contexts4leading():
+        # contexts are streamed into the relation index instead of being collected for all objects first
+        for objId in objects:
+            logging.info("start query for %s", objId)
+            context = graph_source.leading_type_context(objId, max_path_length=max_path_length, entity_types=entity_types)
+            logging.info("finished queries for %s", objId)
+            yield context
+
+    compute_relation_index(contexts4leading(), graph_source, duckdb_conn, cidx, ot1, edges_db,
+                           num_proc_execs=len(objects), relation=relation)
 
 def compute_leading_type_context_union(cidx, ot1, neo4j_connection, duckdb_conn, edges_db, max_path_length=1000, entity_types=None):
+    from src.util.ekg_queries import get_objects_for_leading_type, get_objects_for_leading_type_object_union
     query_results = neo4j_connection.exec_query(get_objects_for_leading_type, **{"ot1": ot1})
     contexts4leading = []
     for record in query_results:
@@ -107,69 +141,158 @@ def compute_leading_type_context_union(cidx, ot1, neo4j_connection, duckdb_conn,
 
         contexts4leading.append(context)
 
-    compute_relation_index(contexts4leading, neo4j_connection, duckdb_conn, cidx, ot1, edges_db)
+    compute_relation_index(contexts4leading, as_graph_source(neo4j_connection), duckdb_conn, cidx, ot1, edges_db)
 
 
-def compute_relation_index(contexts, neo4j_connection, duckdb_conn, cidx, context_name, edges):
-    global incr_edge_idx
-    edge2obj = []
-    batch_size = 50000
-    i = 0
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.csv', dir="data/temp")
-    temp_file.close()
-    num_proc_execs = len(contexts)
-    num_events = 0
+def compute_relation_index(contexts, graph_source, duckdb_conn, cidx, context_name, edges, num_proc_execs=None,
+                           relation="total"):
+    writer = RelationIndexWriter(duckdb_conn, cidx, context_name, edges,
+                                 num_proc_execs=len(contexts) if num_proc_execs is None else num_proc_execs)
 
     logging.info("start context query for %s", context_name)
-
     for pi_idx, context in enumerate(contexts):
-        view = neo4j_connection.exec_query(get_process_instances_multiple_objects, **{"objectIdList": context})
-        events = view[0]['eventList']
-        num_events += len(events)
-
-        for j in range(len(events) - 1):
-            if i == batch_size:
-                with open(temp_file.name, 'a', newline='') as csvfile:
-                    writer = csv.writer(csvfile)
-                    writer.writerows(edge2obj)
-                edge2obj = []
-                i = 0
-
-                if os.path.getsize(temp_file.name) > 50000000000:
-                    duckdb_conn.close()
-                    temp_file.close()
-                    #edges.close()
+        if relation == "partial":
+            writer.add(pi_idx, *graph_source.partial_order_for_objects(context))
+        else:
+            writer.add(pi_idx, graph_source.events_for_objects(context))
+    logging.info("end context query for %s", context_name)
+
+    writer.finish(covered=graph_source.event_coverage(writer.events_covered)
+                  if isinstance(graph_source, EventOrdinalSource) else None)
+
+
+class RelationIndexWriter:
+
+    """
+    Derives the edges of the process executions of one context, stages them in a temporary CSV file and ingests
+    them into the context table together with the view statistics.
+
+    @param edges: SpillableEdgeDict of edge (pair of event ids) to edge id, shared by all contexts
+    @param num_proc_execs: number of process executions of the context
+    """
+    def __init__(self, duckdb_conn, cidx, context_name, edges, num_proc_execs, batch_size=50000):
+        self.duckdb_conn = duckdb_conn
+        self.cidx = cidx
+        self.context_name = context_name
+        self.edges = edges
+        self.num_proc_execs = num_proc_execs
+        self.max_batch_size = batch_size
+        self.batch_size = memory_governor.batch_size(batch_size, minimum=1000)
+        self.temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.csv', dir="data/temp")
+        self.temp_file.close()
+        self.edge2obj = []
+        self.num_events = 0
+        self.num_unique_activities = 0
+        self.events_covered = set()
+        self.num_rows = 0
+
+    def add(self, pi_idx, events, event_relations=None):
+        """
+        @param event_relations: list of (source event id, target event id), the edges of the process execution
+                                (default: the consecutive events of the time-ordered events)
+        """
+        global incr_edge_idx
+        self.num_events += len(events)
+        self.num_unique_activities += len(set(event.get("activity") for event in events))
+        self.events_covered.update(event["id"] for event in events)
+
+        for edge in directly_follows(events) if event_relations is None else event_relations:
+            if len(self.edge2obj) >= self.batch_size:
+                self.flush()
+                # smaller flushes and spilled edges under memory pressure
+                self.batch_size = memory_governor.batch_size(self.max_batch_size, minimum=1000)
+                self.edges.maybe_spill()
+
+                if os.path.getsize(self.temp_file.name) > 50000000000:
+                    self.duckdb_conn.close()
                     raise Exception("Relation index too large")
 
-            #edge = str((events[j]["id"], events[j + 1]["id"]))
-            edge = (events[j]["id"], events[j + 1]["id"])
-            if edge not in edges:
-                #edges[edge] = str(incr_idx)
-                edges[edge] = incr_edge_idx
+            edge_id = self.edges.get(edge)
+            if edge_id is None:
+                edge_id = incr_edge_idx
+                self.edges[edge] = edge_id
                 incr_edge_idx += 1
-            edge2obj.append((int(edges[edge]), pi_idx))
-            i += 1
-    logging.info("end context query for %s", context_name)
+            self.edge2obj.append((int(edge_id), pi_idx))
+            self.num_rows += 1
 
-    if len(edge2obj) > 0:
-        with open(temp_file.name, 'a', newline='') as csvfile:
+    def flush(self):
+        with open(self.temp_file.name, 'a', newline='') as csvfile:
             writer = csv.writer(csvfile)
-            writer.writerows(edge2obj)
-
-    if len(contexts) > 0:
-        duckdb_conn.sql(f"COPY {context_name} FROM '{temp_file.name}' (DELIMITER ',')")
-        duckdb_conn.commit()
-
-    temp_file.close()
-    os.remove(temp_file.name)
-
-    duckdb_conn.execute("INSERT INTO viewmeta VALUES (?, ?, ?, ?, ?)",
-                (cidx, context_name, num_proc_execs, num_events, num_events / num_proc_execs if num_proc_execs > 0 else 0))
-    duckdb_conn.commit()
-
-    logging.info("Ingested relation index")
+            writer.writerows(self.edge2obj)
+        self.edge2obj = []
+
+    def finish(self, covered=None):
+        """
+        @param covered: bool array over the event ordinals of the log, the events covered by the context
+        """
+        if len(self.edge2obj) > 0:
+            self.flush()
+
+        if self.num_proc_execs > 0:
+            with metrics.timed("relation_index_ingest", context=self.context_name):
+                self.duckdb_conn.sql(f"COPY {self.context_name} FROM '{self.temp_file.name}' (DELIMITER ',')")
+                self.duckdb_conn.commit()
+        metrics.count("rows_written", self.num_rows, context=self.context_name)
+        metrics.count("bytes_staged", os.path.getsize(self.temp_file.name), context=self.context_name)
+        metrics.sample_duckdb_memory(self.duckdb_conn, context=self.context_name)
+
+        os.remove(self.temp_file.name)
+
+        insert_view_meta(self.duckdb_conn, self.cidx, self.context_name, self.num_proc_execs, self.num_events,
+                         num_events_covered=len(self.events_covered),
+                         num_unique_activities=self.num_unique_activities, covered=covered)
+        self.duckdb_conn.commit()
+
+        logging.info("Ingested relation index")
+
+
+async def compute_leading_type_context_async(cidx, ot1, graph_source, duckdb_conn, edges_db, max_path_length=10,
+                                             entity_types=None, max_in_flight=16, relation="total"):
+    """
+    Computes the leading type context of ot1 with up to max_in_flight objects queried concurrently. Fetched
+    process executions pass through a bounded queue to the edge-writing stage, which runs in a separate thread;
+    when writing falls behind, the queue fills up and no new queries are issued until it drains. A failed query
+    is passed through the queue as well and raised here.
+    """
+    objects = await graph_source.objects_of_type(ot1)
+    writer = RelationIndexWriter(duckdb_conn, cidx, ot1, edges_db, num_proc_execs=len(objects))
+    pending = iter(enumerate(objects))
+    queue = asyncio.Queue(maxsize=max_in_flight)
+
+    async def fetch():
+        try:
+            for pi_idx, objId in pending:
+                context = await graph_source.leading_type_context(objId, max_path_length=max_path_length,
+                                                                  entity_types=entity_types)
+                if relation == "partial":
+                    await queue.put((pi_idx, *await graph_source.partial_order_for_objects(context)))
+                else:
+                    await queue.put((pi_idx, await graph_source.events_for_objects(context), None))
+        except Exception as e:
+            # the writing stage waits for the process executions of all objects, so it has to learn of the failure
+            await queue.put(e)
+
+    logging.info("start context query for %s", ot1)
+    fetchers = [asyncio.create_task(fetch()) for _ in range(max_in_flight)]
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        try:
+            for _ in range(len(objects)):
+                item = await queue.get()
+                if isinstance(item, Exception):
+                    raise item
+                pi_idx, events, event_relations = item
+                await loop.run_in_executor(executor, writer.add, pi_idx, events, event_relations)
+        finally:
+            for fetcher in fetchers:
+                fetcher.cancel()
+        await asyncio.gather(*fetchers, return_exceptions=True)
+    logging.info("end context query for %s", ot1)
+
+    writer.finish(covered=await graph_source.event_coverage(writer.events_covered))
 
 def compute_leading_type_context(ot1, neo4j_connection):
+    from src.util.ekg_queries import get_leading_type_query, get_process_instances_multiple_objects
     query_result = neo4j_connection.exec_query(get_leading_type_query, **{"ot1": ot1})
     contexts = []
     for record in query_result:
@@ -3,17 +3,21 @@ import csv
 import logging
 import os
 
-from ocpa.objects.log.importer.csv import factory as csv_import_factory
-from ocpa.objects.log.importer.ocel import factory as ocel_import_factory
-from tqdm import tqdm
 import duckdb
+import numpy as np
 import tempfile
 
+from src.util import memory_governor, metrics
+from src.util.memory_governor import SpillableEdgeDict
+from src.util.view_tables import create_context_table, create_viewmeta_table, insert_view_meta
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 
 incr_edge_idx = 0
 
 def get_ocel_from_csv(filename, leading_type, object_types, act_name, time_name, sep):
+    # ocpa (and pm4py with it) is only imported when a log is loaded
+    from ocpa.objects.log.importer.csv import factory as csv_import_factory
     parameters = {
         "obj_names": object_types,
         "val_names": [],
@@ -27,6 +31,7 @@ def get_ocel_from_csv(filename, leading_type, object_types, act_name, time_name,
     return ocel
 
 def get_ocel_from_json(filename, leading_type):
+    from ocpa.objects.log.importer.ocel import factory as ocel_import_factory
     parameters = {
         "execution_extraction": "leading_type",
         "leading_type": leading_type
@@ -58,6 +63,7 @@ def compute_edges_by_leading_type(filename, file_type="json", object_types=None,
 '''
 def compute_indices_by_leading_type_db(filename, db_name, file_type="json", object_types=None, act_name=None,
                                        time_name=None, sep=None, duckdb_config=None):
+    from tqdm import tqdm
 
     config = {}
     if duckdb_config is not None:
@@ -67,64 +73,88 @@ def compute_indices_by_leading_type_db(filename, db_name, file_type="json", obje
             config["threads"] = duckdb_config["threads"]
 
     with duckdb.connect(db_name, config = config) as con:
-        con.sql("DROP TABLE IF EXISTS viewmeta")
-        con.sql("CREATE TABLE IF NOT EXISTS viewmeta(viewIdx INTEGER, objecttype STRING, numProcExecs INTEGER, numEvents INTEGER, AvgNumEventsPerTrace FLOAT)")
+        create_viewmeta_table(con)
 
         con.sql("DROP TABLE IF EXISTS edges")
         con.sql("CREATE TABLE IF NOT EXISTS edges(source INTEGER, target INTEGER, edgeId INTEGER primary key)")
 
         for object_type in object_types:
-            con.sql("DROP TABLE IF EXISTS " + object_type)
-            con.sql("CREATE TABLE IF NOT EXISTS " + object_type + "(edge INTEGER, procExec INTEGER)")
+            create_context_table(con, object_type)
 
         con.commit()
 
-        edges = dict()
+        edges = SpillableEdgeDict(spill_dir=os.path.dirname(db_name) or None)
 
         for i, obj_type in tqdm(enumerate(object_types), desc="Preparing relation indices for leading types"):
             logging.info(f"Start loading: {obj_type}")
-            ocel = load_ocel_by_leading_type(filename, obj_type, file_type, object_types, act_name, time_name, sep)
+            with metrics.timed("ocel_load", context=obj_type):
+                ocel = load_ocel_by_leading_type(filename, obj_type, file_type, object_types, act_name, time_name, sep)
             logging.info(f"Done loading: {obj_type}")
 
             logging.info(f"Start building relation index for {obj_type}")
             temp_path = os.path.dirname(db_name)
-            compute_relation_index(obj_type, ocel, con, edges, temp_path=temp_path)
+            with metrics.timed("context_index", context=obj_type):
+                compute_relation_index(obj_type, ocel, con, edges, temp_path=temp_path)
 
             num_proc_exec = len(ocel.process_executions)
             num_of_events = sum([len(proc_exec) for proc_exec in ocel.process_executions])
-            avg_num_of_events_per_trace = num_of_events / num_proc_exec if num_proc_exec > 0 else 0
-            con.execute("INSERT INTO viewmeta VALUES (?, ?, ?, ?, ?)",
-                    (i, obj_type, num_proc_exec, num_of_events, avg_num_of_events_per_trace))
+            events_covered = set().union(*ocel.process_executions)
+            activities = dict(zip(ocel.log.log["event_id"], ocel.log.log["event_activity"]))
+            num_unique_activities = sum([len(set(activities[e] for e in proc_exec))
+                                         for proc_exec in ocel.process_executions])
+            insert_view_meta(con, i, obj_type, num_proc_exec, num_of_events,
+                             num_unique_activities=num_unique_activities,
+                             covered=event_coverage(ocel.log.log["event_id"], events_covered))
             con.commit()
 
             con.sql("CREATE INDEX IF NOT EXISTS " + obj_type + "_edge_index ON " + obj_type + "(edge)")
             con.commit()
             logging.info(f"Finished building relation index for {obj_type}")
+            # release the log of this leading type before the next one is loaded
+            del ocel
+        edges.close()
+
+def event_coverage(log_event_ids, events_covered):
+    """
+    @param log_event_ids: ids of all events of the log
+    @param events_covered: ids of the events covered by a view
+    @return: bool array over the events of the log in order of their ids, True for the covered events
+    """
+    event_ids = np.unique(np.asarray(log_event_ids))
+    covered = np.zeros(len(event_ids), dtype=bool)
+    covered[np.searchsorted(event_ids, np.fromiter(events_covered, dtype=event_ids.dtype, count=len(events_covered)))] = True
+    return covered
 
 def compute_relation_index(obj_type, ocel, con, edges, temp_path=None):
     global incr_edge_idx
     edge2obj = []
-    batch_size = 50000
+    batch_size = memory_governor.batch_size(50000, minimum=1000)
     i = 0
     temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.csv', dir=temp_path)
     temp_file.close()
+    num_rows = 0
     logging.info("Started process executions")
     process_executions = ocel.process_executions
     logging.info("Computed process executions")
     for j, proc_exec in enumerate(process_executions):
         proc_exec_graph = ocel.get_process_execution_graph(j)
         for edge in proc_exec_graph.edges:
-            if i == batch_size:
+            if i >= batch_size:
                 with open(temp_file.name, 'a', newline='') as csvfile:
                     writer = csv.writer(csvfile)
                     writer.writerows(edge2obj)
                 edge2obj = []
                 i = 0
-            if edge not in edges:
-                edges[edge] = incr_edge_idx
+                batch_size = memory_governor.batch_size(50000, minimum=1000)
+                edges.maybe_spill()
+            edge_id = edges.get(edge)
+            if edge_id is None:
+                edge_id = incr_edge_idx
+                edges[edge] = edge_id
                 incr_edge_idx += 1
-            edge2obj.append((edges[edge], j))
+            edge2obj.append((edge_id, j))
             i += 1
+            num_rows += 1
 
     if len(edge2obj) > 0:
         with open(temp_file.name, 'a', newline='') as csvfile:
@@ -132,12 +162,17 @@ def compute_relation_index(obj_type, ocel, con, edges, temp_path=None):
             writer.writerows(edge2obj)
 
     logging.info("Collected relation index")
-    con.sql(f"COPY {obj_type} FROM '{temp_file.name}' (DELIMITER ',')")
+    with metrics.timed("relation_index_ingest", context=obj_type):
+        con.sql(f"COPY {obj_type} FROM '{temp_file.name}' (DELIMITER ',')")
+    metrics.count("rows_written", num_rows, context=obj_type)
+    metrics.count("bytes_staged", os.path.getsize(temp_file.name), context=obj_type)
+    metrics.sample_duckdb_memory(con, context=obj_type)
     os.remove(temp_file.name)
 
     logging.info("Ingested relation index")
 
 def process_object_type(i, obj_type, filename, conn_name, file_type="json", object_types=None, act_name=None, time_name=None, sep=None):
+    from tqdm import tqdm
     #with sqlite3.connect(conn_name) as con:
     with duckdb.connect(conn_name, read_only=False) as con:
         print("I am here!")
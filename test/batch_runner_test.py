@@ -0,0 +1,94 @@
+import json
+
+import pytest
+import yaml
+
+from src.benchmarks.synthetic_logs import generate_synthetic_events, generate_synthetic_rel, write_synthetic_ekg
+from src.evaluation import batch_runner, ekg_contexts_eval, ocel_contexts_eval
+from src.evaluation.batch_runner import load_batch, run_batch, schedule
+from src.evaluation.dataset_registry import get_dataset, load_registry
+
+
+def write_batch(tmp_path, configs):
+    datasets = {}
+    for seed, name in enumerate(["small", "other"]):
+        events, objects = generate_synthetic_events(num_events=150, num_object_types=3, objects_per_type=8, seed=seed)
+        directory = write_synthetic_ekg(str(tmp_path / name), events, objects,
+                                        generate_synthetic_rel(events, objects, rel_density=0.2))
+        datasets[name] = {"kind": "ekg", "graph": directory}
+    (tmp_path / "datasets.yaml").write_text(yaml.safe_dump({"datasets": datasets}))
+    (tmp_path / "batch.yaml").write_text(yaml.safe_dump({"registry": str(tmp_path / "datasets.yaml"),
+                                                          "datasets": list(datasets), "configs": configs}))
+    (tmp_path / "data" / "temp").mkdir(parents=True)
+    (tmp_path / "results").mkdir()
+    return load_batch(str(tmp_path / "batch.yaml"))
+
+
+def test_registry_replaces_dataset_functions():
+    registry = load_registry()
+    assert get_dataset(registry, "bpi15-3")["file"] == "data/BPIC15_Municipality3.jsonocel"
+    assert get_dataset(registry, "bpi15-3")["object_types"] == get_dataset(registry, "bpi15-1")["object_types"]
+    assert get_dataset(registry, "order-ekg")["properties"]["entity_type_attr"] == "type"
+    with pytest.raises(ValueError):
+        get_dataset(registry, "bpi99")
+
+
+def test_schedule_distributes_cores():
+    assert schedule(2, num_cores=8) == (2, 4)
+    assert schedule(10, num_cores=8) == (8, 1)
+    assert schedule(4, num_cores=8, threads=4) == (2, 4)
+
+
+def test_batch_builds_indices_once_per_dataset(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    batch = write_batch(tmp_path, [{"weights": "0.2,0.8"}, {"selection_method": "enumeration", "k": 2},
+                                   {"weight": 0.5, "duckdb": {"nearest": True}}])
+    builds = []
+    build = ekg_contexts_eval.compute_indices_by_interacting_entities
+    monkeypatch.setattr(ekg_contexts_eval, "compute_indices_by_interacting_entities",
+                        lambda **kwargs: builds.append(kwargs["temp_db_path"]) or build(**kwargs))
+
+    outcomes = run_batch(batch, db_dir=str(tmp_path / "views"), num_cores=1)
+    assert [outcome["dataset"] for outcome in outcomes] == ["small"] * 3 + ["other"] * 3
+    assert all("error" not in outcome for outcome in outcomes)
+    assert sorted(builds) == sorted(str(tmp_path / "views" / f"ekg_views_{name}.duckdb") for name in ["small", "other"])
+    with open(tmp_path / "results" / f"{outcomes[0]['result_file_id']}_weight_sweep.json") as f:
+        assert json.load(f)["weights"] == [0.2, 0.8]
+
+
+def test_batch_rebuilds_indices_for_other_filter_windows(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    events = {f"e{hour}": {"ocel:activity": "a", "ocel:timestamp": f"2020-01-01T{hour:02d}:00:00",
+                           "ocel:omap": ["o1"], "ocel:vmap": {}} for hour in range(12)}
+    (tmp_path / "log.jsonocel").write_text(json.dumps({"ocel:global-log": {}, "ocel:events": events,
+                                                       "ocel:objects": {"o1": {"ocel:type": "t"}}}))
+    (tmp_path / "datasets.yaml").write_text(yaml.safe_dump({"datasets": {"log": {
+        "file": str(tmp_path / "log.jsonocel"), "object_types": ["t"],
+        "filter": {"start_time": "2020-01-01T00:00:00", "end_time": "2020-01-01T11:00:00"},
+        "filtered_file": str(tmp_path / "log_{end_date}.jsonocel")}}}))
+    filter_dates = ["2020-01-01T04:00:00", "2020-01-02T09:00:00", "2020-01-02T09:00:00", "2020-01-01T04:00:00"]
+    (tmp_path / "batch.yaml").write_text(yaml.safe_dump({"registry": str(tmp_path / "datasets.yaml"),
+                                                          "datasets": ["log"],
+                                                          "configs": [{"filter_date": date} for date in filter_dates]}))
+    runs = []
+    monkeypatch.setattr(ocel_contexts_eval, "compute_views",
+                        lambda filename, *args, reuse_indices=False, **kwargs: runs.append((filename, reuse_indices)))
+
+    outcomes = run_batch(load_batch(str(tmp_path / "batch.yaml")), db_dir=str(tmp_path / "views"), num_cores=1)
+    assert all("error" not in outcome for outcome in outcomes)
+    # the database holds the indices of the last window built, a config of another window builds its own
+    assert [reuse for _, reuse in runs] == [False, False, True, False]
+    assert [filename for filename, _ in runs] == [str(tmp_path / f"log_{date[:10]}.jsonocel") for date in filter_dates]
+
+
+def test_batch_runs_datasets_in_worker_processes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    batch = write_batch(tmp_path, [{"weights": "0.5"}])
+    outcomes = run_batch(batch, db_dir=str(tmp_path / "views"), num_cores=2)
+    assert sorted(outcome["dataset"] for outcome in outcomes) == ["other", "small"]
+    assert all("error" not in outcome for outcome in outcomes)
+
+    with pytest.raises(ValueError):
+        (tmp_path / "bad.yaml").write_text(yaml.safe_dump({"datasets": ["small"],
+                                                            "configs": [{"duckdb": {"threads": 2}}]}))
+        batch_runner.load_batch(str(tmp_path / "bad.yaml"))
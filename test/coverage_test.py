@@ -0,0 +1,40 @@
+import duckdb
+import numpy as np
+
+from src.util.coverage import add_coverage_to_results, coverage_stats, selection_coverage
+from src.util.view_tables import create_viewmeta_table, insert_view_meta
+
+
+def test_coverage_stats_match_set_computation():
+    rng = np.random.default_rng(0)
+    for num_events, chunk_size in [(13, 1), (1000, 7), (5000, 1 << 20)]:
+        views = [rng.random(num_events) < density for density in (0.1, 0.5, 0.02, 0.9)]
+        # views of shorter logs are padded with uncovered events
+        views[2] = views[2][:num_events // 2]
+        sets = [set(np.flatnonzero(view).tolist()) for view in views]
+
+        covered, cumulative, overlaps = coverage_stats([np.packbits(view).tobytes() for view in views],
+                                                       chunk_size=chunk_size)
+        assert covered.tolist() == [len(s) for s in sets]
+        assert cumulative.tolist() == [len(set().union(*sets[:k + 1])) for k in range(len(sets))]
+        assert overlaps.tolist() == [[len(s1 & s2) for s2 in sets] for s1 in sets]
+
+
+def test_selection_coverage_in_results(tmp_path):
+    with duckdb.connect(str(tmp_path / "views.duckdb")) as con:
+        create_viewmeta_table(con)
+        for name in ["a", "b"]:
+            con.sql(f"CREATE TABLE {name}(edge INTEGER, procExec INTEGER)")
+        insert_view_meta(con, 0, "a", 1, 3, covered=np.array([1, 1, 0, 0, 1], dtype=bool))
+        insert_view_meta(con, 1, "b", 1, 2, covered=np.array([0, 1, 1, 0, 0], dtype=bool))
+        assert con.sql("SELECT numEventsCovered FROM viewmeta ORDER BY viewIdx").fetchall() == [(3,), (2,)]
+
+        result_json = {"selected_views": [{"object_type": "b"}, {"object_type": "a"}]}
+        add_coverage_to_results(result_json, selection_coverage(con, [1, 0]))
+        assert selection_coverage(con, [2]) is None
+
+    assert result_json["num_events_total"] == 5
+    assert [v["cumulative_events_covered"] for v in result_json["selected_views"]] == [2, 4]
+    assert result_json["selected_views"][1]["event_coverage"] == 0.6
+    assert result_json["event_overlaps"] == {"object_types": ["b", "a"], "overlaps": [[2, 1], [1, 3]]}
+
@@ -0,0 +1,37 @@
+from src.util.cypher_queries import CypherQueryLibrary, QueryTextStats
+
+
+def test_query_shapes_are_fixed_texts_with_parameters():
+    queries = CypherQueryLibrary("uID", "EntityType", "timestamp", "activity")
+
+    shape, text = queries.query("events_for_objects")
+    assert "$objectIds" in text
+    assert queries.query("events_for_objects") == (shape, text)
+    # resumed index constructions rely on the order of the entities and their events
+    assert all("ORDER BY" in queries.query(shape)[1]
+               for shape in ["entity_types", "objects_of_type", "entities", "rel_edges", "entity_event_ids_of_type"])
+    assert "[df:DF]" in queries.query("partial_order_for_objects")[1]
+    # only the DF relationships of the objects themselves relate their events
+    assert "df.uID = ent.uID" in queries.query("partial_order_for_objects")[1]
+    assert "df.entityId = ent.uID" in CypherQueryLibrary("uID", "EntityType", "timestamp", "activity",
+                                                         df_entity_id_attr="entityId").query(
+        "partial_order_for_objects")[1]
+
+    shape1, text1 = queries.query("neighbors_at_path_length", path_length=1)
+    shape3, text3 = queries.query("neighbors_at_path_length", path_length=3)
+    assert shape1 != shape3
+    assert "[:REL*3..3]" in text3 and "$objId" in text3
+    assert queries.query("object_pairs_at_path_length", path_length=2, same_type=True)[1] != \
+           queries.query("object_pairs_at_path_length", path_length=2, same_type=False)[1]
+
+
+def test_query_text_reuse_rate():
+    stats = QueryTextStats()
+    for _ in range(4):
+        stats.record("events_for_objects", "text a")
+    stats.record("objects_of_type", "text b")
+    stats.record("objects_of_type", "text c")
+
+    assert stats.reuse_rates()["events_for_objects"]["reuse_rate"] == 0.75
+    assert stats.reuse_rates()["objects_of_type"]["reuse_rate"] == 0.0
+    assert stats.reuse_rate() == 0.5
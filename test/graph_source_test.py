@@ -0,0 +1,373 @@
+import asyncio
+import shutil
+from datetime import datetime
+
+import duckdb
+import numpy as np
+import pytest
+
+from src.benchmarks.synthetic_logs import generate_synthetic_events, generate_synthetic_rel, write_synthetic_ekg
+from src.util.coverage import selection_coverage
+from src.util.event_sequence_cache import EventSequenceCache, merged_sequence_edges
+from src.util.graph_source import EventOrdinalSource, GraphSource, LocalGraphSource
+from src.view_generation import ekg_interacting_entities, ekg_leading_type
+from src.view_generation.ekg_interacting_entities import compute_indices_by_interacting_entities
+from src.view_generation.ekg_leading_type import compute_indices_by_ekg_leading_types
+
+
+def write_small_ekg(directory):
+    # a1 - b1 - c1 and a2 - b2, c2 unrelated; e3 is correlated to a1 and b1
+    events = [(1, "x", "2020-01-01T00:00:01", ["a1"]),
+              (2, "y", "2020-01-01T00:00:02", ["b1"]),
+              (3, "z", "2020-01-01T00:00:03", ["a1", "b1"]),
+              (4, "x", "2020-01-01T00:00:04", ["c1"]),
+              (5, "y", "2020-01-01T00:00:05", ["a2", "b2"]),
+              (6, "z", "2020-01-01T00:00:06", ["c2"])]
+    objects = {"a1": "A", "a2": "A", "b1": "B", "b2": "B", "c1": "C", "c2": "C"}
+    rel = [("a1", "b1"), ("b1", "c1"), ("a2", "b2")]
+    return write_synthetic_ekg(directory, [(e, a, datetime.fromisoformat(t), objs) for e, a, t, objs in events],
+                               objects, rel)
+
+
+def test_local_graph_source_answers_context_queries(tmp_path):
+    source = LocalGraphSource(write_small_ekg(str(tmp_path)))
+
+    assert source.entity_types() == ["A", "B", "C"]
+    assert sorted(source.objects_of_type("A")) == ["a1", "a2"]
+    assert sorted(source.leading_type_context("a1", entity_types=["A", "B", "C"])) == ["a1", "b1", "c1"]
+    assert sorted(source.leading_type_context("c2", entity_types=["A", "B", "C"])) == ["c2"]
+    assert source.object_pairs("A", "C") == {("a1", "c1")}
+    assert source.object_pairs("A", "C", max_path_length=1) == set()
+    assert [event["id"] for event in source.events_for_objects(["a1", "b1"])] == [1, 2, 3]
+    assert [[event["id"] for event in events] for events in source.single_object_contexts("C")] == [[4], [6]]
+
+
+def test_ekg_indices_on_local_graph_source(tmp_path, monkeypatch):
+    events, objects = generate_synthetic_events(num_events=200, num_object_types=3, objects_per_type=10)
+    directory = write_synthetic_ekg(str(tmp_path / "ekg"), events, objects,
+                                    generate_synthetic_rel(events, objects, rel_density=0.2))
+    source = LocalGraphSource(directory)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "temp").mkdir(parents=True)
+
+    compute_indices_by_ekg_leading_types(source, str(tmp_path / "leading.duckdb"))
+    compute_indices_by_interacting_entities(source, str(tmp_path / "interact.duckdb"))
+
+    with duckdb.connect(str(tmp_path / "leading.duckdb")) as con:
+        stats = con.sql("SELECT objecttype, numProcExecs FROM viewmeta ORDER BY viewIdx").fetchall()
+    assert stats == [(entity_type, 10) for entity_type in source.entity_types()]
+    with duckdb.connect(str(tmp_path / "interact.duckdb")) as con:
+        view_names = [row[0] for row in con.sql("SELECT objecttype FROM viewmeta").fetchall()]
+        assert "type0___type1" in view_names
+        assert con.sql("SELECT COUNT(*) FROM type0___type1").fetchone()[0] > 0
+
+
+def test_ekg_generators_store_event_coverage(tmp_path, monkeypatch):
+    source = LocalGraphSource(write_small_ekg(str(tmp_path / "ekg")))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "temp").mkdir(parents=True)
+
+    compute_indices_by_ekg_leading_types(source, str(tmp_path / "leading.duckdb"))
+    compute_indices_by_interacting_entities(source, str(tmp_path / "interact.duckdb"))
+
+    for db_name in ["leading.duckdb", "interact.duckdb"]:
+        with duckdb.connect(str(tmp_path / db_name)) as con:
+            rows = con.sql("SELECT viewmeta.viewIdx, numEventsCovered, numEventsTotal FROM viewmeta, viewcoverage "
+                           "WHERE viewmeta.viewIdx = viewcoverage.viewIdx ORDER BY viewmeta.viewIdx").fetchall()
+            assert len(rows) == con.sql("SELECT COUNT(*) FROM viewmeta").fetchone()[0] > 0
+            coverage = selection_coverage(con, [row[0] for row in rows])
+        assert coverage["numEventsTotal"] == 6
+        assert coverage["covered"] == [row[1] for row in rows]
+
+
+class AsyncLocalGraphSource:
+    # async interface of AsyncNeo4jGraphSource, answered by a local graph source
+    def __init__(self, graph_source, max_in_flight):
+        self.graph_source = graph_source
+        self.max_in_flight = max_in_flight
+
+    async def entity_types(self):
+        return self.graph_source.entity_types()
+
+    async def objects_of_type(self, entity_type):
+        return self.graph_source.objects_of_type(entity_type)
+
+    async def leading_type_context(self, obj_id, max_path_length=1000, entity_types=None):
+        await asyncio.sleep(0)
+        return self.graph_source.leading_type_context(obj_id, max_path_length, entity_types)
+
+    async def events_for_objects(self, object_ids):
+        await asyncio.sleep(0)
+        return self.graph_source.events_for_objects(object_ids)
+
+    async def event_coverage(self, event_ids):
+        return self.graph_source.event_coverage(event_ids)
+
+    def report_stats(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class EventListGraphSource(GraphSource):
+    # answers only the queries of GraphSource, the generators fall back to event lists
+    def __init__(self, graph_source):
+        self.graph_source = graph_source
+
+    def entity_types(self):
+        return self.graph_source.entity_types()
+
+    def objects_of_type(self, entity_type):
+        return self.graph_source.objects_of_type(entity_type)
+
+    def leading_type_context(self, obj_id, max_path_length=1000, entity_types=None):
+        return self.graph_source.leading_type_context(obj_id, max_path_length, entity_types)
+
+    def object_pairs(self, ot1, ot2, max_path_length=10):
+        return self.graph_source.object_pairs(ot1, ot2, max_path_length)
+
+    def events_for_objects(self, object_ids):
+        return self.graph_source.events_for_objects(object_ids)
+
+    def single_object_contexts(self, entity_type):
+        return self.graph_source.single_object_contexts(entity_type)
+
+    def partial_order_for_objects(self, object_ids):
+        return self.graph_source.partial_order_for_objects(object_ids)
+
+
+def test_event_ordinal_queries_are_a_separate_interface(tmp_path):
+    source = LocalGraphSource(write_small_ekg(str(tmp_path)))
+    assert isinstance(source, EventOrdinalSource)
+    assert not isinstance(EventListGraphSource(source), EventOrdinalSource)
+    assert not hasattr(EventListGraphSource(source), "event_ordinals")
+
+
+def test_async_leading_type_index_matches_sequential(tmp_path, monkeypatch):
+    events, objects = generate_synthetic_events(num_events=200, num_object_types=3, objects_per_type=10)
+    directory = write_synthetic_ekg(str(tmp_path / "ekg"), events, objects, generate_synthetic_rel(events, objects))
+    source = LocalGraphSource(directory)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "temp").mkdir(parents=True)
+    monkeypatch.setattr(ekg_leading_type, "AsyncNeo4jGraphSource", AsyncLocalGraphSource)
+
+    compute_indices_by_ekg_leading_types(source, str(tmp_path / "sequential.duckdb"))
+    compute_indices_by_ekg_leading_types(AsyncLocalGraphSource(source, max_in_flight=4), str(tmp_path / "async.duckdb"))
+
+    def edge_occurrences(db_name):
+        # edge ids depend on the order edges are first seen, compare the process executions each edge occurs in
+        occurrences = {}
+        with duckdb.connect(db_name) as con:
+            for entity_type in source.entity_types():
+                for edge, proc_exec in con.sql(f"SELECT edge, procExec FROM {entity_type}").fetchall():
+                    occurrences.setdefault(edge, []).append((entity_type, proc_exec))
+        return sorted(sorted(occurrence) for occurrence in occurrences.values())
+
+    assert edge_occurrences(str(tmp_path / "sequential.duckdb")) == edge_occurrences(str(tmp_path / "async.duckdb"))
+
+    def coverage(db_name):
+        with duckdb.connect(db_name) as con:
+            return con.sql("SELECT viewmeta.objecttype, numEventsTotal, covered FROM viewmeta, viewcoverage "
+                           "WHERE viewmeta.viewIdx = viewcoverage.viewIdx ORDER BY viewmeta.viewIdx").fetchall()
+
+    assert len(coverage(str(tmp_path / "async.duckdb"))) == len(source.entity_types())
+    assert coverage(str(tmp_path / "sequential.duckdb")) == coverage(str(tmp_path / "async.duckdb"))
+
+
+def test_async_leading_type_index_raises_failed_queries(tmp_path, monkeypatch):
+    source = LocalGraphSource(write_small_ekg(str(tmp_path / "ekg")))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "temp").mkdir(parents=True)
+    monkeypatch.setattr(ekg_leading_type, "AsyncNeo4jGraphSource", AsyncLocalGraphSource)
+
+    class FailingGraphSource(AsyncLocalGraphSource):
+        async def leading_type_context(self, obj_id, max_path_length=1000, entity_types=None):
+            if obj_id == "a2":
+                raise ConnectionError("connection lost")
+            return await super().leading_type_context(obj_id, max_path_length, entity_types)
+
+    async def build():
+        await asyncio.wait_for(ekg_leading_type.compute_indices_by_ekg_leading_types_async(
+            FailingGraphSource(source, max_in_flight=2), str(tmp_path / "async.duckdb")), timeout=30)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(build())
+
+
+def test_event_sequence_cache_spills_and_merges(tmp_path):
+    events, objects = generate_synthetic_events(num_events=200, num_object_types=3, objects_per_type=10)
+    source = LocalGraphSource(write_synthetic_ekg(str(tmp_path / "ekg"), events, objects,
+                                                  generate_synthetic_rel(events, objects)))
+    # budget for a few sequences only, evicted ones are spilled and read back
+    cache = EventSequenceCache(source.event_ordinals, memory_budget=1000, spill_dir=str(tmp_path))
+    object_ids = sorted(objects.keys())
+    for o1, o2 in zip(object_ids, object_ids[1:] + object_ids[:1]):
+        merged = source.events_by_ordinals(cache.merged([o1, o2]))
+        assert merged == source.events_for_objects([o1, o2])
+    assert cache.stats["spills"] > 0 and cache.stats["spill_loads"] > 0
+    cache.close()
+
+
+def test_merged_sequence_edges_reuse_object_edges():
+    rng = np.random.default_rng(0)
+    sequences = [np.unique(rng.integers(40, size=rng.integers(0, 15))) for _ in range(20)]
+    edge_ids = {}
+    for sequence in sequences:
+        for edge in zip(sequence[:-1].tolist(), sequence[1:].tolist()):
+            edge_ids.setdefault(edge, len(edge_ids))
+    object_edge_ids = [np.array([edge_ids[edge] for edge in zip(sequence[:-1].tolist(), sequence[1:].tolist())],
+                                dtype=np.int64) for sequence in sequences]
+
+    pairs = [(i, (i * 7 + 3) % len(sequences)) for i in range(len(sequences))]
+    ordinals, ordinal_pair, edge_positions, merged_edge_ids = merged_sequence_edges(
+        [sequences[i] for i, _ in pairs], [object_edge_ids[i] for i, _ in pairs],
+        [sequences[j] for _, j in pairs], [object_edge_ids[j] for _, j in pairs])
+
+    expected_ordinals, expected_edge_ids = [], []
+    for i, j in pairs:
+        merged = sorted(set(sequences[i].tolist()) | set(sequences[j].tolist()))
+        expected_ordinals.extend(merged)
+        own_edges = {edge for k in (i, j) for edge in zip(sequences[k][:-1].tolist(), sequences[k][1:].tolist())}
+        expected_edge_ids.extend(edge_ids[edge] if edge in own_edges else -1 for edge in zip(merged[:-1], merged[1:]))
+    assert ordinals.tolist() == expected_ordinals
+    assert merged_edge_ids.tolist() == expected_edge_ids
+    assert all(ordinal_pair[position] == ordinal_pair[position + 1] for position in edge_positions)
+
+
+def test_interacting_entities_index_from_ordinals_matches_event_lists(tmp_path, monkeypatch):
+    events, objects = generate_synthetic_events(num_events=300, num_object_types=3, objects_per_type=12)
+    source = LocalGraphSource(write_synthetic_ekg(str(tmp_path / "ekg"), events, objects,
+                                                  generate_synthetic_rel(events, objects, rel_density=0.2)))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "temp").mkdir(parents=True)
+
+    compute_indices_by_interacting_entities(source, str(tmp_path / "ordinals.duckdb"))
+    compute_indices_by_interacting_entities(EventListGraphSource(source), str(tmp_path / "event_lists.duckdb"))
+
+    def contexts(db_name):
+        # edge ids differ between runs, compare each context by the process executions every edge occurs in
+        with duckdb.connect(db_name) as con:
+            view_stats = con.sql("SELECT objecttype, numProcExecs, numEvents, numEdges, numEventsCovered, "
+                                 "AvgNumUniqueActivitiesPerTrace "
+                                 "FROM viewmeta ORDER BY objecttype").fetchall()
+            occurrences = {}
+            for view in view_stats:
+                for edge, proc_exec in con.sql(f"SELECT edge, procExec FROM {view[0]}").fetchall():
+                    occurrences.setdefault(edge, []).append((view[0], proc_exec))
+        return view_stats, sorted(sorted(occurrence) for occurrence in occurrences.values())
+
+    assert contexts(str(tmp_path / "ordinals.duckdb")) == contexts(str(tmp_path / "event_lists.duckdb"))
+
+
+def test_interacting_entities_index_resumes_from_checkpoint(tmp_path, monkeypatch):
+    events, objects = generate_synthetic_events(num_events=300, num_object_types=3, objects_per_type=12)
+    source = LocalGraphSource(write_synthetic_ekg(str(tmp_path / "ekg"), events, objects,
+                                                  generate_synthetic_rel(events, objects, rel_density=0.2)))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "temp").mkdir(parents=True)
+
+    def build(db_name, **kwargs):
+        monkeypatch.setattr(ekg_interacting_entities, "incr_edge_idx", 0)
+        monkeypatch.setattr(ekg_interacting_entities, "incr_context_idx", 0)
+        compute_indices_by_interacting_entities(source, db_name, checkpoint_rows=50, **kwargs)
+
+    build(str(tmp_path / "complete.duckdb"))
+
+    # interrupt the run in the middle of the last single-object context
+    assign_edge_ids = ekg_interacting_entities.assign_edge_ids
+    calls = []
+
+    def failing_assign_edge_ids(sources, targets, edges):
+        calls.append(len(sources))
+        if len(calls) == 32:
+            raise RuntimeError("interrupted")
+        return assign_edge_ids(sources, targets, edges)
+
+    monkeypatch.setattr(ekg_interacting_entities, "assign_edge_ids", failing_assign_edge_ids)
+    with pytest.raises(RuntimeError):
+        build(str(tmp_path / "resumed.duckdb"))
+    with duckdb.connect(str(tmp_path / "resumed.duckdb")) as con:
+        progress = con.sql("SELECT complete, procExecsDone FROM checkpoint_contexts").fetchall()
+    assert any(complete for complete, _ in progress) and any(not complete and done > 0 for complete, done in progress)
+    monkeypatch.setattr(ekg_interacting_entities, "assign_edge_ids", assign_edge_ids)
+
+    # a source streaming the entities in another order than the interrupted run cannot resume it
+    shutil.copy(tmp_path / "resumed.duckdb", tmp_path / "reordered.duckdb")
+    entity_event_ordinals = source.entity_event_ordinals
+    monkeypatch.setattr(source, "entity_event_ordinals",
+                        lambda entity_type: reversed(list(entity_event_ordinals(entity_type))))
+    with pytest.raises(ValueError, match="graph source changed"):
+        build(str(tmp_path / "reordered.duckdb"), resume=True)
+    monkeypatch.setattr(source, "entity_event_ordinals", entity_event_ordinals)
+
+    build(str(tmp_path / "resumed.duckdb"), resume=True)
+
+    def tables(db_name):
+        with duckdb.connect(db_name) as con:
+            view_stats = con.sql("SELECT * FROM viewmeta ORDER BY viewIdx").fetchall()
+            return view_stats, [sorted(con.sql(f"SELECT edge, procExec FROM {view[1]}").fetchall())
+                                for view in view_stats]
+
+    assert tables(str(tmp_path / "resumed.duckdb")) == tables(str(tmp_path / "complete.duckdb"))
+
+
+def test_partial_order_uses_directly_follows_of_single_objects(tmp_path, monkeypatch):
+    source = LocalGraphSource(write_small_ekg(str(tmp_path / "ekg")))
+    events, relations = source.partial_order_for_objects(["a1", "b1"])
+    # total order 1 -> 2 -> 3, but 1 and 2 belong to different objects
+    assert [event["id"] for event in events] == [1, 2, 3]
+    assert relations == [(1, 3), (2, 3)]
+    assert source.partial_order_for_objects(["unknown"]) == ([], [])
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "temp").mkdir(parents=True)
+    compute_indices_by_ekg_leading_types(source, str(tmp_path / "total.duckdb"))
+    compute_indices_by_ekg_leading_types(source, str(tmp_path / "partial.duckdb"), relation="partial")
+    num_edges = {}
+    for relation in ["total", "partial"]:
+        with duckdb.connect(str(tmp_path / f"{relation}.duckdb")) as con:
+            num_edges[relation] = con.sql("SELECT SUM(numEdges) FROM viewmeta").fetchone()[0]
+    assert num_edges["partial"] < num_edges["total"]
+    with pytest.raises(ValueError):
+        compute_indices_by_ekg_leading_types(source, str(tmp_path / "other.duckdb"), relation="other")
+
+
+def test_partial_order_index_from_ordinals_matches_event_lists(tmp_path, monkeypatch):
+    events, objects = generate_synthetic_events(num_events=300, num_object_types=3, objects_per_type=12)
+    source = LocalGraphSource(write_synthetic_ekg(str(tmp_path / "ekg"), events, objects,
+                                                  generate_synthetic_rel(events, objects, rel_density=0.2)))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "temp").mkdir(parents=True)
+
+    compute_indices_by_interacting_entities(source, str(tmp_path / "total.duckdb"))
+    compute_indices_by_interacting_entities(source, str(tmp_path / "ordinals.duckdb"), relation="partial")
+    compute_indices_by_interacting_entities(EventListGraphSource(source), str(tmp_path / "event_lists.duckdb"),
+                                            relation="partial")
+
+    def contexts(db_name):
+        with duckdb.connect(db_name) as con:
+            view_stats = con.sql("SELECT objecttype, numProcExecs, numEvents, numEdges, numEventsCovered "
+                                 "FROM viewmeta ORDER BY objecttype").fetchall()
+            occurrences = {}
+            for view in view_stats:
+                for edge, proc_exec in con.sql(f"SELECT edge, procExec FROM {view[0]}").fetchall():
+                    occurrences.setdefault(edge, []).append((view[0], proc_exec))
+        return view_stats, sorted(sorted(occurrence) for occurrence in occurrences.values())
+
+    partial_stats, partial_occurrences = contexts(str(tmp_path / "ordinals.duckdb"))
+    assert (partial_stats, partial_occurrences) == contexts(str(tmp_path / "event_lists.duckdb"))
+    total_stats, _ = contexts(str(tmp_path / "total.duckdb"))
+    # same process executions and events, the pair contexts lose the edges between events of different objects
+    assert [stats[:3] for stats in partial_stats] == [stats[:3] for stats in total_stats]
+    assert all(partial[3] <= total[3] for partial, total in zip(partial_stats, total_stats))
+    assert sum(stats[3] for stats in partial_stats) < sum(stats[3] for stats in total_stats)
+
+
+def test_graph_source_declares_context_queries_abstract():
+    class IncompleteGraphSource(GraphSource):
+        def entity_types(self):
+            return []
+
+    with pytest.raises(TypeError):
+        IncompleteGraphSource()
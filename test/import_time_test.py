@@ -0,0 +1,7 @@
+from src.benchmarks.import_time import check, entry_points, measure_import
+
+
+def test_entry_points_do_not_import_heavy_modules():
+    results = {"entry_points": {module: measure_import(module) for module in entry_points}}
+    assert check(results) == []
+    assert all(result["import_ms"] is not None for result in results["entry_points"].values())
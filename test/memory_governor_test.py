@@ -0,0 +1,50 @@
+import duckdb
+import numpy as np
+
+from src.strategies.db_selection import max_sims_per_context
+from src.util import memory_governor
+from src.util.memory_governor import MemoryGovernor, SpillableEdgeDict, parse_memory_size
+
+
+def test_batch_sizes_shrink_with_memory_usage(monkeypatch):
+    assert parse_memory_size("4GB") == 4 * 1000 ** 3
+    assert parse_memory_size("512MiB") == 512 * 1024 ** 2
+    governor = MemoryGovernor("1000B", check_interval=0)
+    for rss, expected in [(500, 1024), (725, 520), (900, 16), (500, 1024)]:
+        monkeypatch.setattr(memory_governor, "current_rss_bytes", lambda: rss)
+        assert governor.batch_size(1024) == expected
+        assert governor.should_spill() == (rss >= 850)
+    assert MemoryGovernor().batch_size(1024) == 1024
+
+
+def test_spilled_edges_are_found(tmp_path, monkeypatch):
+    edges = SpillableEdgeDict(spill_dir=str(tmp_path))
+    for i in range(10):
+        edges[(i, i + 1)] = i
+    monkeypatch.setattr(memory_governor, "should_spill", lambda: True)
+    edges.maybe_spill()
+    edges[(10, 11)] = 10
+
+    assert len(edges) == 11 and len(edges.memory) == 1
+    assert [edges[(i, i + 1)] for i in range(11)] == list(range(11))
+    assert (11, 12) not in edges and edges.get((11, 12)) is None
+    assert edges.recent_items(1) == [((10, 11), 10)]
+    assert sorted((int(source), int(target), edge_id) for (source, target), edge_id in edges.items()) == \
+           [(i, i + 1, i) for i in range(11)]
+    edges.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_chunked_max_sims_match_full_result():
+    rng = np.random.default_rng(0)
+    with duckdb.connect() as con:
+        con.execute("CREATE TABLE pairs(o1contexts INTEGER, o2contexts INTEGER, sim DOUBLE)")
+        con.executemany("INSERT INTO pairs VALUES (?, ?, ?)",
+                        [(int(a), int(b), float(s)) for a, b, s in zip(rng.integers(50, size=5000),
+                                                                       rng.integers(80, size=5000), rng.random(5000))])
+        df = con.sql("SELECT * FROM pairs").fetchdf()
+        max_sims1, max_sims2, num_rows = max_sims_per_context(con.execute("SELECT * FROM pairs"), chunk_rows=2048)
+
+    assert num_rows == 5000
+    assert max_sims1.equals(df.groupby('o1contexts')['sim'].max().reset_index())
+    assert max_sims2.equals(df.groupby('o2contexts')['sim'].max().reset_index())
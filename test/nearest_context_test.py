@@ -0,0 +1,50 @@
+import duckdb
+import numpy as np
+
+import src.strategies.db_selection as db_selection
+from src.strategies.db_mmr_selection import DBRankingSubsetSelector
+from src.util.nearest_context import EdgeSetIndex, nearest_max_similarities
+
+
+def random_edge_sets(num_sets, num_edges, max_size, rng):
+    return [set(rng.choice(num_edges, size=rng.integers(1, max_size), replace=False).tolist())
+            for _ in range(num_sets)]
+
+
+def test_nearest_matches_exhaustive_search():
+    rng = np.random.default_rng(0)
+    for num_edges, max_size in [(20, 6), (200, 30)]:
+        edge_sets = random_edge_sets(80, num_edges, max_size, rng)
+        other_edge_sets = random_edge_sets(120, num_edges, max_size, rng)
+        sims = np.array([[len(a & b) / len(a | b) for b in other_edge_sets] for a in edge_sets])
+
+        max_sims, other_max_sims = nearest_max_similarities(edge_sets, other_edge_sets)
+        assert np.allclose(max_sims, sims.max(axis=1))
+        assert np.allclose(other_max_sims, sims.max(axis=0))
+
+    index = EdgeSetIndex([{1, 2, 3}, {3, 4}])
+    assert index.nearest({3, 4, 5}) == (1, 2 / 3)
+    assert index.nearest({7}) == (-1, 0.0)
+
+
+def test_nearest_scores_match_join_scores(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_selection, "results_path", str(tmp_path) + "/")
+    db_name = str(tmp_path / "views.duckdb")
+    rng = np.random.default_rng(1)
+    object_types = ["a", "b", "c", "d"]
+    with duckdb.connect(db_name) as con:
+        con.sql("CREATE TABLE viewmeta(viewIdx INTEGER, objecttype STRING, numProcExecs INTEGER, numEvents INTEGER, "
+                "AvgNumEventsPerTrace FLOAT)")
+        for view_idx, name in enumerate(object_types):
+            edge_sets = random_edge_sets(60, 40, 10, rng)
+            con.sql(f"CREATE TABLE {name}(edge INTEGER, procExec INTEGER)")
+            con.executemany(f"INSERT INTO {name} VALUES (?, ?)",
+                            [(edge, proc_exec) for proc_exec, edge_set in enumerate(edge_sets) for edge in edge_set])
+            con.execute("INSERT INTO viewmeta VALUES (?, ?, ?, ?, ?)", (view_idx, name, 60, 0, 0))
+
+    join = DBRankingSubsetSelector(db_name, object_types=object_types, file_id="join",
+                                   duckdb_config={"variants": False})
+    for config in [{"nearest": True}, {"nearest": True, "variants": False}]:
+        nearest = DBRankingSubsetSelector(db_name, object_types=object_types, file_id="nearest",
+                                          duckdb_config=config)
+        assert np.allclose(join.pairwise_score, nearest.pairwise_score)
@@ -0,0 +1,54 @@
+import duckdb
+import numpy as np
+
+from src.util.posting_index import PostingIndex, delta_decode, delta_encode, load_or_build, posting_index_dir, \
+    views_containing, write_posting_indices
+from src.util.similarity_measures import compute_matching_sim
+
+
+def test_delta_encoding_round_trip():
+    values = np.array([3, 7, 8, 1000, 2, 2000000, 5, 6], dtype=np.int64)
+    offsets = np.array([0, 4, 4, 6, 8], dtype=np.int64)
+    deltas = delta_encode(values, offsets)
+    assert deltas.dtype == np.uint32
+    assert np.array_equal(delta_decode(deltas, offsets), values)
+    assert delta_encode(np.array([1, 2, 250]), np.array([0, 3])).dtype == np.uint8
+
+
+def test_posting_index_is_persisted_and_loaded(tmp_path):
+    db_name = str(tmp_path / "views.duckdb")
+    rng = np.random.default_rng(0)
+    with duckdb.connect(db_name) as con:
+        con.sql("CREATE TABLE viewmeta(viewIdx INTEGER, objecttype STRING, numProcExecs INTEGER)")
+        for view_idx, name in enumerate(["a", "b"]):
+            con.sql(f"CREATE TABLE {name}(edge INTEGER, procExec STRING)")
+            rows = {(int(edge), str(proc_exec)) for edge, proc_exec in zip(rng.integers(50, size=300),
+                                                                       rng.integers(40, size=300))}
+            con.executemany(f"INSERT INTO {name} VALUES (?, ?)", sorted(rows))
+            con.execute("INSERT INTO viewmeta VALUES (?, ?, ?)", (view_idx, name, 40))
+        con.sql("INSERT INTO b VALUES (1000, '0')")
+        indices = write_posting_indices(con, db_name)
+        expected = con.sql("SELECT edge, list(CAST(procExec AS BIGINT) ORDER BY CAST(procExec AS BIGINT)) "
+                           "FROM a GROUP BY edge").fetchall()
+        edge_sets = dict(con.sql("SELECT CAST(procExec AS BIGINT), list(edge) FROM a GROUP BY procExec").fetchall())
+
+    index = PostingIndex.load(posting_index_dir(db_name), "a")
+    assert isinstance(index.deltas, np.memmap) and index.meta["numProcExecs"] == 40
+    for edge, proc_execs in expected:
+        assert index.postings(edge).tolist() == proc_execs
+    assert index.postings(1000).tolist() == []
+    relation_index, num_proc_execs = index.relation_index()
+    assert {edge: proc_execs for edge, proc_execs in expected} == relation_index
+    keys, sets = index.edge_sets()
+    assert {key: edge_set for key, edge_set in zip(keys.tolist(), sets)} == \
+           {key: frozenset(edges) for key, edges in edge_sets.items()}
+    assert views_containing(db_name, 1000) == ["b"]
+    sim, _, _ = compute_matching_sim(index.view_dict(0), indices["b"].view_dict(1))
+    assert 0 < sim < 1
+    assert views_containing(db_name, expected[0][0]) in (["a"], ["a", "b"])
+
+    # a changed table invalidates its stored index
+    with duckdb.connect(db_name) as con:
+        con.sql("INSERT INTO a VALUES (1000, '3')")
+        assert load_or_build(con, db_name, "a").postings(1000).tolist() == [3]
+    assert views_containing(db_name, 1000) == ["a", "b"]
@@ -0,0 +1,69 @@
+import numpy as np
+
+from src.util.rel_graph import RelDistanceIndex, RelGraph
+
+
+def random_rel_graph(num_entities=60, num_rel=80, num_types=4, seed=0):
+    rng = np.random.default_rng(seed)
+    return RelGraph(num_entities, rng.integers(num_entities, size=num_rel), rng.integers(num_entities, size=num_rel),
+                    rng.integers(num_types, size=num_entities), num_types)
+
+
+def nearest_by_bfs(rel_graph, entity, type_idx):
+    for _, level in rel_graph.bfs_levels(entity, rel_graph.num_entities):
+        nearest = level[rel_graph.entity_type_idx[level] == type_idx]
+        if len(nearest) > 0:
+            return sorted(nearest.tolist())
+    return []
+
+
+def test_distance_index_matches_bfs():
+    for seed in range(3):
+        rel_graph = random_rel_graph(seed=seed)
+        distance_index = rel_graph.get_distance_index()
+        for entity in range(rel_graph.num_entities):
+            for type_idx in range(rel_graph.num_types):
+                assert sorted(distance_index.nearest_of_type(entity, type_idx).tolist()) == \
+                       nearest_by_bfs(rel_graph, entity, type_idx)
+
+
+def test_distance_index_is_reused_while_rel_graph_is_unchanged(tmp_path, monkeypatch):
+    file_name = str(tmp_path / "distance_index.npz")
+    rel_graph = random_rel_graph(seed=0)
+    rel_graph.distance_index_file = file_name
+    built = rel_graph.get_distance_index()
+
+    build = RelDistanceIndex.build
+    builds = []
+    monkeypatch.setattr(RelDistanceIndex, "build", lambda graph: builds.append(graph) or build(graph))
+    reloaded_graph = random_rel_graph(seed=0)
+    reloaded_graph.distance_index_file = file_name
+    reloaded = reloaded_graph.get_distance_index()
+    assert builds == []
+    for array in ["nearest_source", "nearest_distance", "second_distance"]:
+        assert np.array_equal(getattr(reloaded, array), getattr(built, array))
+
+    # another REL graph rebuilds and replaces the stored index
+    changed_graph = random_rel_graph(seed=1)
+    changed_graph.distance_index_file = file_name
+    changed_graph.get_distance_index()
+    assert builds == [changed_graph]
+    assert RelDistanceIndex.load(changed_graph, file_name) is not None
+
+
+def test_pair_stream_matches_bfs():
+    rel_graph = random_rel_graph(num_entities=150, num_rel=160, seed=1)
+    sort_keys = np.random.default_rng(1).permutation(rel_graph.num_entities)
+    for type1_idx, type2_idx in [(0, 1), (2, 2)]:
+        expected = []
+        for source in np.flatnonzero(rel_graph.entity_type_idx == type1_idx):
+            for _, level in rel_graph.bfs_levels(source, 3):
+                for target in level[rel_graph.entity_type_idx[level] == type2_idx]:
+                    if type1_idx != type2_idx or sort_keys[source] > sort_keys[target]:
+                        expected.append((sort_keys[source], sort_keys[target]))
+
+        streamed = [(sort_keys[source], sort_keys[target])
+                    for source, targets in rel_graph.stream_object_pairs(type1_idx, type2_idx, 3, sort_keys,
+                                                                         batch_size=16)
+                    for target in targets]
+        assert streamed == sorted(expected)
@@ -0,0 +1,25 @@
+import argparse
+import json
+
+import src.benchmarks.run_benchmarks as run_benchmarks
+
+
+def test_tracked_baseline_covers_small_scale():
+    with open(run_benchmarks.baseline_file) as f:
+        baseline = json.load(f)
+    assert all("small" in baseline["benchmarks"][benchmark_name] for benchmark_name in run_benchmarks.benchmarks)
+
+
+def test_missing_baseline_fails_unless_updated(tmp_path, monkeypatch):
+    results = {"benchmarks": {"pairwise_scores": {"small": {"latency_s": 1.0}}}}
+    monkeypatch.setattr(run_benchmarks, "benchmark_path", str(tmp_path) + "/")
+    monkeypatch.setattr(run_benchmarks, "run_benchmarks", lambda scale_names, benchmark_names, repeat: results)
+    baseline = str(tmp_path / "baseline.json")
+
+    def args(update_baseline):
+        return argparse.Namespace(scales="small", benchmarks="pairwise_scores", repeat=1, baseline=baseline,
+                                  tolerance=0.25, update_baseline=update_baseline)
+
+    assert run_benchmarks.main(args(False)) == 1
+    assert run_benchmarks.main(args(True)) == 0
+    assert run_benchmarks.main(args(False)) == 0
@@ -0,0 +1,53 @@
+import duckdb
+import numpy as np
+
+import src.strategies.db_selection as db_selection
+from src.strategies.db_mmr_selection import DBRankingSubsetSelector
+from src.util.score_store import ScoreStore
+
+
+def create_view_db(db_name, views):
+    with duckdb.connect(db_name) as con:
+        con.sql("CREATE TABLE viewmeta(viewIdx INTEGER, objecttype STRING, numProcExecs INTEGER, numEvents INTEGER, "
+                "AvgNumEventsPerTrace FLOAT)")
+        for view_idx, (name, rows) in enumerate(views.items()):
+            con.sql(f"CREATE TABLE {name}(edge INTEGER, procExec INTEGER)")
+            con.executemany(f"INSERT INTO {name} VALUES (?, ?)", rows)
+            num_proc_execs = len(set(proc_exec for _, proc_exec in rows))
+            con.execute("INSERT INTO viewmeta VALUES (?, ?, ?, ?, ?)", (view_idx, name, num_proc_execs, 0, 0))
+
+
+def test_scores_are_reused_from_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_selection, "results_path", str(tmp_path) + "/")
+    db_name = str(tmp_path / "views.duckdb")
+    views = {
+        "a": [(1, 0), (2, 0), (3, 1)],
+        "b": [(1, 0), (2, 1), (4, 1)],
+        "c": [(5, 0), (3, 0)]
+    }
+    create_view_db(db_name, views)
+    object_types = list(views.keys())
+
+    store = ScoreStore(db_name, store_path=str(tmp_path / "store"))
+    selector = DBRankingSubsetSelector(db_name, object_types=object_types, file_id="first", score_store=store)
+
+    reloaded = ScoreStore(db_name, store_path=str(tmp_path / "store"))
+    assert len(reloaded.pairs) == 3
+    assert np.allclose(reloaded.pairwise_matrix(object_types), selector.pairwise_score)
+
+    # scores of unchanged tables are taken from the store, the changed table invalidates its pairs
+    with duckdb.connect(db_name) as con:
+        con.sql("INSERT INTO c VALUES (1, 1)")
+    with duckdb.connect(db_name) as con:
+        con.sql("UPDATE viewmeta SET numProcExecs = 2 WHERE objecttype = 'c'")
+    reused = DBRankingSubsetSelector(db_name, object_types=object_types, file_id="second", score_store=reloaded)
+    fresh = DBRankingSubsetSelector(db_name, object_types=object_types, file_id="third")
+    assert np.allclose(reused.pairwise_score, fresh.pairwise_score)
+    assert not np.isclose(reused.pairwise_score[0][2], selector.pairwise_score[0][2])
+
+    # a process execution without edges changes the scores of the view, but not its table
+    with duckdb.connect(db_name) as con:
+        con.sql("UPDATE viewmeta SET numProcExecs = 3 WHERE objecttype = 'a'")
+    reused = DBRankingSubsetSelector(db_name, object_types=object_types, file_id="fourth", score_store=reloaded)
+    fresh = DBRankingSubsetSelector(db_name, object_types=object_types, file_id="fifth")
+    assert np.allclose(reused.pairwise_score, fresh.pairwise_score)
@@ -0,0 +1,91 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from src.evaluation.weight_sweep import parse_weights
+from src.strategies.db_enumeration_selection import optimal_subset, subset_objective
+from src.strategies.db_mmr_selection import DBRankingSubsetSelector, select_views_for_weights
+
+
+def random_scores(n, seed=0):
+    rng = np.random.default_rng(seed)
+    pairwise_score = rng.random((n, n))
+    pairwise_score = (pairwise_score + pairwise_score.T) / 2
+    np.fill_diagonal(pairwise_score, 1)
+    overall_scores = pairwise_score.sum(axis=1) / n
+    return overall_scores, pairwise_score
+
+
+def selector_without_db(overall_scores, pairwise_score, weight=0.5):
+    # skip score computation on the database, scores are set directly
+    selector = DBRankingSubsetSelector.__new__(DBRankingSubsetSelector)
+    selector.object_types = [f"ot{i}" for i in range(len(overall_scores))]
+    selector.overall_scores = list(overall_scores)
+    selector.pairwise_score = pairwise_score
+    selector.weight = weight
+    return selector
+
+
+def test_weight_sweep_matches_greedy_selection():
+    overall_scores, pairwise_score = random_scores(12)
+    weights = [0.0, 0.2, 0.5, 0.8, 1.0]
+    sweep = select_views_for_weights(overall_scores, pairwise_score, weights, 12)
+
+    for w_idx, weight in enumerate(weights):
+        selector = selector_without_db(overall_scores, pairwise_score, weight)
+        selected = [view_idx for view_idx, _, _, _ in selector.select_view_indices(12)]
+        assert selected == list(sweep["selected"][w_idx])
+
+
+def test_weight_sweep_score_info():
+    overall_scores, pairwise_score = random_scores(6, seed=1)
+    selector = selector_without_db(overall_scores, pairwise_score)
+    greedy = selector.select_view_indices(6)
+    swept = selector.select_view_indices_for_weights([0.5])[0.5]
+
+    for (view_idx, score, info, _), (swept_idx, swept_score, swept_info, _) in zip(greedy, swept):
+        assert view_idx == swept_idx
+        assert np.isclose(score, swept_score)
+        for key, value in info.items():
+            if value is None:
+                assert swept_info[key] is None
+            else:
+                assert np.isclose(value, swept_info[key])
+
+
+def test_optimal_subset_matches_exhaustive_enumeration():
+    overall_scores, pairwise_score = random_scores(9, seed=2)
+    for weight in [0.2, 0.5, 0.8]:
+        for k in range(1, 10):
+            subset, score, _, greedy_score, _ = optimal_subset(overall_scores, pairwise_score, k, weight,
+                                                               num_workers=1)
+            best = max(subset_objective(overall_scores, pairwise_score, c, weight)
+                       for c in itertools.combinations(range(9), k))
+            assert np.isclose(score, best)
+            assert np.isclose(subset_objective(overall_scores, pairwise_score, subset, weight), score)
+            assert score >= greedy_score - 1e-9
+
+
+def test_parallel_optimal_subset_scores_returned_subset():
+    # 16 views and more are searched by worker processes sharing the best score
+    overall_scores, pairwise_score = random_scores(16, seed=2)
+    for k in [3, 5]:
+        subset, score, _, greedy_score, _ = optimal_subset(overall_scores, pairwise_score, k, 0.5, num_workers=4)
+        best = max(subset_objective(overall_scores, pairwise_score, c, 0.5)
+                   for c in itertools.combinations(range(16), k))
+        assert np.isclose(score, best)
+        assert np.isclose(subset_objective(overall_scores, pairwise_score, subset, 0.5), score)
+
+    overall_scores, pairwise_score = random_scores(35, seed=2)
+    subset, score, _, greedy_score, _ = optimal_subset(overall_scores, pairwise_score, 10, 0.5, num_workers=4)
+    assert np.isclose(subset_objective(overall_scores, pairwise_score, subset, 0.5), score)
+    assert score >= greedy_score - 1e-9
+
+
+def test_parse_weights_rejects_empty_ranges():
+    assert parse_weights("0:1:0.25") == [0, 0.25, 0.5, 0.75, 1]
+    assert parse_weights("0.1,0.9") == [0.1, 0.9]
+    for weights_arg in ["0:1:0", "0:1:-0.1", "1:0:0.1", ",", "0:1"]:
+        with pytest.raises(ValueError):
+            parse_weights(weights_arg)
@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+
+import duckdb
+import numpy as np
+import pytest
+
+import src.strategies.db_selection as db_selection
+from src.strategies.db_mmr_selection import DBRankingSubsetSelector
+from src.strategies.sharded_scoring import ShardedPairScorer, claim_task, run_worker
+
+
+def create_view_db(db_name, num_views, seed=0):
+    rng = np.random.default_rng(seed)
+    with duckdb.connect(db_name) as con:
+        con.sql("CREATE TABLE viewmeta(viewIdx INTEGER, objecttype STRING, numProcExecs INTEGER, numEvents INTEGER, "
+                "AvgNumEventsPerTrace FLOAT)")
+        for view_idx in range(num_views):
+            name = f"view{view_idx}"
+            rows = {(int(edge), int(proc_exec)) for edge, proc_exec in zip(rng.integers(40, size=200),
+                                                                        rng.integers(30, size=200))}
+            con.sql(f"CREATE TABLE {name}(edge INTEGER, procExec INTEGER)")
+            con.executemany(f"INSERT INTO {name} VALUES (?, ?)", sorted(rows))
+            con.execute("INSERT INTO viewmeta VALUES (?, ?, ?, ?, ?)",
+                        (view_idx, name, len({proc_exec for _, proc_exec in rows}), 0, 0))
+    return [f"view{view_idx}" for view_idx in range(num_views)]
+
+
+def test_sharded_scores_match_single_node_scores(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_selection, "results_path", str(tmp_path) + "/")
+    db_name = str(tmp_path / "views.duckdb")
+    object_types = create_view_db(db_name, 4)
+
+    single = DBRankingSubsetSelector(db_name, object_types=object_types, file_id="single")
+    sharded = DBRankingSubsetSelector(db_name, object_types=object_types, file_id="sharded",
+                                      duckdb_config={"shards": 3, "shard_workers": 2})
+    assert np.allclose(single.pairwise_score, sharded.pairwise_score)
+
+
+def test_sharded_scores_with_queue_workers(tmp_path, monkeypatch):
+    # no local workers, the queue is served like by a remote host sharing the queue directory
+    monkeypatch.setattr(db_selection, "results_path", str(tmp_path) + "/")
+    db_name = str(tmp_path / "views.duckdb")
+    object_types = create_view_db(db_name, 3, seed=1)
+    queue_dir = str(tmp_path / "queue")
+    worker = threading.Thread(target=run_worker, args=(queue_dir,), daemon=True)
+
+    single = DBRankingSubsetSelector(db_name, object_types=object_types, file_id="single")
+    (tmp_path / "queue").mkdir()
+    worker.start()
+    sharded = DBRankingSubsetSelector(db_name, object_types=object_types, file_id="sharded",
+                                      duckdb_config={"shards": 4, "shard_workers": 0, "shard_queue": queue_dir})
+    (tmp_path / "queue" / "stop").touch()
+    worker.join()
+    assert np.allclose(single.pairwise_score, sharded.pairwise_score)
+    assert list((tmp_path / "queue" / "partials").iterdir()) == []
+
+
+def sharded_scorer(tmp_path, **scorer_args):
+    con = duckdb.connect(str(tmp_path / "views.duckdb"))
+    for name in create_view_db(str(tmp_path / "views.duckdb"), 2):
+        con.sql(f"CREATE TABLE {name}Counts AS SELECT procExec, COUNT(*) AS counts FROM {name} GROUP BY procExec")
+    scorer = ShardedPairScorer(con, 2, **scorer_args)
+    scorer.submit([("view0", "view1")])
+    return con, scorer
+
+
+def test_expired_claims_are_requeued(tmp_path):
+    queue_dir = str(tmp_path / "queue")
+    con, scorer = sharded_scorer(tmp_path, queue_dir=queue_dir, num_workers=0, lease=0.2)
+    # a worker claims a task and dies without finishing it
+    dead_claim = claim_task(queue_dir)
+    os.utime(os.path.join(queue_dir, "claimed", dead_claim[0] + ".json"), (time.time() - 1, time.time() - 1))
+    worker = threading.Thread(target=run_worker, args=(queue_dir,), daemon=True)
+    worker.start()
+    try:
+        assert len(scorer.pair_similarities("view0", "view1").fetchall()) > 0
+        scorer.release("view0", "view1")
+    finally:
+        (tmp_path / "queue" / "stop").touch()
+        worker.join()
+        scorer.close()
+        con.close()
+    assert list((tmp_path / "queue" / "tasks").iterdir()) == []
+
+
+def test_wait_fails_without_workers(tmp_path):
+    con, scorer = sharded_scorer(tmp_path, num_workers=0, timeout=0.2)
+    try:
+        with pytest.raises(TimeoutError):
+            scorer.pair_similarities("view0", "view1")
+    finally:
+        scorer.close()
+
+    scorer = ShardedPairScorer(con, 2, num_workers=1)
+    for process in scorer.workers.processes:
+        process.kill()
+        process.join()
+    scorer.submit([("view0", "view1")])
+    try:
+        with pytest.raises(RuntimeError):
+            scorer.pair_similarities("view0", "view1")
+    finally:
+        scorer.close()
+        con.close()
+
+
+def test_closing_local_workers_leaves_shared_queue_running(tmp_path):
+    queue_dir = str(tmp_path / "queue")
+    remote_worker = threading.Thread(target=run_worker, args=(queue_dir,), daemon=True)
+    remote_worker.start()
+    con, scorer = sharded_scorer(tmp_path, queue_dir=queue_dir, num_workers=1)
+    try:
+        scorer.pair_similarities("view0", "view1")
+        scorer.release("view0", "view1")
+    finally:
+        scorer.close()
+    assert not (tmp_path / "queue" / "stop").exists()
+    assert remote_worker.is_alive()
+
+    # the next run on the queue is served by the remote worker alone
+    scorer = ShardedPairScorer(con, 2, queue_dir=queue_dir, num_workers=0, timeout=30)
+    scorer.submit([("view0", "view1")])
+    try:
+        assert len(scorer.pair_similarities("view0", "view1").fetchall()) > 0
+        scorer.release("view0", "view1")
+    finally:
+        (tmp_path / "queue" / "stop").touch()
+        remote_worker.join()
+        scorer.close()
+        con.close()
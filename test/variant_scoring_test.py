@@ -0,0 +1,59 @@
+import duckdb
+import numpy as np
+
+import src.strategies.db_selection as db_selection
+from src.strategies.db_mmr_selection import DBRankingSubsetSelector
+from src.util.similarity_measures import edge_set_variants, matching_similarities
+from src.util.view_tables import create_variant_tables
+
+
+def repetitive_view(num_contexts, num_variants, rng):
+    edge_sets = [rng.choice(30, size=rng.integers(1, 8), replace=False) for _ in range(num_variants)]
+    view = {}
+    for context in range(num_contexts):
+        for edge in edge_sets[rng.integers(num_variants)]:
+            view.setdefault(int(edge), []).append(context)
+    return view
+
+
+def context_matching_similarity(view, num_view, other_view, num_other_view):
+    # reference: maxima over every pair of contexts
+    edge_sets = [{edge for edge, contexts in view.items() if context in contexts} for context in range(num_view)]
+    other_edge_sets = [{edge for edge, contexts in other_view.items() if context in contexts}
+                       for context in range(num_other_view)]
+    sims = np.array([[len(e1 & e2) / len(e1 | e2) for e2 in other_edge_sets] for e1 in edge_sets])
+    return (sims.max(axis=1).sum() + sims.max(axis=0).sum()) / (num_view + num_other_view)
+
+
+def test_variant_matching_similarities_are_exact():
+    rng = np.random.default_rng(0)
+    for num_contexts, other_num_contexts in [(40, 40), (25, 60), (60, 25)]:
+        view = repetitive_view(num_contexts, 5, rng)
+        other_view = repetitive_view(other_num_contexts, 8, rng)
+        _, multiplicities = edge_set_variants(view, num_contexts)
+        assert multiplicities.sum() == num_contexts and len(multiplicities) <= 5
+        assert np.isclose(matching_similarities((view, num_contexts), (other_view, other_num_contexts)),
+                          context_matching_similarity(view, num_contexts, other_view, other_num_contexts))
+
+
+def test_variant_scores_match_process_execution_scores(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_selection, "results_path", str(tmp_path) + "/")
+    db_name = str(tmp_path / "views.duckdb")
+    rng = np.random.default_rng(1)
+    object_types = ["a", "b", "c"]
+    with duckdb.connect(db_name) as con:
+        con.sql("CREATE TABLE viewmeta(viewIdx INTEGER, objecttype STRING, numProcExecs INTEGER, numEvents INTEGER, "
+                "AvgNumEventsPerTrace FLOAT)")
+        for view_idx, name in enumerate(object_types):
+            view = repetitive_view(50, 6, rng)
+            con.sql(f"CREATE TABLE {name}(edge INTEGER, procExec INTEGER)")
+            con.executemany(f"INSERT INTO {name} VALUES (?, ?)",
+                            [(edge, context) for edge, contexts in view.items() for context in contexts])
+            con.execute("INSERT INTO viewmeta VALUES (?, ?, ?, ?, ?)", (view_idx, name, 50, 0, 0))
+        assert create_variant_tables(con, "a") == (50, 6)
+        assert con.sql("SELECT SUM(multiplicity) FROM aVariantsCounts").fetchone()[0] == 50
+
+    per_proc_exec = DBRankingSubsetSelector(db_name, object_types=object_types, file_id="procexecs",
+                                            duckdb_config={"variants": False})
+    per_variant = DBRankingSubsetSelector(db_name, object_types=object_types, file_id="variants")
+    assert np.allclose(per_proc_exec.pairwise_score, per_variant.pairwise_score)
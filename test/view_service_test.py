@@ -0,0 +1,112 @@
+import http.client
+import json
+import threading
+from datetime import timedelta
+
+import duckdb
+import numpy as np
+import pytest
+
+import src.strategies.db_selection as db_selection
+from src.benchmarks.synthetic_logs import generate_synthetic_events, generate_synthetic_rel, write_synthetic_ekg
+from src.evaluation.view_service import ViewService, ekg_rebuild, make_server
+from src.strategies.db_mmr_selection import DBRankingSubsetSelector
+from src.util.graph_source import LocalGraphSource
+from src.util.score_store import ScoreStore
+from src.util.view_tables import create_viewmeta_table, insert_view_meta
+
+
+def write_views(db_name, object_types, rng):
+    with duckdb.connect(db_name) as con:
+        create_viewmeta_table(con)
+        for view_idx, name in enumerate(object_types):
+            con.sql(f"CREATE TABLE {name}(edge INTEGER, procExec INTEGER)")
+            con.executemany(f"INSERT INTO {name} VALUES (?, ?)",
+                            [(int(edge), proc_exec) for proc_exec in range(20)
+                             for edge in rng.choice(30, size=rng.integers(1, 6), replace=False)])
+            insert_view_meta(con, view_idx, name, 20, 0, covered=rng.random(50) < 0.3)
+
+
+def request(server, method, path):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+    connection.request(method, path)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_service_answers_selections_from_resident_scores(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_selection, "results_path", str(tmp_path) + "/")
+    db_name = str(tmp_path / "views.duckdb")
+    object_types = ["a", "b", "c", "d"]
+    write_views(db_name, object_types, np.random.default_rng(0))
+
+    def rebuild():
+        with duckdb.connect(db_name) as con:
+            con.sql("DELETE FROM c WHERE procExec = 0")
+
+    service = ViewService(db_name, rebuild=rebuild, score_store=ScoreStore(db_name, str(tmp_path / "scores")))
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        expected = DBRankingSubsetSelector(db_name, object_types=object_types, file_id="expected") \
+            .select_view_indices_for_weights([0.3], 3)[0.3]
+        status, selection = request(server, "GET", "/select?k=3&weight=0.3")
+        assert status == 200
+        assert [view["object_type"] for view in selection["selected_views"]] == \
+               [object_types[view_idx] for view_idx, _, _, _ in expected]
+        assert selection["num_events_total"] == 50
+        assert len(selection["event_overlaps"]["overlaps"]) == 3
+
+        status, selections = request(server, "GET", "/select?k=2&weight=0.1,0.9")
+        assert status == 200 and [selection["weight"] for selection in selections] == [0.1, 0.9]
+        assert request(server, "GET", "/select?k=9")[0] == 400
+        assert request(server, "GET", "/select?k=2&weight=0:1:0")[0] == 400
+        assert request(server, "GET", "/select?k=2&weight=1:0:0.1")[0] == 400
+        assert [view["objecttype"] for view in request(server, "GET", "/views")[1]] == object_types
+
+        status, refreshed = request(server, "POST", "/refresh")
+        assert status == 200 and refreshed["changed_views"] == ["c"]
+        assert np.allclose(service.selector.pairwise_score,
+                           DBRankingSubsetSelector(db_name, object_types=object_types,
+                                                   file_id="rescored").pairwise_score)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize("contextdef", ["interact", "leading"])
+def test_refresh_of_unchanged_source_changes_no_views(tmp_path, monkeypatch, contextdef):
+    monkeypatch.setattr(db_selection, "results_path", str(tmp_path) + "/")
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "temp").mkdir(parents=True)
+    events, objects = generate_synthetic_events(num_events=100, num_object_types=2, objects_per_type=5)
+    source = LocalGraphSource(write_synthetic_ekg(str(tmp_path / "ekg"), events, objects,
+                                                  generate_synthetic_rel(events, objects, rel_density=0.3)))
+    db_name = str(tmp_path / "views.duckdb")
+    rebuild = ekg_rebuild(source, db_name, contextdef, None)
+    rebuild()
+
+    service = ViewService(db_name, rebuild=rebuild, score_store=ScoreStore(db_name, str(tmp_path / "scores")))
+    assert len(service.object_types) > 0
+    assert service.refresh()["changed_views"] == []
+
+
+def test_refresh_rescores_only_views_of_changed_objects(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_selection, "results_path", str(tmp_path) + "/")
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "temp").mkdir(parents=True)
+    events, objects = generate_synthetic_events(num_events=300, num_object_types=3, objects_per_type=10)
+    rel = generate_synthetic_rel(events, objects, rel_density=0.2)
+    source = LocalGraphSource(write_synthetic_ekg(str(tmp_path / "ekg"), events, objects, rel))
+    db_name = str(tmp_path / "views.duckdb")
+    rebuild = ekg_rebuild(source, db_name, "interact", None)
+    rebuild()
+    service = ViewService(db_name, rebuild=rebuild, score_store=ScoreStore(db_name, str(tmp_path / "scores")))
+
+    # a new event of a single type2 object, which takes part in the views of type2 only
+    last_id, _, last_timestamp, _ = events[-1]
+    events.append((last_id + 1, "act0", last_timestamp + timedelta(minutes=1), ["type2_3"]))
+    write_synthetic_ekg(str(tmp_path / "ekg"), events, objects, rel)
+    changed_views = service.refresh()["changed_views"]
+    assert 0 < len(changed_views) < len(service.object_types)
+    assert all("type2" in view for view in changed_views)
@@ -0,0 +1,59 @@
+import duckdb
+import numpy as np
+
+import src.strategies.db_selection as db_selection
+from src.benchmarks.synthetic_logs import generate_synthetic_events, generate_synthetic_rel, \
+    generate_synthetic_view_db, write_synthetic_ekg
+from src.util.graph_source import LocalGraphSource
+from src.util.score_store import context_table_versions
+from src.util.view_tables import get_schema_version, has_table, migrate_view_database, schema_version
+from src.view_generation.ekg_interacting_entities import compute_indices_by_interacting_entities
+from src.view_generation.ekg_leading_type import compute_indices_by_ekg_leading_types
+
+
+def column_types(con, table_name):
+    return {column[0]: column[1] for column in con.sql("DESCRIBE " + table_name).fetchall()}
+
+
+def test_migration_types_proc_execs_and_keeps_scores(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_selection, "results_path", str(tmp_path) + "/")
+    db_name = str(tmp_path / "legacy.duckdb")
+    view_names = generate_synthetic_view_db(db_name, num_views=3, num_proc_execs=50, num_edges=200,
+                                            legacy_schema=True)
+    legacy = db_selection.DBSubsetSelector(db_name, object_types=view_names, file_id="legacy",
+                                           duckdb_config={"variants": False})
+    with duckdb.connect(db_name) as con:
+        assert get_schema_version(con) == 1
+        assert column_types(con, view_names[0])["procExec"] == "VARCHAR"
+        versions = context_table_versions(con, view_names)
+
+        assert migrate_view_database(con) == view_names
+        assert get_schema_version(con) == schema_version
+        assert all(column_types(con, view_name) == {"edge": "INTEGER", "procExec": "INTEGER"}
+                   for view_name in view_names)
+        assert not has_table(con, view_names[0] + "Counts")
+        assert con.sql("SELECT COUNT(*) FROM duckdb_indexes() WHERE index_name = ?",
+                       params=[view_names[0] + "_edge_index"]).fetchone()[0] == 1
+        # stored scores of migrated tables stay valid
+        assert context_table_versions(con, view_names) == versions
+        assert migrate_view_database(con) == []
+
+    migrated = db_selection.DBSubsetSelector(db_name, object_types=view_names, file_id="migrated",
+                                             duckdb_config={"variants": False})
+    assert np.allclose(migrated.pairwise_score, legacy.pairwise_score)
+
+
+def test_generators_write_typed_context_tables(tmp_path, monkeypatch):
+    events, objects = generate_synthetic_events(num_events=100, num_object_types=2, objects_per_type=5)
+    source = LocalGraphSource(write_synthetic_ekg(str(tmp_path / "ekg"), events, objects,
+                                                  generate_synthetic_rel(events, objects, rel_density=0.3)))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "temp").mkdir(parents=True)
+    compute_indices_by_ekg_leading_types(source, str(tmp_path / "leading.duckdb"))
+    compute_indices_by_interacting_entities(source, str(tmp_path / "interact.duckdb"))
+
+    for db_name in ["leading.duckdb", "interact.duckdb"]:
+        with duckdb.connect(str(tmp_path / db_name)) as con:
+            assert get_schema_version(con) == schema_version
+            for (view_name,) in con.sql("SELECT objecttype FROM viewmeta").fetchall():
+                assert column_types(con, view_name) == {"edge": "INTEGER", "procExec": "INTEGER"}